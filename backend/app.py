@@ -10,13 +10,13 @@ import time
 import random
 import re
 import threading
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import sys
 import schedule
 import pytz
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from functools import lru_cache
+from functools import lru_cache, wraps
 import logging.config
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -34,12 +34,19 @@ except ImportError:
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
+from background_refresh import BackgroundRefresher
+from collection_jobs import CollectionJobs
+from prediction_cache import LRUCache
+from race_conditions import RaceConditionsStore, wind_direction_label
+from response_cache import ResponseCache
+
 # ===== 設定クラス =====
 class Config:
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
     API_RATE_LIMIT = os.environ.get('API_RATE_LIMIT', '100 per hour')
     CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', '300'))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))  # Redisがない場合にプロセス内で保持する応答数
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///boatrace_data.db')
     MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '5'))
@@ -49,6 +56,20 @@ class Config:
     MOBILE_OPTIMIZATION = os.environ.get('MOBILE_OPTIMIZATION', 'True').lower() == 'true'
     MAX_SCRAPING_PER_DAY = int(os.environ.get('MAX_SCRAPING_PER_DAY', '50'))  # 1日最大50回
     CACHE_ONLY_MODE = os.environ.get('CACHE_ONLY_MODE', 'False').lower() == 'true'
+    SCHEDULE_TTL = int(os.environ.get('SCHEDULE_TTL', '3600'))  # 保存済みスケジュールをバックグラウンドで再取得するまでの秒数
+    ENTRIES_TTL = int(os.environ.get('ENTRIES_TTL', '900'))  # 保存済み出走表をバックグラウンドで再取得するまでの秒数
+    REFRESH_RETRY_INTERVAL = float(os.environ.get('REFRESH_RETRY_INTERVAL', '60'))  # 同じデータの再取得を再び依頼するまでの最短秒数
+    REFRESH_MAX_RETRY_INTERVAL = float(os.environ.get('REFRESH_MAX_RETRY_INTERVAL', '3600'))  # 失敗が続いたときに延ばす再依頼間隔の上限（秒）
+    REQUEST_DATE_WINDOW_DAYS = int(os.environ.get('REQUEST_DATE_WINDOW_DAYS', '7'))  # date 指定を受け付ける今日からの前後日数
+    AI_PRELOAD = os.environ.get('AI_PRELOAD', 'True').lower() == 'true'  # 起動後にAIをバックグラウンドで先読み
+    MODEL_RELOAD_INTERVAL = int(os.environ.get('MODEL_RELOAD_INTERVAL', '60'))  # 新モデルバージョンの確認間隔（秒）
+    ONLINE_LEARNING = os.environ.get('ONLINE_LEARNING', 'False').lower() == 'true'  # 評価済みレースでの逐次学習
+    MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')  # 選手単位モデルの学習バックエンド（keras / hist_gbt）
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'auto')  # auto / tensorflow / numpy / float16 / int8（量子化版を memmap で共有）
+    INFERENCE_MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', '64'))  # 推論サーバーが1回にまとめる最大レース数
+    INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', '5'))  # 後続の要求を待つ最大時間（ミリ秒）
+    VENUE_DAY_CACHE_SIZE = int(os.environ.get('VENUE_DAY_CACHE_SIZE', '256'))  # 会場一括予想の圧縮済みレスポンスを保持する件数
+    DETERMINISTIC_RULES = os.environ.get('DETERMINISTIC_RULES', 'True').lower() == 'true'  # ルールベース予想を入力から決まるシードで抽選しキャッシュ
 
 # ===== ログ設定 =====
 LOGGING_CONFIG = {
@@ -127,6 +148,17 @@ def record_scraping():
     scraping_count_today += 1
     logger.info(f"スクレイピング実行: {scraping_count_today}/{Config.MAX_SCRAPING_PER_DAY}")
 
+def response_metadata():
+    """応答ごとに変わる共通フィールド（応答キャッシュの本文には入れず、返すときに付け直す）"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "scraping_status": {
+            "count_today": scraping_count_today,
+            "limit": Config.MAX_SCRAPING_PER_DAY,
+            "cache_only_mode": Config.CACHE_ONLY_MODE
+        }
+    }
+
 # ===== Redis・キャッシュ設定 =====
 redis_client = None
 if REDIS_AVAILABLE:
@@ -144,21 +176,90 @@ if REDIS_AVAILABLE:
         logger.warning(f"Redis接続失敗: {e}")
         redis_client = None
 
-# ===== AI初期化 =====
-print("🔍 sys.path設定完了、インポート開始...")
+# 読み取り系APIの応答キャッシュ（Redis、なければプロセス内。元テーブルの書き込みで無効化）
+response_cache = ResponseCache(redis_client, default_ttl=Config.CACHE_TIMEOUT, max_size=Config.RESPONSE_CACHE_SIZE,
+                               volatile_fields=response_metadata)
 
-try:
-    from boat_race_prediction_system import BoatRaceAI
-    print("🤖 AIモデル初期化開始...")
-    ai_model = BoatRaceAI()
-    print("✅ ディープラーニングAIモデル初期化完了")
-    AI_AVAILABLE = True
-except Exception as e:
-    print(f"❌ AI model initialization failed: {e}")
-    print(f"エラー詳細: {type(e).__name__}")
-    AI_AVAILABLE = False
+# ===== AI初期化（遅延ロード） =====
+class LazyAIModel:
+    """
+    BoatRaceAI の遅延ロードファサード
+    - 予測モジュール（NumPy推論 / TensorFlow）の読み込みを初回利用時まで遅らせる
+    - スケジュール・出走表APIはAIのロードを待たずに応答できる
+    """
+    
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+        self.available = None  # None: 未ロード / True: ロード済み / False: ロード失敗
+        self.load_seconds = None
+        self.error = None
+    
+    def get(self):
+        """BoatRaceAI を取得（未ロードならここでロード）"""
+        if self.available is None:
+            with self._lock:
+                if self.available is None:
+                    self._load()
+        return self._model
+    
+    def _load(self):
+        print("🤖 AIモデル初期化開始...")
+        started = time.time()
+        try:
+            from boat_race_prediction_system import BoatRaceAI
+            self._model = BoatRaceAI(
+                inference_backend=Config.INFERENCE_BACKEND,
+                online_learning=Config.ONLINE_LEARNING,
+                model_backend=Config.MODEL_BACKEND,
+                inference_max_batch=Config.INFERENCE_MAX_BATCH,
+                inference_max_wait_ms=Config.INFERENCE_MAX_WAIT_MS,
+                deterministic_rules=Config.DETERMINISTIC_RULES,
+                race_conditions=race_conditions
+            )
+            # 再学習で登録された新バージョンを再起動なしで取り込む
+            if Config.MODEL_RELOAD_INTERVAL > 0:
+                self._model.prediction_model.start_model_watcher(Config.MODEL_RELOAD_INTERVAL)
+            self.available = True
+            print("✅ ディープラーニングAIモデル初期化完了")
+        except Exception as e:
+            print(f"❌ AI model initialization failed: {e}")
+            print(f"エラー詳細: {type(e).__name__}")
+            self.error = str(e)
+            self.available = False
+        self.load_seconds = time.time() - started
+        print(f"🔍 AI初期化処理完了: available = {self.available} ({self.load_seconds:.2f}s)")
+    
+    def preload_in_background(self):
+        """バックグラウンドで先読み（起動はブロックしない）"""
+        threading.Thread(target=self.get, name="ai-preload", daemon=True).start()
+    
+    def status(self):
+        """システムステータス用"""
+        return {
+            "available": self.available,
+            "loaded": self._model is not None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.error,
+            "model": self._model.prediction_model.model_status() if self._model is not None else None,
+            "prediction_cache": self._model.current_predictions.stats() if self._model is not None else None,
+            "inference_server": self._model.inference_server.stats() if self._model is not None else None,
+            "rule_cache": self._model.rule_cache.stats() if self._model is not None else None,
+            "venue_knowledge": self._model.venue_knowledge.status() if self._model is not None else None,
+            "race_conditions": self._model.race_conditions.stats() if self._model is not None else None,
+            "online_learning": (
+                self._model.online_learner.status()
+                if self._model is not None and self._model.online_learner is not None else None
+            )
+        }
+    
+    def __getattr__(self, name):
+        model = self.get()
+        if model is None:
+            raise AttributeError(f"AIモデルが利用できません: {name}")
+        return getattr(model, name)
 
-print(f"🔍 AI初期化処理完了: AI_AVAILABLE = {AI_AVAILABLE}")
+ai_model = LazyAIModel()
 
 # ===== データベース管理クラス =====
 class DatabaseManager:
@@ -297,6 +398,7 @@ class DatabaseManager:
                 ))
             
             conn.commit()
+            response_cache.invalidate_tables('race_schedule')
             logger.info(f"レーススケジュール保存: {len(schedule_data)}件")
         except Exception as e:
             logger.error(f"レーススケジュール保存エラー: {e}")
@@ -333,6 +435,7 @@ class DatabaseManager:
                 ))
             
             conn.commit()
+            response_cache.invalidate_tables('race_entries')
             logger.info(f"出走表保存: {len(entries_data)}件")
         except Exception as e:
             logger.error(f"出走表保存エラー: {e}")
@@ -376,8 +479,11 @@ class OfficialBoatraceCollector:
             "21": "芦屋", "22": "福岡", "23": "唐津", "24": "大村"
         }
     
-    def get_daily_schedule(self, date_str=None):
-        """本日の全会場スケジュール取得"""
+    def get_daily_schedule(self, date_str=None, progress_callback=None):
+        """
+        本日の全会場スケジュール取得
+        - progress_callback: 会場ごとの進捗通知（parse_daily_schedule を参照）
+        """
         if not can_scrape():
             return self.get_cached_schedule(date_str)
         
@@ -396,7 +502,7 @@ class OfficialBoatraceCollector:
             response_time = time.time() - start_time
             
             if response.status_code == 200:
-                schedule_data = self.parse_daily_schedule(response.content, date_str)
+                schedule_data = self.parse_daily_schedule(response.content, date_str, progress_callback)
                 
                 # ログ記録
                 self.log_scraping(date_str, url, "success", response_time, len(schedule_data))
@@ -419,32 +525,48 @@ class OfficialBoatraceCollector:
         finally:
             time.sleep(Config.SCRAPING_DELAY)  # 5秒待機
     
-    def parse_daily_schedule(self, html_content, date_str):
-        """日次スケジュール解析"""
+    def parse_daily_schedule(self, html_content, date_str, progress_callback=None):
+        """
+        日次スケジュール解析
+        - progress_callback(venue_code, status, venue_name, race_count): 会場ごとの進捗通知
+          （開催会場を見つけた時点で全会場 'pending'、取得中 'running'、取得後 'done' / 'failed'）
+        """
+        def notify(venue_code, status, race_count=0):
+            if progress_callback is None:
+                return
+            try:
+                progress_callback(venue_code, status, self.venue_mapping.get(venue_code, f"会場{venue_code}"), race_count)
+            except Exception as e:
+                logger.warning(f"進捗通知エラー: {str(e)}")
+        
         try:
             soup = BeautifulSoup(html_content, 'html.parser')
             schedule_data = []
             
-            # 開催会場情報を取得
-            venue_elements = soup.find_all('a', href=re.compile(r'/owpc/pc/race/racelist'))
+            # 開催会場情報を取得（同じ会場へのリンクが複数あっても1回だけ取得）
+            venue_codes = []
+            for venue_element in soup.find_all('a', href=re.compile(r'/owpc/pc/race/racelist')):
+                venue_match = re.search(r'jcd=(\d{2})', venue_element.get('href') or '')
+                if venue_match and venue_match.group(1) not in venue_codes:
+                    venue_codes.append(venue_match.group(1))
+            
+            for venue_code in venue_codes:
+                notify(venue_code, 'pending')
             
-            for venue_element in venue_elements:
+            for venue_code in venue_codes:
                 try:
-                    href = venue_element.get('href')
-                    venue_match = re.search(r'jcd=(\d{2})', href)
+                    notify(venue_code, 'running')
+                    
+                    # 各会場の詳細レース情報を取得
+                    venue_races = self.get_venue_race_schedule(venue_code, date_str)
+                    schedule_data.extend(venue_races)
+                    notify(venue_code, 'done' if venue_races else 'failed', len(venue_races))
+                    
+                    time.sleep(Config.SCRAPING_DELAY)  # 会場間で待機
                     
-                    if venue_match:
-                        venue_code = venue_match.group(1)
-                        venue_name = self.venue_mapping.get(venue_code, f"会場{venue_code}")
-                        
-                        # 各会場の詳細レース情報を取得
-                        venue_races = self.get_venue_race_schedule(venue_code, date_str)
-                        schedule_data.extend(venue_races)
-                        
-                        time.sleep(Config.SCRAPING_DELAY)  # 会場間で待機
-                        
                 except Exception as e:
                     logger.warning(f"会場情報解析エラー: {str(e)}")
+                    notify(venue_code, 'failed')
                     continue
             
             return schedule_data
@@ -715,6 +837,101 @@ class OfficialBoatraceCollector:
         except:
             return random.randint(1, 100)
     
+    def get_pre_race_info(self, venue_code, race_number, date_str):
+        """直前情報（気象・水面・展示タイム）取得"""
+        if not can_scrape():
+            return None
+        
+        url = f"https://boatrace.jp/owpc/pc/race/beforeinfo?rno={race_number}&jcd={venue_code}&hd={date_str}"
+        try:
+            logger.info(f"直前情報取得: 会場{venue_code} {race_number}R")
+            
+            record_scraping()
+            start_time = time.time()
+            response = self.session.get(url, timeout=30)
+            response_time = time.time() - start_time
+            
+            if response.status_code == 200:
+                pre_race_info = self.parse_pre_race_info(response.content)
+                data_count = len(pre_race_info["exhibition_times"]) if pre_race_info else 0
+                self.log_scraping(date_str, url, "success", response_time, data_count)
+                return pre_race_info
+            else:
+                self.log_scraping(date_str, url, "error", response_time, 0, f"HTTP {response.status_code}")
+                logger.warning(f"直前情報取得失敗: {response.status_code}")
+                return None
+                
+        except Exception as e:
+            logger.error(f"直前情報取得エラー: {str(e)}")
+            self.log_scraping(date_str, url, "error", 0, 0, str(e))
+            return None
+        finally:
+            time.sleep(Config.SCRAPING_DELAY)
+    
+    def parse_pre_race_info(self, html_content):
+        """
+        直前情報解析
+        - 戻り値: {"conditions": pre_race_info の列の辞書, "exhibition_times": {艇番: 展示タイム}}
+          （気象欄がなければ None）
+        """
+        try:
+            soup = BeautifulSoup(html_content, 'html.parser')
+            weather_block = soup.find('div', class_='weather1')
+            if not weather_block:
+                logger.warning("直前情報: 気象欄が見つかりません")
+                return None
+            
+            def unit(name):
+                return weather_block.find('div', class_=f'is-{name}')
+            
+            def number(name):
+                element = unit(name)
+                data = element.find(class_='weather1_bodyUnitLabelData') if element else None
+                match = re.search(r'(\d+(?:\.\d+)?)', data.get_text()) if data else None
+                return float(match.group(1)) if match else None
+            
+            # 天候はラベル、風向はアイコンのクラス（is-wind1 .. is-wind16）
+            weather_unit = unit('weather')
+            weather_title = weather_unit.find(class_='weather1_bodyUnitLabelTitle') if weather_unit else None
+            direction_unit = unit('windDirection')
+            direction_image = direction_unit.find('p', class_='weather1_bodyUnitImage') if direction_unit else None
+            direction_match = None
+            for css_class in (direction_image.get('class', []) if direction_image else []):
+                direction_match = re.fullmatch(r'is-wind(\d+)', css_class) or direction_match
+            
+            wave_height = number('wave')
+            conditions = {
+                'weather': weather_title.get_text().strip() if weather_title else None,
+                'wind_direction': wind_direction_label(int(direction_match.group(1))) if direction_match else None,
+                'wind_speed': number('wind'),
+                'wave_height': int(wave_height) if wave_height is not None else None,
+                'temperature': number('direction'),
+                'water_temperature': number('waterTemperature')
+            }
+            
+            # 展示タイム（艇ごとの tbody の1行目、x.xx 形式のセル）
+            exhibition_times = {}
+            exhibition_table = soup.find('table', class_='is-w748')
+            for body in (exhibition_table.find_all('tbody') if exhibition_table else []):
+                row = body.find('tr')
+                cells = row.find_all('td') if row else []
+                if not cells:
+                    continue
+                boat_number = self.extract_boat_number(cells[0])
+                for cell in cells[1:]:
+                    match = re.fullmatch(r'(\d\.\d{2})', cell.get_text().strip())
+                    if match and boat_number:
+                        exhibition_times[boat_number] = float(match.group(1))
+                        break
+            
+            logger.info(f"直前情報解析完了: 風速{conditions['wind_speed']}m 波高{conditions['wave_height']}cm "
+                        f"展示{len(exhibition_times)}艇")
+            return {"conditions": conditions, "exhibition_times": exhibition_times}
+            
+        except Exception as e:
+            logger.error(f"直前情報解析エラー: {str(e)}")
+            return None
+    
     def get_cached_schedule(self, date_str):
         """キャッシュからスケジュール取得"""
         try:
@@ -749,6 +966,36 @@ class OfficialBoatraceCollector:
             logger.error(f"キャッシュスケジュール取得エラー: {str(e)}")
             return []
     
+    def _stored_at(self, query, params):
+        """保存時刻（created_at、UTC）の最新値をローカル時刻で（保存済みのデータがなければ None）"""
+        try:
+            conn = self.db_manager.get_connection()
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            result = cursor.fetchone()
+            conn.close()
+            
+            if not result or not result[0]:
+                return None
+            stored_at = datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            return stored_at.astimezone().replace(tzinfo=None)
+            
+        except Exception as e:
+            logger.error(f"保存時刻取得エラー: {str(e)}")
+            return None
+    
+    def get_schedule_updated_at(self, date_str):
+        """保存済みスケジュールの更新時刻"""
+        return self._stored_at('''
+        SELECT MAX(created_at) FROM race_schedule WHERE race_date = ?
+        ''', (date_str,))
+    
+    def get_entries_updated_at(self, venue_code, race_number, date_str):
+        """保存済み出走表の更新時刻"""
+        return self._stored_at('''
+        SELECT MAX(created_at) FROM race_entries WHERE venue_code = ? AND race_number = ? AND race_date = ?
+        ''', (venue_code, race_number, date_str))
+    
     def get_cached_race_entries(self, venue_code, race_number, date_str):
         """キャッシュから出走表取得"""
         try:
@@ -792,6 +1039,40 @@ class OfficialBoatraceCollector:
             logger.error(f"キャッシュ出走表取得エラー: {str(e)}")
             return {"status": "error", "message": str(e)}
     
+    def get_cached_venue_entries(self, venue_code, date_str):
+        """キャッシュから会場1日分の出走表を1回のクエリで取得 {レース番号: 選手のリスト}"""
+        try:
+            conn = self.db_manager.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT race_number, boat_number, racer_id, racer_name, racer_class, age, weight, region, branch
+            FROM race_entries
+            WHERE venue_code = ? AND race_date = ?
+            ORDER BY race_number, boat_number
+            ''', (venue_code, date_str))
+            
+            results = cursor.fetchall()
+            conn.close()
+            
+            entries = {}
+            for result in results:
+                entries.setdefault(result[0], []).append({
+                    'boat_number': result[1],
+                    'registration_number': result[2],
+                    'name': result[3],
+                    'class': result[4],
+                    'age': result[5],
+                    'weight': result[6],
+                    'region': result[7],
+                    'branch': result[8]
+                })
+            return entries
+            
+        except Exception as e:
+            logger.error(f"会場出走表キャッシュ取得エラー: {str(e)}")
+            return {}
+    
     def log_scraping(self, date_str, url, status, response_time, data_count, error_message=None):
         """スクレイピングログ記録"""
         try:
@@ -811,9 +1092,10 @@ class OfficialBoatraceCollector:
 
 # ===== レーススケジュール管理クラス =====
 class RaceScheduleManager:
-    def __init__(self, db_manager, data_collector):
+    def __init__(self, db_manager, data_collector, race_conditions=None):
         self.db_manager = db_manager
         self.data_collector = data_collector
+        self.race_conditions = race_conditions or RaceConditionsStore(db_manager.db_path)
         self.scheduler = None
         self.race_schedules = {}
         self.dynamic_jobs = {}
@@ -841,6 +1123,15 @@ class RaceScheduleManager:
             id="pre_race_check"
         )
         
+        # 毎日深夜3時: 会場別コース1着率の再集計
+        self.scheduler.add_job(
+            func=self.refresh_venue_knowledge,
+            trigger="cron",
+            hour=3,
+            minute=0,
+            id="venue_knowledge_refresh"
+        )
+        
         self.scheduler.start()
         logger.info("レーススケジューラー開始")
     
@@ -876,6 +1167,18 @@ class RaceScheduleManager:
         except Exception as e:
             logger.error(f"日次データ収集エラー: {str(e)}")
     
+    def refresh_venue_knowledge(self):
+        """深夜3時実行: 前日までのレース結果で会場ナレッジを更新"""
+        try:
+            model = ai_model.get()
+            if model is None:
+                logger.warning("会場ナレッジ更新: AIモデル未ロードのためスキップ")
+                return
+            status = model.venue_knowledge.refresh()
+            logger.info(f"会場ナレッジ更新完了: {status}")
+        except Exception as e:
+            logger.error(f"会場ナレッジ更新エラー: {str(e)}")
+    
     def schedule_pre_race_updates(self, date_str):
         """直前情報更新スケジューリング"""
         try:
@@ -912,16 +1215,49 @@ class RaceScheduleManager:
             logger.error(f"直前情報スケジューリングエラー: {str(e)}")
     
     def update_pre_race_info(self, venue_code, race_number, date_str):
-        """直前情報更新（レース開始1時間前実行）"""
+        """
+        直前情報更新（レース開始1時間前実行）
+        - 気象・水面・展示タイムを取得して保存し、値が変わったレースだけルールベース予想を再評価
+        - 戻り値: 直前情報が変わったか
+        """
         logger.info(f"直前情報更新: 会場{venue_code} {race_number}R")
         
         try:
-            # 展示タイム・気象情報などを取得
-            # 実際には追加のスクレイピングが必要
-            pass
+            pre_race_info = self.data_collector.get_pre_race_info(venue_code, race_number, date_str)
+            if not pre_race_info:
+                logger.warning(f"直前情報なし: 会場{venue_code} {race_number}R")
+                return False
+            
+            race_id = f"{date_str}{venue_code}{int(race_number):02d}"
+            changed = self.race_conditions.save(
+                race_id, venue_code, race_number, date_str,
+                pre_race_info["conditions"], pre_race_info["exhibition_times"]
+            )
+            if not changed:
+                logger.info(f"直前情報に変化なし: {race_id}")
+                return False
+            
+            self.rescore_race(venue_code, race_number, date_str, race_id)
+            return True
             
         except Exception as e:
             logger.error(f"直前情報更新エラー: {str(e)}")
+            return False
+    
+    def rescore_race(self, venue_code, race_number, date_str, race_id):
+        """直前情報の変わったレースのルールベース予想を再計算（キャッシュを新しい気象条件の結果にする）"""
+        try:
+            model = ai_model.get()
+            if model is None:
+                return
+            entries = self.data_collector.get_cached_race_entries(venue_code, race_number, date_str)
+            if entries.get("status") != "success" or not entries.get("racers"):
+                logger.info(f"再評価スキップ（出走表なし）: {race_id}")
+                return
+            model.get_comprehensive_prediction(entries["racers"], venue_code, race_id=race_id)
+            logger.info(f"直前情報でルールベース予想を再評価: {race_id}")
+        except Exception as e:
+            logger.error(f"ルールベース予想再評価エラー: {str(e)}")
     
     def check_pre_race_updates(self):
         """1時間ごと実行: 直前情報更新が必要なレースをチェック"""
@@ -956,7 +1292,13 @@ class RaceScheduleManager:
 # ===== グローバルインスタンス =====
 db_manager = DatabaseManager()
 data_collector = OfficialBoatraceCollector(db_manager)
-schedule_manager = RaceScheduleManager(db_manager, data_collector)
+race_conditions = RaceConditionsStore(db_manager.db_path)
+venue_day_cache = LRUCache(max_size=Config.VENUE_DAY_CACHE_SIZE)  # 入力ハッシュ -> 会場一括予想の本文（JSON / gzip）
+background_refresher = BackgroundRefresher(
+    min_interval=Config.REFRESH_RETRY_INTERVAL, max_interval=Config.REFRESH_MAX_RETRY_INTERVAL
+)  # 古くなったデータの再取得（リクエスト外。失敗が続くキーは間隔を延ばす）
+collection_jobs = CollectionJobs(db_manager.db_path, background_refresher)  # 時間のかかる収集のジョブ（実行は上のワーカー）
+schedule_manager = RaceScheduleManager(db_manager, data_collector, race_conditions)
 
 # ===== Flask アプリ初期化 =====
 app = Flask(__name__)
@@ -975,16 +1317,11 @@ limiter = Limiter(
 # ===== レスポンス標準化関数 =====
 def create_response(data=None, error=None, status_code=200, message=None):
     """レスポンス標準化"""
-    response = {
-        "timestamp": datetime.now().isoformat(),
-        "status_code": status_code,
-        "success": error is None,
-        "scraping_status": {
-            "count_today": scraping_count_today,
-            "limit": Config.MAX_SCRAPING_PER_DAY,
-            "cache_only_mode": Config.CACHE_ONLY_MODE
-        }
-    }
+    response = dict(
+        response_metadata(),
+        status_code=status_code,
+        success=error is None
+    )
     
     if data is not None:
         response["data"] = data
@@ -995,6 +1332,123 @@ def create_response(data=None, error=None, status_code=200, message=None):
         
     return jsonify(response), status_code
 
+def stale_while_revalidate(ttl, locate, retry_after=10):
+    """
+    保存済みデータを待たずに返し、古ければバックグラウンドで再取得するデコレーター
+    - locate(**ビュー引数) -> (キー, 保存時刻 or None, 再取得関数)。None ならそのままビューへ（入力エラーなど）
+    - 保存時刻から ttl 秒を過ぎていれば再取得を依頼（応答は保存済みのデータ）
+    - 保存済みのデータがなければ再取得を依頼して 202（Retry-After 秒後に再要求）
+    - 応答ヘッダー: X-Data-Updated-At / X-Data-Age / X-Data-Stale / X-Refresh-Pending
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            located = locate(**kwargs)
+            if located is None:
+                return view(*args, **kwargs)
+            key, updated_at, refresh = located
+            
+            if updated_at is None:
+                if can_scrape() and background_refresher.trigger(key, refresh):
+                    response = make_response(create_response(
+                        data={"updated_at": None, "refreshing": True},
+                        status_code=202,
+                        message="データを取得中です。しばらくしてから再度お試しください"
+                    ))
+                    response.headers['Retry-After'] = str(retry_after)
+                    response.headers['X-Refresh-Pending'] = 'true'
+                    return response
+                return view(*args, **kwargs)
+            
+            age = max(0.0, (datetime.now() - updated_at).total_seconds())
+            stale = age > ttl
+            pending = background_refresher.pending(key)
+            if stale and not pending and can_scrape():
+                pending = background_refresher.trigger(key, refresh)
+            
+            response = make_response(view(*args, **kwargs))
+            response.headers['X-Data-Updated-At'] = updated_at.isoformat()
+            response.headers['X-Data-Age'] = str(int(age))
+            response.headers['X-Data-Stale'] = 'true' if stale else 'false'
+            response.headers['X-Refresh-Pending'] = 'true' if pending else 'false'
+            return response
+        
+        return wrapper
+    
+    return decorator
+
+def parse_request_date(date_str):
+    """
+    date の検証（YYYYMMDD で今日から前後 REQUEST_DATE_WINDOW_DAYS 日以内なら date_str、それ以外は None）
+    - 範囲外の日付で公式サイトへの取得やキャッシュのキーを増やさない
+    """
+    if not isinstance(date_str, str) or len(date_str) != 8 or not date_str.isdigit():
+        return None
+    try:
+        date = datetime.strptime(date_str, "%Y%m%d").date()
+    except ValueError:
+        return None
+    if abs((date - datetime.now().date()).days) > Config.REQUEST_DATE_WINDOW_DAYS:
+        return None
+    return date_str
+
+def invalid_date_response():
+    """date が不正なときの 400"""
+    return create_response(
+        error="無効な日付です",
+        status_code=400,
+        message=f"date は今日から前後{Config.REQUEST_DATE_WINDOW_DAYS}日以内の YYYYMMDD で指定してください"
+    )
+
+def _collect_schedule(progress_callback, date_str):
+    return data_collector.get_daily_schedule(date_str, progress_callback)
+
+def submit_schedule_job(date_str):
+    """全会場スケジュール取得ジョブを登録（同じ日付のジョブが待機中・実行中ならそれを返す）"""
+    return collection_jobs.submit('daily_schedule', {'date_str': date_str}, _collect_schedule)
+
+def _refresh_and_verify(refresh, get_updated_at):
+    """
+    再取得して保存時刻が進んだかを確かめる（バックグラウンド更新のワーカーで実行）
+    - 収集処理は取得に失敗しても保存済みのデータを返すため、保存時刻が進まなければ例外にする
+      （失敗としてそのキーの再依頼間隔が延びる）
+    """
+    before = get_updated_at()
+    refresh()
+    after = get_updated_at()
+    if after is None or (before is not None and after <= before):
+        raise RuntimeError("データが更新されませんでした")
+
+def _locate_daily_schedule():
+    """日次スケジュールの保存時刻と再取得処理（再取得は収集ジョブとして記録し、進捗を参照できるようにする）"""
+    date_str = parse_request_date(request.args.get('date', datetime.now().strftime("%Y%m%d")))
+    if date_str is None:
+        return None
+    return (
+        f"schedule:{date_str}",
+        data_collector.get_schedule_updated_at(date_str),
+        lambda: _refresh_and_verify(
+            lambda: collection_jobs.run('daily_schedule', {'date_str': date_str}, _collect_schedule),
+            lambda: data_collector.get_schedule_updated_at(date_str)
+        )
+    )
+
+def _locate_race_entries(venue_code, race_number):
+    """出走表の保存時刻と再取得処理（会場コード・レース番号・日付が不正ならビューの検証に任せる）"""
+    if venue_code not in [f"{i:02d}" for i in range(1, 25)] or not (1 <= race_number <= 12):
+        return None
+    date_str = parse_request_date(request.args.get('date', datetime.now().strftime("%Y%m%d")))
+    if date_str is None:
+        return None
+    return (
+        f"entries:{date_str}:{venue_code}:{race_number}",
+        data_collector.get_entries_updated_at(venue_code, race_number, date_str),
+        lambda: _refresh_and_verify(
+            lambda: data_collector.get_race_entries(venue_code, race_number, date_str),
+            lambda: data_collector.get_entries_updated_at(venue_code, race_number, date_str)
+        )
+    )
+
 # ===== リクエスト処理フック =====
 @app.before_request
 def before_request():
@@ -1082,7 +1536,7 @@ def index():
         "service": "WAVE PREDICTOR - 正式スクレイピング対応版",
         "version": "3.0.0",
         "status": "running",
-        "ai_available": AI_AVAILABLE,
+        "ai_available": ai_model.available,
         "scraping_status": {
             "daily_count": scraping_count_today,
             "daily_limit": Config.MAX_SCRAPING_PER_DAY,
@@ -1122,15 +1576,23 @@ def test():
 # ===== 正式データ取得API =====
 @app.route('/api/daily-schedule', methods=['GET'])
 @limiter.limit("30 per minute")
+@stale_while_revalidate(Config.SCHEDULE_TTL, _locate_daily_schedule, retry_after=60)
+@response_cache.cached(['race_schedule'])
 def get_daily_schedule():
-    """本日の全会場スケジュール取得"""
+    """
+    本日の全会場スケジュール取得
+    - 保存済みのスケジュールを返す（古ければバックグラウンドで再取得）
+    """
     try:
-        date_str = request.args.get('date', datetime.now().strftime("%Y%m%d"))
+        date_str = parse_request_date(request.args.get('date', datetime.now().strftime("%Y%m%d")))
+        if date_str is None:
+            return invalid_date_response()
         
         logger.info(f"日次スケジュール取得リクエスト: {date_str}")
         
-        # スケジュールデータ取得
-        schedule_data = data_collector.get_daily_schedule(date_str)
+        # 保存済みスケジュール（スクレイピングはバックグラウンド更新で行う）
+        schedule_data = data_collector.get_cached_schedule(date_str)
+        updated_at = data_collector.get_schedule_updated_at(date_str)
         
         if schedule_data:
             # 会場別にグループ化
@@ -1155,7 +1617,9 @@ def get_daily_schedule():
                     "date": date_str,
                     "venues": venues,
                     "total_venues": len(venues),
-                    "total_races": len(schedule_data)
+                    "total_races": len(schedule_data),
+                    "data_source": "cache",
+                    "updated_at": updated_at.isoformat() if updated_at else None
                 },
                 message="正式スケジュールデータ取得完了"
             )
@@ -1172,8 +1636,13 @@ def get_daily_schedule():
 
 @app.route('/api/race-entries/<venue_code>/<int:race_number>', methods=['GET'])
 @limiter.limit("20 per minute")
+@stale_while_revalidate(Config.ENTRIES_TTL, _locate_race_entries)
+@response_cache.cached(['race_entries'])
 def get_race_entries_api(venue_code, race_number):
-    """正式出走表取得API"""
+    """
+    正式出走表取得API
+    - 保存済みの出走表を返す（古ければバックグラウンドで再取得）
+    """
     try:
         date_str = request.args.get('date', datetime.now().strftime("%Y%m%d"))
         
@@ -1191,11 +1660,16 @@ def get_race_entries_api(venue_code, race_number):
                 status_code=400,
                 message="レース番号は1-12の範囲で指定してください"
             )
-        
+
+        date_str = parse_request_date(date_str)
+        if date_str is None:
+            return invalid_date_response()
+
         logger.info(f"正式出走表取得: 会場{venue_code} {race_number}R {date_str}")
         
-        # 出走表取得
-        entries_result = data_collector.get_race_entries(venue_code, race_number, date_str)
+        # 保存済み出走表（スクレイピングはバックグラウンド更新で行う）
+        entries_result = data_collector.get_cached_race_entries(venue_code, race_number, date_str)
+        updated_at = data_collector.get_entries_updated_at(venue_code, race_number, date_str)
         
         if entries_result and entries_result.get("status") == "success":
             venue_name = data_collector.venue_mapping.get(venue_code, f"会場{venue_code}")
@@ -1206,7 +1680,8 @@ def get_race_entries_api(venue_code, race_number):
                 "race_number": race_number,
                 "race_date": date_str,
                 "racer_extraction": entries_result,
-                "data_source": "official_scraping" if can_scrape() else "cache",
+                "data_source": "cache",
+                "updated_at": updated_at.isoformat() if updated_at else None,
                 "mobile_optimized": hasattr(g, 'is_mobile') and g.is_mobile
             }
             
@@ -1253,7 +1728,8 @@ def get_system_status():
         system_data = {
             "system_status": "running",
             "version": "3.0.0",
-            "ai_available": AI_AVAILABLE,
+            "ai_available": ai_model.available,
+            "ai_model": ai_model.status(),
             "uptime": {
                 "seconds": uptime,
                 "formatted": str(timedelta(seconds=int(uptime)))
@@ -1270,7 +1746,11 @@ def get_system_status():
                 "total_requests": request_count,
                 "error_count": error_count,
                 "avg_response_time": round(avg_response_time, 3),
-                "success_rate": (request_count - error_count) / request_count if request_count > 0 else 0
+                "success_rate": (request_count - error_count) / request_count if request_count > 0 else 0,
+                "venue_day_cache": venue_day_cache.stats(),
+                "response_cache": response_cache.stats(),
+                "background_refresh": background_refresher.stats(),
+                "collection_jobs": collection_jobs.stats()
             },
             "features": {
                 "official_scraping": True,
@@ -1363,6 +1843,71 @@ def get_scraping_status():
         logger.error(f"スクレイピング状況取得エラー: {str(e)}")
         return create_response(error=str(e), status_code=500)
 
+# ===== 収集ジョブAPI =====
+@app.route('/api/jobs/daily-schedule', methods=['POST'])
+@limiter.limit("10 per minute")
+def create_daily_schedule_job():
+    """
+    全会場スケジュール取得ジョブの開始
+    - すぐに 202 とジョブIDを返し、取得はバックグラウンドで行う（進捗は /api/jobs/<job_id>）
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        date_str = parse_request_date(data.get('date') or request.args.get('date') or datetime.now().strftime("%Y%m%d"))
+        if date_str is None:
+            return invalid_date_response()
+        
+        if not can_scrape():
+            return create_response(
+                error="スクレイピング制限中のため収集ジョブを開始できません",
+                status_code=503,
+                message="保存済みのデータは /api/daily-schedule で参照できます"
+            )
+        
+        job, created = submit_schedule_job(date_str)
+        status_url = f"/api/jobs/{job['job_id']}"
+        response = make_response(create_response(
+            data=dict(job, created=created, status_url=status_url),
+            status_code=202,
+            message="収集ジョブを受け付けました" if created else "同じ収集ジョブを実行中です"
+        ))
+        response.headers['Location'] = status_url
+        return response
+        
+    except Exception as e:
+        logger.error(f"収集ジョブ登録エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@limiter.limit("120 per minute")
+def get_collection_job(job_id):
+    """収集ジョブの状態と会場ごとの進捗"""
+    try:
+        job = collection_jobs.get(job_id)
+        if job is None:
+            return create_response(error="ジョブが見つかりません", status_code=404)
+        
+        response = make_response(create_response(data=job))
+        response.headers['Cache-Control'] = 'no-store'
+        if job['status'] in ('queued', 'running'):
+            response.headers['Retry-After'] = '5'
+        return response
+        
+    except Exception as e:
+        logger.error(f"収集ジョブ取得エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@app.route('/api/jobs', methods=['GET'])
+@limiter.limit("30 per minute")
+def list_collection_jobs():
+    """最近の収集ジョブ一覧"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        return create_response(data={"jobs": collection_jobs.recent(limit)})
+    except Exception as e:
+        logger.error(f"収集ジョブ一覧取得エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
 # ===== 緊急モード切替API =====
 @app.route('/api/emergency/cache-only', methods=['POST'])
 @limiter.limit("5 per minute")
@@ -1390,6 +1935,71 @@ def toggle_cache_only_mode():
         logger.error(f"緊急モード切替エラー: {str(e)}")
         return create_response(error=str(e), status_code=500)
 
+# ===== モデルバージョン管理API =====
+@app.route('/api/models', methods=['GET'])
+@limiter.limit("30 per minute")
+def list_model_versions():
+    """登録済みモデルバージョン一覧"""
+    try:
+        model = ai_model.get()
+        if model is None:
+            return create_response(error="AIモデルが利用できません", status_code=503)
+        
+        prediction_model = model.prediction_model
+        return create_response(data={
+            "active": prediction_model.model_status(),
+            "versions": prediction_model.registry.list_versions()
+        })
+        
+    except Exception as e:
+        logger.error(f"モデル一覧取得エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@app.route('/api/models/activate', methods=['POST'])
+@limiter.limit("5 per minute")
+def activate_model_version():
+    """指定バージョンへの切り替え"""
+    try:
+        data = request.get_json() or {}
+        version = data.get('version')
+        if not version:
+            return create_response(error="version を指定してください", status_code=400)
+        
+        model = ai_model.get()
+        if model is None:
+            return create_response(error="AIモデルが利用できません", status_code=503)
+        
+        active_version = model.prediction_model.activate_version(version)
+        logger.warning(f"モデルバージョン切り替え: {active_version}")
+        
+        return create_response(data=model.prediction_model.model_status(), message=f"モデルを {active_version} に切り替えました")
+        
+    except ValueError as e:
+        return create_response(error=str(e), status_code=400)
+    except Exception as e:
+        logger.error(f"モデル切り替えエラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@app.route('/api/models/rollback', methods=['POST'])
+@limiter.limit("5 per minute")
+def rollback_model_version():
+    """直前のモデルバージョンへのロールバック"""
+    try:
+        model = ai_model.get()
+        if model is None:
+            return create_response(error="AIモデルが利用できません", status_code=503)
+        
+        active_version = model.prediction_model.rollback()
+        logger.warning(f"モデルロールバック: {active_version}")
+        
+        return create_response(data=model.prediction_model.model_status(), message=f"モデルを {active_version} にロールバックしました")
+        
+    except ValueError as e:
+        return create_response(error=str(e), status_code=400)
+    except Exception as e:
+        logger.error(f"モデルロールバックエラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
 # ===== レガシーエンドポイント（互換性維持） =====
 @app.route('/api/real-data-test', methods=['GET'])
 @limiter.limit("20 per minute")
@@ -1399,6 +2009,7 @@ def real_data_test():
 
 @app.route('/api/races/today', methods=['GET'])
 @limiter.limit("30 per minute")
+@response_cache.cached(['race_schedule'])
 def get_today_races():
     """今日のレース一覧（簡易版）"""
     try:
@@ -1436,19 +2047,174 @@ def get_today_races():
 @limiter.limit("20 per minute")
 def get_race_prediction(race_id):
     try:
-        if not AI_AVAILABLE:
+        model = ai_model.get()
+        if model is None:
             return create_response(data=get_mock_prediction(race_id))
             
-        prediction = ai_model.get_race_prediction(race_id)
+        prediction = model.get_race_prediction(race_id)
         return create_response(data=prediction)
         
     except Exception as e:
         logger.error(f"AI予想エラー: {str(e)}")
         return create_response(data=get_mock_prediction(race_id))
 
+@app.route('/api/prediction/<race_id>/combinations', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_race_combinations(race_id):
+    """全券種の組み合わせ確率表（2連単30・2連複15・3連単120・3連複20）"""
+    try:
+        from bet_combinations import BET_TYPE_NAMES, BET_TYPES, prediction_tables
+        
+        started = time.time()
+        bet_types = [t for t in request.args.get('bet_types', ','.join(BET_TYPES)).split(',') if t in BET_TYPES]
+        if not bet_types:
+            return create_response(error=f"bet_types は {', '.join(BET_TYPES)} から指定してください", status_code=400)
+        top = request.args.get('top', type=int)
+        
+        combinations = None
+        data_source = "ai_model"
+        model = ai_model.get()
+        if model is not None:
+            try:
+                combinations = model.get_race_combinations(race_id, bet_types=bet_types, top=top)
+            except Exception as e:
+                logger.error(f"AI予想エラー: {str(e)}")
+        
+        if combinations is None:
+            # AIが使えない場合はモック予想から計算
+            combinations = {
+                "race_id": race_id,
+                "bet_type_names": {bet_type: BET_TYPE_NAMES[bet_type] for bet_type in bet_types},
+                "combinations": prediction_tables([get_mock_prediction(race_id)], bet_types=bet_types, top=top)[race_id]
+            }
+            data_source = "mock"
+        
+        combinations["data_source"] = data_source
+        combinations["compute_ms"] = round((time.time() - started) * 1000, 2)
+        return create_response(data=combinations)
+        
+    except Exception as e:
+        logger.error(f"組み合わせ確率エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@app.route('/api/venue-day/<venue_code>', methods=['GET'])
+@limiter.limit("20 per minute")
+def get_venue_day(venue_code):
+    """
+    会場1日分（1R-12R）の出走表・直前情報・ルールベース予想・モデル予想を1回の応答で返す
+    - 出走表はキャッシュ（DB）から1回のクエリで読み、予想は全レースまとめて計算
+    - 出走表・直前情報・特徴量の元データの世代・モデルバージョン・会場ナレッジが前回と同じなら、
+      圧縮済みの本文をそのまま返す（モデル予想が欠けたレースがある本文はキャッシュしない）
+    - Accept-Encoding に gzip があれば gzip で返す
+    """
+    try:
+        import gzip
+        from feature_schema import hash_inputs
+        
+        date_str = request.args.get('date', datetime.now().strftime("%Y%m%d"))
+        if venue_code not in [f"{i:02d}" for i in range(1, 25)]:
+            return create_response(
+                error="無効な会場コードです",
+                status_code=400,
+                message="会場コードは01-24の範囲で指定してください"
+            )
+        
+        started = time.time()
+        entries = data_collector.get_cached_venue_entries(venue_code, date_str)
+        races = [
+            {
+                "race_id": f"{date_str}{venue_code}{race_number:02d}",
+                "race_number": race_number,
+                "venue_code": venue_code,
+                "racers": entries.get(race_number, [])
+            }
+            for race_number in range(1, 13)
+        ]
+        conditions = race_conditions.get_many([race["race_id"] for race in races])
+        model = ai_model.get()
+        
+        cache_key = hash_inputs({
+            "venue_code": venue_code,
+            "race_date": date_str,
+            "entries": entries,
+            "conditions": {race_id: [c["conditions"], c["exhibition_times"]] for race_id, c in conditions.items()},
+            "model_version": model.prediction_model.model_version if model is not None else None,
+            # 選手成績（race_results）などの更新で特徴量が変わるため、元データの世代もキーに含める
+            "feature_data": model.feature_extractor.data_generation() if model is not None else None,
+            "venue_knowledge": model.venue_knowledge.status()["updated_at"] if model is not None else None
+        })
+        
+        cached = venue_day_cache.get(cache_key)
+        if cached is None:
+            predictions = model.get_venue_day_predictions(races) if model is not None else {}
+            
+            race_data = []
+            for race in races:
+                race_conditions_data = conditions.get(race["race_id"])
+                prediction = predictions.get(race["race_id"], {})
+                race_data.append({
+                    "race_id": race["race_id"],
+                    "race_number": race["race_number"],
+                    "racers": race["racers"],
+                    "pre_race_info": {
+                        "weather": race_conditions_data["weather"],
+                        "exhibition_times": race_conditions_data["exhibition_times"]
+                    } if race_conditions_data else None,
+                    "rule_prediction": prediction.get("rule_prediction"),
+                    "model_prediction": prediction.get("model_prediction")
+                })
+            
+            payload = {
+                "timestamp": datetime.now().isoformat(),
+                "status_code": 200,
+                "success": True,
+                "data": {
+                    "venue_code": venue_code,
+                    "venue_name": data_collector.venue_mapping.get(venue_code, f"会場{venue_code}"),
+                    "race_date": date_str,
+                    "race_count": sum(1 for race in races if race["racers"]),
+                    "races": race_data,
+                    "data_source": "cache",
+                    "ai_available": model is not None,
+                    "compute_ms": round((time.time() - started) * 1000, 2)
+                },
+                "message": "会場一括予想取得完了"
+            }
+            body = app.json.dumps(payload).encode("utf-8")
+            cached = {"json": body, "gzip": gzip.compress(body, compresslevel=6)}
+            # 特徴抽出・推論に失敗したレースがあれば次のリクエストで計算し直す
+            complete = model is None or all(
+                race["model_prediction"] is not None for race in race_data if race["racers"]
+            )
+            if complete:
+                venue_day_cache.put(cache_key, cached)
+        
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+        response = make_response(cached["gzip"] if use_gzip else cached["json"])
+        response.mimetype = 'application/json'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+        
+    except Exception as e:
+        logger.error(f"会場一括予想エラー: {str(e)}")
+        return create_response(error=str(e), status_code=500)
+
+@lru_cache(maxsize=8)
+def _simulated_risk_analysis(rank_probabilities):
+    """着順分布（艇番順のタプル）からシミュレーションで risk_analysis を算出"""
+    from race_simulator import RaceSimulator, attach_risk_analysis
+    
+    prediction = {"predictions": [
+        {"boat_number": i + 1, "rank_probabilities": list(probs)} for i, probs in enumerate(rank_probabilities)
+    ]}
+    attach_risk_analysis([prediction], RaceSimulator(n_draws=200_000, seed=0))
+    return prediction.get("risk_analysis")
+
 def get_mock_prediction(race_id):
     """改良版モック予想データ"""
-    return {
+    prediction = {
         "race_id": race_id,
         "predictions": [
             {"racer_id": 1, "boat_number": 1, "predicted_rank": 1, "rank_probabilities": [0.35, 0.25, 0.20, 0.12, 0.05, 0.03], "expected_value": 1.2, "confidence": 0.85},
@@ -1463,13 +2229,13 @@ def get_mock_prediction(race_id):
             "quinella": {"combination": [1, 3], "confidence": 0.78},
             "exacta": {"combination": [1, 3], "confidence": 0.72},
             "trio": {"combination": [1, 3, 2], "confidence": 0.68}
-        },
-        "risk_analysis": {
-            "stability_score": 78,
-            "upset_probability": 22,
-            "reliability": "高"
         }
     }
+    
+    # 固定値ではなく着順分布から安定度・荒れ確率を算出（同じ分布なら結果はキャッシュ）
+    rank_probabilities = tuple(tuple(p["rank_probabilities"]) for p in prediction["predictions"])
+    prediction["risk_analysis"] = dict(_simulated_risk_analysis(rank_probabilities))
+    return prediction
 
 # ===== アプリケーション初期化 =====
 def initialize_app():
@@ -1485,6 +2251,10 @@ def initialize_app():
         schedule_manager.start_scheduled_tasks()
         logger.info("✅ レーススケジューラー開始完了")
         
+        # AIモデルはリクエスト処理を妨げないようバックグラウンドで先読み
+        if Config.AI_PRELOAD:
+            ai_model.preload_in_background()
+        
         logger.info("=== アプリケーション初期化完了 ===")
         
     except Exception as e:
@@ -1498,7 +2268,7 @@ def main():
         initialize_app()
         
         # AI初期化（必要に応じて）
-        if AI_AVAILABLE:
+        if ai_model.available:
             logger.info("AI学習システム準備完了")
         
         # サーバー起動
@@ -0,0 +1,103 @@
+"""
+バックグラウンド更新
+- 保存済みのデータが古くなったとき、リクエストを待たせずに専用スレッドで再取得する
+  （スクレイピングとその間の待機はこのスレッドで行い、APIは保存済みのデータをすぐ返す）
+- 同じキーの更新は同時に1件だけ。実行中なら新たに積まず「更新中」として扱う
+- 同じキーは min_interval 秒の間は再実行しない（スクレイピング回数の保護）
+- 失敗したキーは連続失敗ごとに間隔を倍にする（max_interval まで。成功すれば元に戻す）
+- ワーカーは1本（公式サイトへのアクセスを直列にする）
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger('boatrace')
+
+DEFAULT_MIN_INTERVAL = 60.0
+DEFAULT_MAX_INTERVAL = 3600.0
+
+
+class BackgroundRefresher:
+    """
+    キー単位で重複を除いたバックグラウンド更新
+    - trigger(key, func, *args): 更新を依頼（更新中・依頼済みなら True、間隔制限で見送れば False）
+    - pending(key): 更新待ち・実行中か
+    - func が例外を出せば失敗として、そのキーの再実行間隔を延ばす
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL, name="background-refresh"):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = None
+        self._pending = set()
+        self._last_started = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self.stats_counts = {"triggered": 0, "throttled": 0, "succeeded": 0, "failed": 0}
+
+    def _start(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._worker.start()
+
+    def trigger(self, key, func, *args):
+        """更新を依頼"""
+        with self._lock:
+            if key in self._pending:
+                return True
+            last_started = self._last_started.get(key)
+            if last_started is not None and time.time() - last_started < self._interval(key):
+                self.stats_counts["throttled"] += 1
+                return False
+            self._pending.add(key)
+            self._last_started[key] = time.time()
+            self.stats_counts["triggered"] += 1
+            self._start()
+        self._queue.put((key, func, args))
+        logger.info(f"バックグラウンド更新依頼: {key}")
+        return True
+
+    def _interval(self, key):
+        """キーの再実行間隔（連続失敗 n 回で min_interval * 2^n、上限 max_interval）"""
+        failures = self._failures.get(key, 0)
+        return min(self.min_interval * 2 ** min(failures, 32), self.max_interval)
+
+    def pending(self, key):
+        """更新待ち・実行中か"""
+        with self._lock:
+            return key in self._pending
+
+    def _run(self):
+        while True:
+            key, func, args = self._queue.get()
+            started = time.time()
+            try:
+                func(*args)
+                outcome = "succeeded"
+                logger.info(f"バックグラウンド更新完了: {key} ({time.time() - started:.1f}s)")
+            except Exception as e:
+                outcome = "failed"
+                logger.error(f"バックグラウンド更新エラー: {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+            with self._lock:
+                self.stats_counts[outcome] += 1
+                if outcome == "failed":
+                    self._failures[key] = self._failures.get(key, 0) + 1
+                    logger.info(f"バックグラウンド更新 再依頼まで{self._interval(key):.0f}秒: {key}")
+                else:
+                    self._failures.pop(key, None)
+
+    def stats(self):
+        """システムステータス用"""
+        with self._lock:
+            counts = dict(self.stats_counts)
+            pending = sorted(self._pending)
+            backoff = {key: self._interval(key) for key in self._failures}
+        return dict(counts, pending=pending, queue_depth=self._queue.qsize(), min_interval=self.min_interval,
+                    max_interval=self.max_interval, backoff=backoff)
@@ -0,0 +1,302 @@
+"""
+ウォークフォワード・バックテスト
+- race_results のある日を1日ずつ再生: その日より前の成績だけで特徴量を作り（as_of）、予測し、結果と照合
+- 日ごとの処理はプロセスプールで並列実行（各ワーカーはモデルを1回だけ読み込み、NumPyエンジンで推論）
+- ワーカーはレースごとの着順を配列で返し、的中判定は全レース分をまとめてベクトル演算で計算
+  （判定基準は BoatRacePredictionModel.evaluate_prediction と同じ）
+- 評価するモデルは固定（--version）。リークを避けるには期間の開始前に学習したバージョンを指定する
+
+使い方:
+    python backtest.py --db boatrace_data.db --start 20240101 --end 20241231
+    python backtest.py --version 20240101-000000 --workers 8 --output backtest.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+logger = logging.getLogger("BoatraceAI")
+
+N_BOATS = 6
+
+# ワーカープロセスごとの特徴抽出器・予測モデル（_init_worker で作成）
+_worker = {}
+
+
+def backtest_dates(db_path, start_date=None, end_date=None):
+    """結果のある日（YYYYMMDD）の一覧"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT DISTINCT race_date
+    FROM race_results
+    WHERE race_date >= ? AND race_date <= ?
+    ORDER BY race_date
+    ''', (start_date or "00000000", end_date or "99999999"))
+    dates = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return dates
+
+
+def _day_results(db_path, date):
+    """指定日の全レースの着順 {race_id: {艇番: 着順}}（1回のクエリで取得）"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT race_id, boat_number, rank
+    FROM race_results
+    WHERE race_date = ?
+    ORDER BY race_id
+    ''', (date,))
+    results = {}
+    for race_id, boat_number, rank in cursor.fetchall():
+        results.setdefault(race_id, {})[boat_number] = rank
+    conn.close()
+    return results
+
+
+def _init_worker(db_path, model_dir, version, inference_backend, model_backend, log_level):
+    """ワーカー初期化: 特徴抽出器と予測モデルを1回だけ作成"""
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+    from boat_race_prediction_system import BoatRaceFeatureExtractor, BoatRacePredictionModel
+    from venue_knowledge import VenueKnowledgeBase
+
+    # レース・選手ごとの INFO ログはワーカー数 x 日数分になるため抑える
+    logging.getLogger("BoatraceAI").setLevel(log_level)
+
+    prediction_model = BoatRacePredictionModel(
+        model_dir=model_dir, inference_backend=inference_backend, model_backend=model_backend
+    )
+    if version is not None and prediction_model.model_version != version:
+        if not prediction_model.activate_version(version):
+            raise RuntimeError(f"モデルバージョンを読み込めません: {version}")
+
+    _worker["db_path"] = db_path
+    _worker["feature_extractor"] = BoatRaceFeatureExtractor(db_path)
+    _worker["prediction_model"] = prediction_model
+    _worker["venue_knowledge"] = VenueKnowledgeBase(db_path)
+
+
+def run_day(date):
+    """
+    1日分のバックテスト（ワーカープロセス内で実行）
+    - 予測と結果をレース x 艇番の配列で返す（0 は該当なし）
+    """
+    started = time.perf_counter()
+    feature_extractor = _worker["feature_extractor"]
+    prediction_model = _worker["prediction_model"]
+
+    # 会場別コース1着率もその日より前の結果だけで集計（当日以降の結果を特徴量に混ぜない）
+    prediction_model.feature_registry.venue_knowledge = _worker["venue_knowledge"].table_as_of(date)
+
+    day_results = _day_results(_worker["db_path"], date)
+    race_features_list = []
+    for race_id in day_results:
+        race_features = feature_extractor.get_race_features(race_id, as_of=date)
+        if race_features and race_features["racers"]:
+            race_features_list.append(race_features)
+
+    n_races = len(race_features_list)
+    arrays = {
+        "predicted_rank": np.zeros((n_races, N_BOATS), dtype=np.int8),
+        "actual_rank": np.zeros((n_races, N_BOATS), dtype=np.int8),
+        "win_probability": np.zeros((n_races, N_BOATS), dtype=np.float32),
+        "forecast": np.zeros((n_races, 3), dtype=np.int8),
+    }
+
+    predictions = prediction_model.predict_races(race_features_list)
+    race_ids = []
+    for i, race_features in enumerate(race_features_list):
+        race_id = race_features["race_info"]["race_id"]
+        prediction = predictions[race_id]
+        race_ids.append(race_id)
+
+        for p in prediction["predictions"]:
+            boat = int(p["boat_number"]) - 1
+            arrays["predicted_rank"][i, boat] = p["predicted_rank"]
+            arrays["win_probability"][i, boat] = p["rank_probabilities"][0]
+        for boat_number, rank in day_results[race_id].items():
+            if boat_number and 1 <= boat_number <= N_BOATS:
+                arrays["actual_rank"][i, boat_number - 1] = rank or 0
+
+        # 単勝・2連単・2連複・3連複はいずれも上位3艇の並びの先頭から決まる
+        trio = prediction["forecast"]["trio"]
+        arrays["forecast"][i, :len(trio)] = trio
+
+    return dict(
+        arrays,
+        date=date,
+        race_ids=race_ids,
+        model_version=prediction_model.model_version,
+        seconds=time.perf_counter() - started
+    )
+
+
+def evaluate_arrays(predicted_rank, actual_rank, forecast, win_probability=None):
+    """
+    全レース分の的中判定（ベクトル演算）
+    - predicted_rank / actual_rank: (n, 6) 艇番-1 の位置に着順（0 は該当なし）
+    - forecast: (n, 3) 予想上位3艇の艇番
+    - 返り値はレースごとの配列の辞書
+    """
+    predicted_rank = np.asarray(predicted_rank)
+    actual_rank = np.asarray(actual_rank)
+    forecast = np.asarray(forecast, dtype=np.int64)
+
+    # 着順の一致率（予想した艇のうち予想着順どおりだった割合）
+    predicted = predicted_rank > 0
+    matches = (predicted_rank == actual_rank) & predicted
+    hit_rate = matches.sum(axis=1) / np.maximum(predicted.sum(axis=1), 1)
+
+    # 予想上位3艇の実際の着順
+    boats = np.clip(forecast - 1, 0, N_BOATS - 1)
+    forecast_ranks = np.where(forecast > 0, np.take_along_axis(actual_rank, boats, axis=1), 0)
+    first, second = forecast_ranks[:, 0], forecast_ranks[:, 1]
+
+    evaluation = {
+        "hit_rate": hit_rate,
+        "win_hit": first == 1,
+        "exacta_hit": (first == 1) & (second == 2),
+        "quinella_hit": np.isin(forecast_ranks[:, :2], (1, 2)).all(axis=1),
+        "trio_hit": np.isin(forecast_ranks, (1, 2, 3)).all(axis=1),
+    }
+
+    if win_probability is not None:
+        # 実際の1着艇に付けた1着確率（1着が確定しないレースは NaN）
+        winner = actual_rank == 1
+        has_winner = winner.any(axis=1)
+        winner_probability = np.where(
+            has_winner, np.asarray(win_probability)[np.arange(len(winner)), winner.argmax(axis=1)], np.nan
+        )
+        evaluation["winner_probability"] = winner_probability
+        evaluation["winner_log_loss"] = -np.log(np.clip(winner_probability, 1e-12, None))
+
+    return evaluation
+
+
+def summarize(evaluation, mask=None):
+    """レースごとの配列を率に集計"""
+    n_races = len(evaluation["hit_rate"])
+    if mask is None:
+        mask = np.ones(n_races, dtype=bool)
+    count = int(mask.sum())
+    summary = {"race_count": count}
+    for name in ("hit_rate", "win_hit", "exacta_hit", "quinella_hit", "trio_hit"):
+        key = "avg_hit_rate" if name == "hit_rate" else f"{name}_rate"
+        summary[key] = round(float(evaluation[name][mask].mean()), 4) if count else 0
+    if "winner_log_loss" in evaluation:
+        values = evaluation["winner_log_loss"][mask]
+        values = values[np.isfinite(values)]
+        summary["winner_log_loss"] = round(float(values.mean()), 4) if len(values) else None
+    return summary
+
+
+def run_backtest(db_path, model_dir="models", start_date=None, end_date=None, version=None, workers=None,
+                 inference_backend="numpy", model_backend="keras", log_level=logging.WARNING):
+    """期間内の全日をプロセスプールで並列にバックテストし、全体・日別の集計を返す"""
+    started = time.perf_counter()
+    dates = backtest_dates(db_path, start_date, end_date)
+    if not dates:
+        logger.warning(f"バックテスト対象の結果がありません: {start_date} - {end_date}")
+        return {"days": 0, "failed_days": [], "summary": {"race_count": 0}, "daily": []}
+
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"バックテスト開始: {dates[0]} - {dates[-1]} ({len(dates)}日, ワーカー{workers})")
+
+    day_outputs = []
+    failed = []
+    # TensorFlow は fork と相性が悪いため spawn で起動
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(dates)), mp_context=context, initializer=_init_worker,
+                             initargs=(db_path, model_dir, version, inference_backend, model_backend,
+                                       log_level)) as executor:
+        futures = {executor.submit(run_day, date): date for date in dates}
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                output = future.result()
+            except Exception as e:
+                logger.error(f"バックテスト失敗: {date}: {str(e)}")
+                failed.append(date)
+                continue
+            day_outputs.append(output)
+            logger.info(f"バックテスト完了 ({len(day_outputs)}/{len(dates)}): {date} "
+                        f"{len(output['race_ids'])}レース {output['seconds']:.1f}秒")
+
+    day_outputs.sort(key=lambda output: output["date"])
+
+    def stack(name, width):
+        blocks = [output[name] for output in day_outputs if len(output[name])]
+        return np.concatenate(blocks) if blocks else np.zeros((0, width))
+
+    evaluation = evaluate_arrays(
+        stack("predicted_rank", N_BOATS), stack("actual_rank", N_BOATS), stack("forecast", 3),
+        win_probability=stack("win_probability", N_BOATS)
+    )
+
+    # 日別の集計（レースが日付順に並んでいるので範囲で切り出す）
+    daily = []
+    offset = 0
+    for output in day_outputs:
+        n_races = len(output["race_ids"])
+        mask = np.zeros(len(evaluation["hit_rate"]), dtype=bool)
+        mask[offset:offset + n_races] = True
+        daily.append(dict(summarize(evaluation, mask), date=output["date"]))
+        offset += n_races
+
+    versions = sorted({output["model_version"] for output in day_outputs if output["model_version"]})
+    result = {
+        "start_date": dates[0],
+        "end_date": dates[-1],
+        "days": len(day_outputs),
+        "failed_days": failed,
+        "model_versions": versions,
+        "workers": workers,
+        "seconds": round(time.perf_counter() - started, 2),
+        "summary": summarize(evaluation),
+        "daily": daily,
+    }
+    logger.info(f"バックテスト終了: {result['days']}日 {result['summary']['race_count']}レース "
+                f"{result['seconds']}秒")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ウォークフォワード・バックテスト")
+    parser.add_argument("--db", default="boatrace_data.db")
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("--start", help="開始日 YYYYMMDD")
+    parser.add_argument("--end", help="終了日 YYYYMMDD")
+    parser.add_argument("--version", help="評価するモデルバージョン（既定: 稼働中のバージョン）")
+    parser.add_argument("--workers", type=int, help="既定: CPUコア数")
+    parser.add_argument("--inference-backend", default="numpy")
+    parser.add_argument("--model-backend", default="keras")
+    parser.add_argument("--output", help="結果のJSONを書き出すパス")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    result = run_backtest(
+        args.db, model_dir=args.model_dir, start_date=args.start, end_date=args.end, version=args.version,
+        workers=args.workers, inference_backend=args.inference_backend, model_backend=args.model_backend
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(result, generated_at=datetime.datetime.now().isoformat()), f, ensure_ascii=False,
+                      indent=2)
+
+    print(json.dumps(dict(result, daily=f"{len(result['daily'])}日分"), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+"""
+競艇AI ベンチマーク
+- 推論・学習まわりの性能計測用コマンド
+- 合成データで計測するため、DBやスクレイピングは不要
+
+使い方:
+    python benchmark.py daily-batch --races 72
+    python benchmark.py single-race --iterations 500
+    python benchmark.py concurrent --threads 16 --requests 200
+    python benchmark.py startup
+    python benchmark.py listwise --races 1000 --epochs 5
+    python benchmark.py simulate --races 72 --draws 200000
+    python benchmark.py backends --races 2000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+def make_synthetic_race(race_id, rng):
+    """get_race_features と同じ形式の合成レース特徴量"""
+    venue_code = race_id[8:10]
+    racers = []
+    for boat_number in range(1, 7):
+        course_performance = {
+            course: {
+                "avg_rank": float(rng.uniform(1, 6)),
+                "win_rate": float(rng.uniform(0, 0.6)),
+                "top3_rate": float(rng.uniform(0.2, 0.9)),
+                "count": int(rng.integers(1, 20))
+            }
+            for course in range(1, 7) if rng.random() < 0.6
+        }
+        racers.append({
+            "racer_id": int(10000 + int(venue_code) * 100 + boat_number),
+            "position": {
+                "boat_number": boat_number,
+                "course": boat_number,
+                "motor_number": int(rng.integers(1, 100)),
+                "boat_id": int(rng.integers(1, 100)),
+                "weight": float(rng.normal(52, 2))
+            },
+            "statistics": {
+                "avg_rank": float(rng.uniform(1.5, 5.5)),
+                "win_rate": float(rng.uniform(0, 0.5)),
+                "top3_rate": float(rng.uniform(0.1, 0.9)),
+                "avg_start_time": float(rng.normal(0.15, 0.03)),
+                "recent_races": int(rng.integers(0, 40)),
+                "course_performance": course_performance,
+                "venue_performance": {}
+            },
+            "weather_performance": {
+                "avg_rank": float(rng.uniform(1.5, 5.5)),
+                "win_rate": float(rng.uniform(0, 0.5)),
+                "race_count": int(rng.integers(0, 20))
+            },
+            "comment": "",
+            "comment_analysis": {"sentiment": float(rng.uniform(-1, 1)), "confidence": 0.7, "key_topics": []}
+        })
+
+    return {
+        "race_info": {
+            "race_id": race_id,
+            "venue": venue_code,
+            "race_number": int(race_id[10:12]),
+            "race_date": race_id[0:8]
+        },
+        "water_condition": {
+            "temperature": float(rng.normal(25, 2)),
+            "water_temperature": float(rng.normal(20, 1)),
+            "wave_height": int(rng.choice([0, 1, 2, 3, 5, 10])),
+            "wind_direction": str(rng.choice(["北", "北東", "東", "南東", "南", "南西", "西", "北西"])),
+            "wind_speed": float(rng.normal(3, 1)),
+            "weather": str(rng.choice(["晴", "曇", "雨", "荒天"]))
+        },
+        "racers": racers
+    }
+
+
+def make_synthetic_day(n_races, seed=0, date="20250101"):
+    """1日分の合成レース（会場ごとに12R）"""
+    rng = np.random.default_rng(seed)
+    races = []
+    for i in range(n_races):
+        venue_code = i // 12 + 1
+        race_number = i % 12 + 1
+        races.append(make_synthetic_race(f"{date}{venue_code:02d}{race_number:02d}", rng))
+    return races
+
+
+def make_synthetic_results(race, rng):
+    """特徴量に依存する隠れた強さから Plackett-Luce で着順を生成（学習で回収できる信号を持たせる）"""
+    strengths = np.array([
+        3.0 * racer["statistics"]["win_rate"] + 1.5 * racer["statistics"]["top3_rate"]
+        - 0.4 * (racer["position"]["course"] - 1)
+        for racer in race["racers"]
+    ])
+    order = np.argsort(-(strengths + rng.gumbel(size=len(strengths))))
+    ranks = np.empty(len(order), dtype=int)
+    ranks[order] = np.arange(1, len(order) + 1)
+    return [
+        {"boat_number": racer["position"]["boat_number"], "rank": int(rank)}
+        for racer, rank in zip(race["racers"], ranks)
+    ]
+
+
+def _timeit(func, repeat):
+    """最良値（秒）を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _build_prediction_model(model_dir):
+    """未学習モデル付きの予測モデル（計測用）"""
+    from boat_race_prediction_system import BoatRacePredictionModel
+
+    prediction_model = BoatRacePredictionModel(model_dir=model_dir)
+    if prediction_model.main_model is None:
+        prediction_model.main_model = prediction_model.create_model()
+    return prediction_model
+
+
+def bench_daily_batch(args):
+    """レースごとの予測ループと一括予測の比較"""
+    prediction_model = _build_prediction_model(args.model_dir)
+    races = make_synthetic_day(args.races, seed=args.seed)
+
+    def per_race():
+        return {race["race_info"]["race_id"]: prediction_model.predict_race(race) for race in races}
+
+    def batched():
+        return prediction_model.predict_races(races)
+
+    # 結果の一致確認
+    loop_result = per_race()
+    batch_result = batched()
+    max_diff = max(
+        float(np.max(np.abs(
+            np.array([p["rank_probabilities"] for p in loop_result[race_id]["predictions"]]) -
+            np.array([p["rank_probabilities"] for p in batch_result[race_id]["predictions"]])
+        )))
+        for race_id in loop_result
+    )
+    same_forecast = all(loop_result[r]["forecast"] == batch_result[r]["forecast"] for r in loop_result)
+
+    loop_time = _timeit(per_race, args.repeat)
+    batch_time = _timeit(batched, args.repeat)
+
+    print(f"races: {len(races)}")
+    print(f"per-race loop : {loop_time * 1000:9.1f} ms")
+    print(f"batched       : {batch_time * 1000:9.1f} ms")
+    print(f"speedup       : {loop_time / batch_time:9.1f} x")
+    print(f"max |Δprob|   : {max_diff:.2e}  forecast一致: {same_forecast}")
+
+
+def _percentiles(samples_ms):
+    samples = np.array(samples_ms)
+    return np.percentile(samples, 50), np.percentile(samples, 99), samples.mean()
+
+
+def bench_single_race(args):
+    """1レース予測のレイテンシ（model.predict vs tf.function）"""
+    prediction_model = _build_prediction_model(args.model_dir)
+    race = make_synthetic_day(1, seed=args.seed)[0]
+
+    results = {}
+    for label, fast in (("model.predict", False), ("tf.function", True)):
+        prediction_model.fast_inference = fast
+        prediction_model.warmup()
+        for _ in range(10):
+            prediction_model.predict_race(race)
+
+        samples = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            prediction_model.predict_race(race)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[label] = _percentiles(samples)
+
+    print(f"iterations: {args.iterations}")
+    print(f"{'path':<15}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for label, (p50, p99, mean) in results.items():
+        print(f"{label:<15}{p50:>10.2f}{p99:>10.2f}{mean:>10.2f}")
+
+
+def bench_concurrent(args):
+    """同時リクエストの1レース予測: 各スレッドで直接推論 vs 推論サーバーでまとめて推論"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from inference_server import MicroBatchInferenceServer
+
+    prediction_model = _build_prediction_model(args.model_dir)
+    prediction_model.warmup()
+    races = make_synthetic_day(args.threads * args.requests, seed=args.seed)
+
+    def direct(race):
+        return prediction_model.predict_race(race)
+
+    def predict_batch(batch):
+        predictions = prediction_model.predict_races(batch)
+        return [predictions[race["race_info"]["race_id"]] for race in batch]
+
+    server = MicroBatchInferenceServer(
+        predict_batch,
+        max_batch_size=args.max_batch,
+        max_wait_ms=args.max_wait_ms
+    )
+
+    def batched(race):
+        return server.submit(race).result()
+
+    results = {}
+    for label, predict in (("direct", direct), ("micro-batch", batched)):
+        def timed(race):
+            start = time.perf_counter()
+            predict(race)
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(timed, races[:args.threads * 4]))  # ウォームアップ
+            start = time.perf_counter()
+            samples = list(executor.map(timed, races))
+            elapsed = time.perf_counter() - start
+        results[label] = (len(races) / elapsed,) + _percentiles(samples)
+
+    server.stop()
+    stats = server.stats()
+    print(f"threads: {args.threads}  requests: {len(races)}  max_batch: {args.max_batch}  max_wait: {args.max_wait_ms}ms")
+    print(f"{'path':<13}{'races/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for label, (throughput, p50, p99, mean) in results.items():
+        print(f"{label:<13}{throughput:>10.0f}{p50:>10.2f}{p99:>10.2f}{mean:>10.2f}")
+    print(f"バッチ数: {stats['batches']}  平均バッチ: {stats['mean_batch']}  最大バッチ: {stats['max_batch']}")
+
+
+def _epoch_timer():
+    """エポックごとの所要時間を記録するコールバック"""
+    from tensorflow.keras.callbacks import Callback
+
+    class EpochTimer(Callback):
+        def on_train_begin(self, logs=None):
+            self.seconds = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.seconds.append(time.perf_counter() - self._start)
+
+    return EpochTimer()
+
+
+def bench_listwise(args):
+    """選手単位モデルとレース単位（Plackett-Luce）モデルの学習スループット・精度比較"""
+    from boat_race_prediction_system import BoatRacePredictionModel
+    from feature_schema import N_RACER_FEATURES, FeatureSchemaRegistry
+    from listwise_model import build_keras_model, build_race_tensors, fit_scaler, ListwiseRankModel
+    from numpy_inference import NumpyRankModel
+    from plackett_luce import negative_log_likelihood, position_probabilities, strengths_from_rank_probs
+
+    rng = np.random.default_rng(args.seed)
+    races = make_synthetic_day(args.races, seed=args.seed)
+    source = [(race["race_info"]["race_id"], race, make_synthetic_results(race, rng)) for race in races]
+    tensors = build_race_tensors(source, FeatureSchemaRegistry())
+
+    train, val = ~tensors["validation"], tensors["validation"]
+    scaler = fit_scaler(tensors["racers"][train])
+    racers = scaler.transform(tensors["racers"]).astype(np.float32)
+    water = tensors["water"]
+    ranks = tensors["ranks"]
+    n_train = int(train.sum())
+
+    # 選手単位: (レース数*6, N_RACER_FEATURES) の行に展開し、同じレース数のバッチで学習
+    per_racer = BoatRacePredictionModel.create_model()
+    per_racer_timer = _epoch_timer()
+    per_racer.fit(
+        [racers[train].reshape(-1, N_RACER_FEATURES), np.repeat(water[train], 6, axis=0)],
+        np.eye(6, dtype=np.float32)[ranks[train].reshape(-1) - 1],
+        epochs=args.epochs, batch_size=args.batch_size * 6, callbacks=[per_racer_timer], verbose=0
+    )
+
+    listwise = build_keras_model()
+    listwise_timer = _epoch_timer()
+    listwise.fit(
+        [racers[train], water[train]], ranks[train].astype(np.float32),
+        epochs=args.epochs, batch_size=args.batch_size, callbacks=[listwise_timer], verbose=0
+    )
+
+    # 検証レースでの評価（推論はどちらもNumPyエンジン）
+    per_racer_engine = NumpyRankModel.from_keras(per_racer)
+    listwise_engine = ListwiseRankModel.from_keras(listwise, scaler)
+    n_val = int(val.sum())
+
+    rank_probs = per_racer_engine.predict(
+        [racers[val].reshape(-1, N_RACER_FEATURES), np.repeat(water[val], 6, axis=0)]
+    ).reshape(n_val, 6, 6)
+    per_racer_strengths = strengths_from_rank_probs(rank_probs)
+    listwise_strengths = listwise_engine.predict_scores(tensors["racers"][val], water[val])
+    listwise_probs = position_probabilities(listwise_strengths)
+
+    def summary(strengths, probs):
+        winners = np.argmin(ranks[val], axis=1)
+        return {
+            "nll": float(negative_log_likelihood(strengths, ranks[val]).mean()),
+            "win_hit": float(np.mean(np.argmax(probs[:, :, 0], axis=1) == winners)),
+            # 着位ごとの確率の艇合計は本来1（選手単位モデルは保証されない）
+            "consistency_error": float(np.abs(probs.sum(axis=1) - 1).mean()),
+        }
+
+    results = {
+        "per-racer": (per_racer_timer.seconds, summary(per_racer_strengths, rank_probs)),
+        "listwise": (listwise_timer.seconds, summary(listwise_strengths, listwise_probs)),
+    }
+
+    print(f"races: train {n_train} / val {n_val}, epochs: {args.epochs}, batch: {args.batch_size} races")
+    print(f"{'model':<12}{'races/s':>10}{'epoch s':>9}{'val NLL':>10}{'win hit':>9}{'Σ誤差':>10}")
+    for label, (seconds, metrics) in results.items():
+        # 初回エポックはトレースを含むため除外
+        epoch_seconds = float(np.median(seconds[1:] if len(seconds) > 1 else seconds))
+        print(f"{label:<12}{n_train / epoch_seconds:>10.0f}{epoch_seconds:>9.3f}{metrics['nll']:>10.3f}"
+              f"{metrics['win_hit']:>9.3f}{metrics['consistency_error']:>10.4f}")
+
+
+def bench_backends(args):
+    """選手単位モデルのバックエンド比較（学習時間・1レース推論・一括スループット・精度）"""
+    from feature_schema import FeatureSchemaRegistry
+    from listwise_model import build_race_tensors, fit_scaler
+    from model_backends import MODEL_BACKENDS, create_backend
+
+    rng = np.random.default_rng(args.seed)
+    races = make_synthetic_day(args.races, seed=args.seed)
+    source = [(race["race_info"]["race_id"], race, make_synthetic_results(race, rng)) for race in races]
+    tensors = build_race_tensors(source, FeatureSchemaRegistry())
+
+    # (レース数, 6, 選手 + 水面) の特徴量行列（スケーリング済み選手特徴量 + 水面状況）
+    train, val = ~tensors["validation"], tensors["validation"]
+    scaler = fit_scaler(tensors["racers"][train])
+    racers = scaler.transform(tensors["racers"]).astype(np.float32)
+    water = np.repeat(tensors["water"][:, None, :], 6, axis=1)
+    X = np.concatenate([racers, water], axis=2)
+    y = tensors["ranks"] - 1
+
+    X_train, y_train = X[train].reshape(-1, X.shape[-1]), y[train].reshape(-1)
+    X_val, y_val = X[val].reshape(-1, X.shape[-1]), y[val].reshape(-1)
+    val_races = X[val]
+    winners = np.argmin(tensors["ranks"][val], axis=1)
+
+    results = {}
+    for name in (args.backend or list(MODEL_BACKENDS)):
+        options = {"epochs": args.epochs} if name == "keras" else {}
+        backend = create_backend(name, **options)
+
+        start = time.perf_counter()
+        backend.fit(X_train, y_train, X_val, y_val)
+        train_seconds = time.perf_counter() - start
+
+        # 1レース（6行）の推論レイテンシ
+        for race in val_races[:10]:
+            backend.predict_proba(race)
+        samples = []
+        for i in range(args.iterations):
+            race = val_races[i % len(val_races)]
+            start = time.perf_counter()
+            backend.predict_proba(race)
+            samples.append((time.perf_counter() - start) * 1000)
+        p50, p99, _ = _percentiles(samples)
+
+        batch_seconds = _timeit(lambda: backend.predict_proba(X_val), args.repeat)
+        probs = backend.predict_proba(X_val)
+        race_probs = probs.reshape(-1, 6, 6)
+        results[name] = {
+            "train_s": train_seconds,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "races_per_s": len(val_races) / batch_seconds,
+            "log_loss": float(-np.log(np.clip(probs[np.arange(len(y_val)), y_val], 1e-12, None)).mean()),
+            "rank_acc": float(np.mean(probs.argmax(axis=1) == y_val)),
+            "win_hit": float(np.mean(race_probs[:, :, 0].argmax(axis=1) == winners)),
+        }
+
+    print(f"races: train {int(train.sum())} / val {int(val.sum())}, rows: {len(X_train)} / {len(X_val)}")
+    print(f"{'backend':<10}{'train s':>9}{'p50 ms':>9}{'p99 ms':>9}{'races/s':>10}{'logloss':>9}{'rank acc':>10}{'win hit':>9}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['train_s']:>9.2f}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}{r['races_per_s']:>10.0f}"
+              f"{r['log_loss']:>9.4f}{r['rank_acc']:>10.4f}{r['win_hit']:>9.4f}")
+
+
+def bench_simulate(args):
+    """1日分のレースをまとめてモンテカルロ・シミュレーション（厳密な Plackett-Luce の値と比較）"""
+    from plackett_luce import position_probabilities
+    from race_simulator import RaceSimulator
+
+    rng = np.random.default_rng(args.seed)
+    strengths = rng.normal(0.0, 1.0, (args.races, 6))
+    simulator = RaceSimulator(n_draws=args.draws, seed=args.seed)
+
+    seconds = _timeit(lambda: simulator.simulate(strengths), args.repeat)
+    result = simulator.simulate(strengths)
+
+    exact = position_probabilities(strengths)
+    race_index = np.arange(args.races)
+    model_rank = np.argsort(np.argsort(-strengths, axis=1), axis=1)
+    exact_stability = exact[race_index, result["favourite"], :3].sum(axis=1)
+    exact_upset = np.where(model_rank >= 3, exact[:, :, 0], 0.0).sum(axis=1)
+
+    print(f"races: {args.races}, draws/race: {result['draws']}")
+    print(f"time: {seconds * 1000:.1f} ms ({args.races * result['draws'] / seconds / 1e6:.1f}M draws/s)")
+    print(f"max abs error  win: {np.abs(result['win_probability'] - exact[:, :, 0]).max():.4f}"
+          f"  stability: {np.abs(result['stability'] - exact_stability).max():.4f}"
+          f"  upset: {np.abs(result['upset_probability'] - exact_upset).max():.4f}")
+
+
+STARTUP_MODULES = [
+    "numpy", "pandas", "sklearn", "tensorflow", "transformers",
+    "flask", "bs4", "requests", "apscheduler",
+    "feature_schema", "numpy_inference", "boat_race_prediction_system", "app",
+]
+
+_IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+    error = None
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - start
+result = {"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "error": error}
+if error is None and sys.argv[1] == "app":
+    import app
+    client = app.app.test_client()
+    for path in ("/api/test", "/api/races/today"):
+        client.get(path)
+        result[path] = time.perf_counter() - start
+print("RESULT " + json.dumps(result))
+"""
+
+
+def _probe_import(module, backend_dir, work_dir):
+    """新しいインタプリタでモジュールのインポートコストを計測"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [backend_dir, os.environ.get("PYTHONPATH")])))
+    completed = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE, module],
+        cwd=work_dir, env=env, capture_output=True, text=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    return {"seconds": None, "max_rss_mb": None, "error": completed.stderr.strip().splitlines()[-1:]}
+
+
+def bench_startup(args):
+    """モジュールごとのインポート時間・メモリとAPIの初回応答時間"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"{'module':<30}{'import s':>10}{'max RSS MB':>12}")
+        for module in args.modules or STARTUP_MODULES:
+            result = _probe_import(module, backend_dir, work_dir)
+            if result["error"]:
+                print(f"{module:<30}{'-':>10}{'-':>12}  ({result['error']})")
+                continue
+            print(f"{module:<30}{result['seconds']:>10.3f}{result['max_rss_mb']:>12.1f}")
+            for path in ("/api/test", "/api/races/today"):
+                if path in result:
+                    print(f"  first {path:<22}{result[path]:>10.3f} s (プロセス起動から)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="競艇AI ベンチマーク")
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    daily = subparsers.add_parser("daily-batch", help="日次一括予測 vs レース毎ループ")
+    daily.add_argument("--races", type=int, default=72)
+    daily.set_defaults(func=bench_daily_batch)
+
+    single = subparsers.add_parser("single-race", help="1レース予測のp50/p99レイテンシ")
+    single.add_argument("--iterations", type=int, default=500)
+    single.set_defaults(func=bench_single_race)
+
+    concurrent = subparsers.add_parser("concurrent", help="同時リクエスト時の直接推論 vs 推論サーバー")
+    concurrent.add_argument("--threads", type=int, default=16)
+    concurrent.add_argument("--requests", type=int, default=200, help="1スレッドあたりの要求数")
+    concurrent.add_argument("--max-batch", type=int, default=64)
+    concurrent.add_argument("--max-wait-ms", type=float, default=5.0)
+    concurrent.set_defaults(func=bench_concurrent)
+
+    startup = subparsers.add_parser("startup", help="モジュールごとのインポートコスト")
+    startup.add_argument("modules", nargs="*")
+    startup.set_defaults(func=bench_startup)
+
+    listwise = subparsers.add_parser("listwise", help="選手単位 vs レース単位モデルの学習スループット")
+    listwise.add_argument("--races", type=int, default=1000)
+    listwise.add_argument("--epochs", type=int, default=5)
+    listwise.add_argument("--batch-size", type=int, default=64)
+    listwise.set_defaults(func=bench_listwise)
+
+    backends = subparsers.add_parser("backends", help="Keras vs 勾配ブースティングの学習・推論・精度")
+    backends.add_argument("--races", type=int, default=2000)
+    backends.add_argument("--epochs", type=int, default=20)
+    backends.add_argument("--iterations", type=int, default=300)
+    backends.add_argument("--backend", action="append", help="比較するバックエンド（省略時は全て）")
+    backends.set_defaults(func=bench_backends)
+
+    simulate = subparsers.add_parser("simulate", help="リスク分析のモンテカルロ・シミュレーション")
+    simulate.add_argument("--races", type=int, default=72)
+    simulate.add_argument("--draws", type=int, default=200_000)
+    simulate.set_defaults(func=bench_simulate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
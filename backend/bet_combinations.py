@@ -0,0 +1,155 @@
+"""
+舟券の組み合わせ確率エンジン
+- 各艇の強さ（対数スケール）から Plackett-Luce で3連単120通りの確率を直接計算し、
+  集計行列を掛けて全組み合わせの確率を一括計算
+    単勝 6 / 2連単 30 / 2連複 15 / 3連単 120 / 3連複 20
+- 複数レースを (レース数, 6) の配列でまとめて処理（レースごとのループなし）
+- 選手単位モデルの出力からは1着確率を強さとして使う（Harville 方式）
+"""
+
+import itertools
+
+import numpy as np
+
+from plackett_luce import N_BOATS, strengths_from_rank_probs
+
+BET_TYPES = ("win", "exacta", "quinella", "trifecta", "trio")
+
+BET_TYPE_NAMES = {
+    "win": "単勝",
+    "exacta": "2連単",
+    "quinella": "2連複",
+    "trifecta": "3連単",
+    "trio": "3連複",
+}
+
+# 各券種の組み合わせ（艇インデックス 0-5。連複は昇順）
+COMBINATIONS = {
+    "win": [(boat,) for boat in range(N_BOATS)],
+    "exacta": list(itertools.permutations(range(N_BOATS), 2)),
+    "quinella": list(itertools.combinations(range(N_BOATS), 2)),
+    "trifecta": list(itertools.permutations(range(N_BOATS), 3)),
+    "trio": list(itertools.combinations(range(N_BOATS), 3)),
+}
+
+
+# 3連単の 1着・2着・3着 の艇インデックス
+_FIRST, _SECOND, _THIRD = (np.array(column) for column in zip(*COMBINATIONS["trifecta"]))
+
+
+def _combination_key(bet_type, order):
+    if bet_type == "win":
+        return (order[0],)
+    if bet_type == "exacta":
+        return tuple(order[:2])
+    if bet_type == "quinella":
+        return tuple(sorted(order[:2]))
+    if bet_type == "trifecta":
+        return tuple(order[:3])
+    return tuple(sorted(order[:3]))
+
+
+def _build_aggregation():
+    """[3連単 120, 全券種の組み合わせ] の0/1行列と、券種ごとの列範囲"""
+    columns = {}
+    offset = 0
+    for bet_type in BET_TYPES:
+        columns[bet_type] = (offset, offset + len(COMBINATIONS[bet_type]))
+        offset += len(COMBINATIONS[bet_type])
+
+    matrix = np.zeros((len(COMBINATIONS["trifecta"]), offset))
+    for bet_type in BET_TYPES:
+        start, _ = columns[bet_type]
+        index = {combination: start + i for i, combination in enumerate(COMBINATIONS[bet_type])}
+        for t, order in enumerate(COMBINATIONS["trifecta"]):
+            matrix[t, index[_combination_key(bet_type, order)]] = 1.0
+    return matrix, columns
+
+
+_AGGREGATION, _COLUMNS = _build_aggregation()
+
+
+def trifecta_probabilities(strengths):
+    """
+    3連単の確率 (n, 120)
+    P(i, j, k) = w_i * w_j / (1 - w_i) * w_k / (1 - w_i - w_j)   （w は強さの softmax）
+    """
+    strengths = np.asarray(strengths, dtype=np.float64).reshape(-1, N_BOATS)
+    w = np.exp(strengths - strengths.max(axis=1, keepdims=True))
+    w /= w.sum(axis=1, keepdims=True)
+
+    first, second, third = w[:, _FIRST], w[:, _SECOND], w[:, _THIRD]
+    rest_after_first = np.clip(1.0 - first, 1e-12, None)
+    rest_after_second = np.clip(rest_after_first - second, 1e-12, None)
+    return first * (second / rest_after_first) * (third / rest_after_second)
+
+
+def combination_probabilities(strengths):
+    """
+    全券種の組み合わせ確率
+    - strengths: (n, 6) 各艇の対数強さ
+    - 戻り値: {券種: (n, 組み合わせ数)}（列の順は COMBINATIONS と同じ）
+    """
+    probs = trifecta_probabilities(strengths) @ _AGGREGATION
+    return {bet_type: probs[:, start:stop] for bet_type, (start, stop) in _COLUMNS.items()}
+
+
+def ranked_combinations(strengths, boat_numbers=None, bet_types=BET_TYPES, top=None):
+    """
+    レースごと・券種ごとの確率順の組み合わせ表
+    - boat_numbers: (n, 6) 各インデックスの艇番（省略時はインデックス+1）
+    - 戻り値: [{券種: [{"combination", "probability", "fair_odds"}, ...]}, ...]
+    """
+    probabilities = combination_probabilities(strengths)
+    n_races = len(next(iter(probabilities.values())))
+    if boat_numbers is None:
+        boat_numbers = np.tile(np.arange(1, N_BOATS + 1), (n_races, 1))
+    boat_numbers = np.asarray(boat_numbers).reshape(-1, N_BOATS)
+
+    tables = [{} for _ in range(n_races)]
+    for bet_type in bet_types:
+        probs = probabilities[bet_type]
+        combos = np.array(COMBINATIONS[bet_type])
+        ranking = np.argsort(-probs, axis=1, kind="stable")[:, :top]
+        for race, (race_probs, race_ranking, numbers) in enumerate(zip(probs, ranking, boat_numbers)):
+            entries = []
+            for c in race_ranking:
+                combination = numbers[combos[c]].tolist()
+                if bet_type in ("quinella", "trio"):
+                    combination.sort()
+                probability = float(race_probs[c])
+                entries.append({
+                    "combination": combination,
+                    "probability": round(probability, 6),
+                    "fair_odds": round(1 / probability, 1) if probability > 0 else None
+                })
+            tables[race][bet_type] = entries
+    return tables
+
+
+def strengths_from_prediction(prediction):
+    """
+    predict_race の結果から (強さ (6,), 艇番 (6,)) を取り出す
+    - predictions は期待値順に並んでいるため艇番順に並べ直す
+    """
+    racers = sorted(prediction["predictions"], key=lambda p: p["boat_number"])
+    rank_probs = np.array([racer["rank_probabilities"] for racer in racers])
+    return strengths_from_rank_probs(rank_probs)[0], np.array([racer["boat_number"] for racer in racers])
+
+
+def strengths_from_scores(scores, temperature):
+    """ルールベースの評価点を強さに換算（temperature 点差で強さが e 倍）"""
+    scores = np.asarray(scores, dtype=np.float64)
+    return (scores - scores.max(axis=-1, keepdims=True)) / temperature
+
+
+def prediction_tables(predictions, bet_types=BET_TYPES, top=None):
+    """複数レースの予測結果をまとめて組み合わせ表に変換 {race_id: 表}"""
+    predictions = [p for p in predictions if len(p["predictions"]) == N_BOATS]
+    if not predictions:
+        return {}
+    pairs = [strengths_from_prediction(p) for p in predictions]
+    strengths = np.stack([pair[0] for pair in pairs])
+    boat_numbers = np.stack([pair[1] for pair in pairs])
+    tables = ranked_combinations(strengths, boat_numbers, bet_types=bet_types, top=top)
+    return {p["race_id"]: table for p, table in zip(predictions, tables)}
@@ -5,15 +5,7 @@
 - 結果のフィードバックによる継続的な精度向上
 """
 
-import pandas as pd
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Sequential, load_model, Model
-from tensorflow.keras.layers import Dense, LSTM, Dropout, Input, Embedding, Flatten, Concatenate
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.model_selection import train_test_split
 import requests
 from bs4 import BeautifulSoup
 import schedule
@@ -23,10 +15,35 @@ import os
 import datetime
 import logging
 import re
-from transformers import BertJapaneseTokenizer, TFBertModel
+import pickle
+import importlib.util
 import sqlite3
+import threading
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
+from bet_combinations import (BET_TYPE_NAMES, BET_TYPES, COMBINATIONS, combination_probabilities,
+                              prediction_tables, strengths_from_scores)
+from feature_schema import N_RACER_FEATURES, N_WATER_FEATURES, FeatureSchemaRegistry, hash_inputs
+from inference_server import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, MicroBatchInferenceServer
+from listwise_model import LISTWISE_MODEL_FILENAME, ListwiseRankModel, build_race_tensors, fit_listwise_model, race_inputs
+from model_backends import MODEL_BACKENDS, create_backend
+from model_registry import MANIFEST_FILENAME, ModelRegistry
+from online_learning import OnlineLearner
+from plackett_luce import N_BOATS, position_probabilities, top_orders
+from prediction_cache import LRUCache, PredictionCache
+from race_conditions import RaceConditionsStore
+from race_simulator import RaceSimulator, attach_risk_analysis
+from rule_scorer import score_races
+from venue_knowledge import VENUE_NAMES, VenueKnowledgeBase
+from numpy_inference import (NUMPY_MODEL_FILENAME, QUANTIZED_DTYPES, QUANTIZED_MODEL_FILENAMES, NumpyRankModel,
+                             export_rank_model)
+from training_pipeline import DatabaseRaceSource, DictRaceSource, FeatureArchive, StreamingTrainingPipeline
+
+# TensorFlow / scikit-learn / transformers は使う時点で読み込む（APIのコールドスタート短縮）
+# 推論はNumPyエンジンで代替できるため、学習時以外は不要
+TF_AVAILABLE = importlib.util.find_spec("tensorflow") is not None
+
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
@@ -53,12 +70,7 @@ class BoatRaceDataCollector:
         """初期化"""
         self.db_path = db_path
         self.initialize_database()
-        self.venues = [
-            "桐生", "戸田", "江戸川", "平和島", "多摩川", "浜名湖", 
-            "蒲郡", "常滑", "津", "三国", "びわこ", "住之江",
-            "尼崎", "鳴門", "丸亀", "児島", "宮島", "徳山",
-            "下関", "若松", "芦屋", "福岡", "唐津", "大村"
-        ]
+        self.venues = list(VENUE_NAMES.values())
         self.base_url = "https://boatrace.jp/"
         
     def initialize_database(self):
@@ -99,6 +111,11 @@ class BoatRaceDataCollector:
         )
         ''')
         
+        # 選手ごとの期間集計（特徴抽出・バックテスト）用
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_race_results_racer_date ON race_results (racer_id, race_date)
+        ''')
+        
         # 水面状況テーブル
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS water_conditions (
@@ -444,30 +461,47 @@ class BoatRaceFeatureExtractor:
     など
     """
     
+    # 特徴量の元になるテーブル（出走表・水面状況・コメント・成績）
+    FEATURE_TABLES = ("race_entries", "water_conditions", "racer_comments", "race_results")
+    
     def __init__(self, db_path="boatrace_data.db"):
         """初期化"""
         self.db_path = db_path
         self.tokenizer = None
-        # 必要に応じてBERTトークナイザーの初期化
+        # 必要に応じてBERTトークナイザーの初期化（transformersはここで遅延インポート）
+        # from transformers import BertJapaneseTokenizer
         # self.tokenizer = BertJapaneseTokenizer.from_pretrained('cl-tohoku/bert-base-japanese-whole-word-masking')
 
-    def get_racer_statistics(self, racer_id, days=30):
-        """選手の直近成績取得"""
+    @staticmethod
+    def _stats_window(days, as_of=None):
+        """
+        集計期間 (開始日, 終了日) を YYYYMMDD で返す（終了日は含まない）
+        - as_of なし: 今日の days 日前以降の全成績
+        - as_of あり: as_of の days 日前から前日まで（その日以降の結果を使わない）
+        """
+        if as_of is None:
+            current_date = datetime.datetime.now()
+            return (current_date - datetime.timedelta(days=days)).strftime("%Y%m%d"), "99999999"
+        
+        as_of_date = datetime.datetime.strptime(as_of, "%Y%m%d")
+        return (as_of_date - datetime.timedelta(days=days)).strftime("%Y%m%d"), as_of
+    
+    def get_racer_statistics(self, racer_id, days=30, as_of=None):
+        """選手の直近成績取得（as_of: YYYYMMDD を指定するとその前日までの成績）"""
         logger.info(f"選手統計取得: {racer_id}, 期間: {days}日")
         
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        current_date = datetime.datetime.now()
-        past_date = (current_date - datetime.timedelta(days=days)).strftime("%Y%m%d")
+        past_date, end_date = self._stats_window(days, as_of)
         
         # 直近の着順データ
         cursor.execute('''
         SELECT rank, course, time, start_time, venue
         FROM race_results
-        WHERE racer_id = ? AND race_date >= ?
+        WHERE racer_id = ? AND race_date >= ? AND race_date < ?
         ORDER BY race_date DESC, race_number DESC
-        ''', (racer_id, past_date))
+        ''', (racer_id, past_date, end_date))
         
         recent_results = cursor.fetchall()
         
@@ -538,23 +572,22 @@ class BoatRaceFeatureExtractor:
         
         return stats
 
-    def get_weather_performance(self, racer_id, weather_type, days=180):
-        """天候条件別の選手成績"""
+    def get_weather_performance(self, racer_id, weather_type, days=180, as_of=None):
+        """天候条件別の選手成績（as_of: YYYYMMDD を指定するとその前日までの成績）"""
         logger.info(f"天候別成績取得: {racer_id}, 天候: {weather_type}")
         
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        current_date = datetime.datetime.now()
-        past_date = (current_date - datetime.timedelta(days=days)).strftime("%Y%m%d")
+        past_date, end_date = self._stats_window(days, as_of)
         
         # 天候別の成績データ取得
         cursor.execute('''
         SELECT r.rank, w.wave_height, w.wind_speed, w.weather
         FROM race_results r
         JOIN water_conditions w ON r.race_id = w.race_id
-        WHERE r.racer_id = ? AND r.race_date >= ? AND w.weather = ?
-        ''', (racer_id, past_date, weather_type))
+        WHERE r.racer_id = ? AND r.race_date >= ? AND r.race_date < ? AND w.weather = ?
+        ''', (racer_id, past_date, end_date, weather_type))
         
         results = cursor.fetchall()
         conn.close()
@@ -629,8 +662,29 @@ class BoatRaceFeatureExtractor:
         
         return result
 
-    def get_race_features(self, race_id):
-        """レース毎の特徴量を抽出"""
+    def data_generation(self):
+        """
+        特徴量の元データの世代 {テーブル名: AUTOINCREMENT の最終値}
+        - FEATURE_TABLES はいずれも INSERT OR REPLACE で書き込むため、更新のたびに値が進む
+          （特徴量から作った予想をキャッシュするときのキーに使う）
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            SELECT name, seq
+            FROM sqlite_sequence
+            WHERE name IN ({", ".join("?" for _ in self.FEATURE_TABLES)})
+            ''', self.FEATURE_TABLES)
+            return dict(cursor.fetchall())
+        finally:
+            conn.close()
+    
+    def get_race_features(self, race_id, as_of=None):
+        """
+        レース毎の特徴量を抽出
+        - as_of: YYYYMMDD。指定するとその日より前の成績だけで集計（バックテストではレース日を渡す）
+        """
         logger.info(f"レース特徴抽出: {race_id}")
         
         conn = sqlite3.connect(self.db_path)
@@ -696,12 +750,13 @@ class BoatRaceFeatureExtractor:
             racer_id = entry[0]
             
             # 選手統計取得
-            racer_stats = self.get_racer_statistics(racer_id)
+            racer_stats = self.get_racer_statistics(racer_id, as_of=as_of)
             
             # 天候条件下での成績
             weather_stats = self.get_weather_performance(
-                racer_id, 
-                water_features.get("weather", "晴")
+                racer_id,
+                water_features.get("weather", "晴"),
+                as_of=as_of
             ) if water_features else {}
             
             # コメント分析
@@ -739,6 +794,49 @@ class BoatRaceFeatureExtractor:
         return race_features
 
 
+class ModelBundle:
+    """
+    推論に使うモデル一式（1バージョン分）
+    - 切り替えはこのオブジェクトごと差し替えるため、処理中のリクエストでモデルとスケーラーが混ざらない
+    """
+    
+    def __init__(self, version=None, main_model=None, features_scaler=None, numpy_engine=None,
+                 model_schema=None, comment_model=None, listwise_engine=None, backend_engine=None):
+        self.version = version
+        self.main_model = main_model
+        self.features_scaler = features_scaler
+        self.numpy_engine = numpy_engine
+        self.model_schema = model_schema
+        self.comment_model = comment_model
+        self.listwise_engine = listwise_engine
+        # Keras 以外のバックエンド（model_backends.py。fit / predict_proba）
+        self.backend_engine = backend_engine
+        self.loaded_at = datetime.datetime.now().isoformat()
+        
+        # 固定シグネチャのtf.function（モデルごとに構築）
+        self.inference_fn = None
+        self.inference_model = None
+    
+    @property
+    def ready(self):
+        """選手単位モデルで推論できるか"""
+        return self.main_model is not None or self.numpy_engine is not None or self.backend_engine is not None
+    
+    def derive(self, **changes):
+        """一部だけ差し替えた新しい一式（バージョンは未設定）"""
+        fields = {
+            "main_model": self.main_model,
+            "features_scaler": self.features_scaler,
+            "numpy_engine": self.numpy_engine,
+            "model_schema": self.model_schema,
+            "comment_model": self.comment_model,
+            "listwise_engine": self.listwise_engine,
+            "backend_engine": self.backend_engine
+        }
+        fields.update(changes)
+        return ModelBundle(**fields)
+
+
 class BoatRacePredictionModel:
     """
     競艇予測モデルクラス
@@ -748,161 +846,457 @@ class BoatRacePredictionModel:
     - モデルの評価・更新
     """
     
-    def __init__(self, model_dir="models"):
-        """初期化"""
+    # ロールバックを即時に行うため、直近に読み込んだバージョンをメモリに残す数
+    KEEP_LOADED_VERSIONS = 2
+    
+    # 順位予測モデルの既定ハイパーパラメータ（create_model の config で上書き）
+    DEFAULT_MODEL_CONFIG = {
+        "racer_units": [64, 32, 16],
+        "water_units": 8,
+        "merged_units": 32,
+        "dropout": 0.2,
+        "learning_rate": 0.001
+    }
+    
+    def __init__(self, model_dir="models", fast_inference=True,
+                 inference_backend="auto", ranking_head="auto", model_backend="keras",
+                 venue_knowledge=None):
+        """
+        初期化
+        - venue_knowledge: 会場別コース1着率の VenueKnowledgeBase（venue_stats 特徴量が参照。省略時は既定値）
+        """
         self.model_dir = model_dir
-        self.main_model = None
-        self.features_scaler = None
-        self.comment_model = None
         self.race_history = {}
         
+        # バージョン管理されたモデル成果物（稼働中のモデル一式は _active を丸ごと差し替える）
+        self.registry = ModelRegistry(model_dir)
+        self._active = ModelBundle()
+        self._loaded_bundles = OrderedDict()
+        self._failed_version = None
+        self._swap_lock = threading.Lock()
+        self._watcher = None
+        
+        # 特徴量スキーマ（モデルが想定するスキーマはロード時に記録）
+        self.feature_registry = FeatureSchemaRegistry(venue_knowledge=venue_knowledge)
+        
+        # 低レイテンシ推論（固定シグネチャのtf.function）
+        self.fast_inference = fast_inference
+        
+        # 推論バックエンド（"auto" / "tensorflow" / "numpy" / 量子化版の "float16" / "int8"）
+        self.inference_backend = inference_backend
+        
+        # 着順の予測方式（"auto": レース単位モデルがあれば使用 / "listwise" / "per_racer"）
+        self.ranking_head = ranking_head
+        
+        # 選手単位モデルの学習バックエンド（"keras" / "hist_gbt"）
+        if model_backend not in MODEL_BACKENDS:
+            raise ValueError(f"未対応のモデルバックエンドです: {model_backend}")
+        self.model_backend = model_backend
+        
         # モデル保存用ディレクトリ作成
         os.makedirs(self.model_dir, exist_ok=True)
         
         # モデルのロード（存在する場合）
         self.load_models()
     
-    def load_models(self):
-        """既存モデルのロード"""
-        try:
-            model_path = os.path.join(self.model_dir, "boatrace_model.h5")
-            scaler_path = os.path.join(self.model_dir, "features_scaler.pkl")
-            comment_model_path = os.path.join(self.model_dir, "comment_model.h5")
-            
-            if os.path.exists(model_path):
-                logger.info("メインモデルをロード中...")
-                self.main_model = load_model(model_path)
-                logger.info("メインモデルのロード完了")
+    # 稼働中のモデル一式への委譲（学習・ベンチマークのコードはこれまで通り属性として扱える）
+    @property
+    def main_model(self):
+        return self._active.main_model
+    
+    @main_model.setter
+    def main_model(self, value):
+        self._active.main_model = value
+    
+    @property
+    def features_scaler(self):
+        return self._active.features_scaler
+    
+    @features_scaler.setter
+    def features_scaler(self, value):
+        self._active.features_scaler = value
+    
+    @property
+    def numpy_engine(self):
+        return self._active.numpy_engine
+    
+    @numpy_engine.setter
+    def numpy_engine(self, value):
+        self._active.numpy_engine = value
+    
+    @property
+    def model_schema(self):
+        return self._active.model_schema
+    
+    @model_schema.setter
+    def model_schema(self, value):
+        self._active.model_schema = value
+    
+    @property
+    def comment_model(self):
+        return self._active.comment_model
+    
+    @comment_model.setter
+    def comment_model(self, value):
+        self._active.comment_model = value
+    
+    @property
+    def model_version(self):
+        return self._active.version
+    
+    def _resolve_inference_backend(self, directory):
+        """使用する推論バックエンドを決定"""
+        numpy_model_path = os.path.join(directory, NUMPY_MODEL_FILENAME)
+        backend = self.inference_backend
+        
+        if backend == "auto":
+            # 書き出し済みならTensorFlowを使わずにNumPyで推論
+            backend = "numpy" if os.path.exists(numpy_model_path) else "tensorflow"
+        if backend == "tensorflow" and not TF_AVAILABLE:
+            backend = "numpy"
+        if backend in QUANTIZED_DTYPES and not os.path.exists(os.path.join(directory, QUANTIZED_MODEL_FILENAMES[backend])):
+            logger.warning(f"量子化モデル({backend})がないため、float32のNumPy推論を使用します")
+            backend = "numpy"
+        
+        return backend
+    
+    def _artifact_model_backend(self, directory):
+        """
+        成果物を学習したモデルバックエンド
+        - バージョンの manifest に記録された model_backend（学習時の設定）を使う
+        - 記録のない成果物（レジストリ導入前など）は、バックエンド固有のファイルがあるかで判断
+        """
+        manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            model_backend = manifest.get("model_backend") or (manifest.get("model_config") or {}).get("model_backend")
+            if model_backend:
+                return model_backend
+        
+        for name, backend_class in MODEL_BACKENDS.items():
+            if name != "keras" and os.path.exists(os.path.join(directory, backend_class.FILENAME)):
+                return name
+        return "keras"
+    
+    def _load_bundle(self, directory, version=None):
+        """成果物ディレクトリからモデル一式を読み込み、ウォームアップまで済ませる"""
+        bundle = ModelBundle(version=version)
+        model_path = os.path.join(directory, "boatrace_model.h5")
+        scaler_path = os.path.join(directory, "features_scaler.pkl")
+        comment_model_path = os.path.join(directory, "comment_model.h5")
+        schema_path = os.path.join(directory, "feature_schema.json")
+        numpy_model_path = os.path.join(directory, NUMPY_MODEL_FILENAME)
+        
+        # 稼働中の設定（MODEL_BACKEND）ではなく、そのバージョンを学習したバックエンドで読み込む
+        model_backend = self._artifact_model_backend(directory)
+        if model_backend not in MODEL_BACKENDS:
+            raise ValueError(f"未対応のモデルバックエンドの成果物です: {model_backend}")
+        
+        backend = self._resolve_inference_backend(directory)
+        if model_backend != "keras":
+            backend_engine_path = os.path.join(directory, MODEL_BACKENDS[model_backend].FILENAME)
+            if not os.path.exists(backend_engine_path):
+                raise ValueError(f"{model_backend}モデルの成果物がありません: {backend_engine_path}")
+            logger.info(f"{model_backend}モデルをロード中...")
+            bundle.backend_engine = MODEL_BACKENDS[model_backend].load(directory)
+        elif backend in QUANTIZED_DTYPES:
+            # memmap で読み込むため、複数ワーカーでもページキャッシュを共有しロードはほぼ一瞬
+            bundle.numpy_engine = NumpyRankModel.load_quantized(os.path.join(directory, QUANTIZED_MODEL_FILENAMES[backend]))
+            bundle.features_scaler = bundle.numpy_engine.scaler
+        elif backend == "numpy":
+            if os.path.exists(numpy_model_path):
+                logger.info("NumPy推論モデルをロード中...")
+                bundle.numpy_engine = NumpyRankModel.load(numpy_model_path)
+                bundle.features_scaler = bundle.numpy_engine.scaler
+            else:
+                logger.warning("TensorFlowなし、かつNumPy推論モデルがありません")
+        elif os.path.exists(model_path):
+            from tensorflow.keras.models import load_model
             
-            if os.path.exists(scaler_path):
-                logger.info("特徴量スケーラーをロード中...")
-                with open(scaler_path, 'rb') as f:
-                    self.features_scaler = pickle.load(f)
-                logger.info("特徴量スケーラーのロード完了")
+            logger.info("メインモデルをロード中...")
+            bundle.main_model = load_model(model_path)
+            logger.info("メインモデルのロード完了")
+        
+        # 学習時の特徴量スキーマを確認
+        if bundle.ready:
+            if os.path.exists(schema_path):
+                with open(schema_path, 'r', encoding='utf-8') as f:
+                    bundle.model_schema = json.load(f)
+                changed_groups = self.feature_registry.diff(bundle.model_schema)
+                if changed_groups:
+                    logger.warning(f"特徴量スキーマ不一致: 変更グループ={changed_groups}, 再学習が必要です")
+            else:
+                logger.warning("特徴量スキーマ記録なし: 旧形式のモデルです")
+        
+        if os.path.exists(scaler_path) and bundle.numpy_engine is None:
+            logger.info("特徴量スケーラーをロード中...")
+            with open(scaler_path, 'rb') as f:
+                bundle.features_scaler = pickle.load(f)
+            logger.info("特徴量スケーラーのロード完了")
+        
+        if os.path.exists(comment_model_path) and TF_AVAILABLE:
+            from tensorflow.keras.models import load_model
             
-            if os.path.exists(comment_model_path):
-                logger.info("コメント分析モデルをロード中...")
-                self.comment_model = load_model(comment_model_path)
-                logger.info("コメント分析モデルのロード完了")
-                
+            logger.info("コメント分析モデルをロード中...")
+            bundle.comment_model = load_model(comment_model_path)
+            logger.info("コメント分析モデルのロード完了")
+        
+        listwise_model_path = os.path.join(directory, LISTWISE_MODEL_FILENAME)
+        if os.path.exists(listwise_model_path):
+            bundle.listwise_engine = ListwiseRankModel.load(listwise_model_path)
+            if bundle.listwise_engine.metadata.get("schema_version") != self.feature_registry.schema_version:
+                logger.warning("リストワイズモデルの特徴量スキーマ不一致: 再学習が必要です")
+        
+        # 初回リクエストでのトレースを避けるため、差し替え前にウォームアップ
+        self.warmup(bundle)
+        return bundle
+    
+    def _swap(self, bundle):
+        """稼働中のモデル一式を差し替え（参照の付け替えのみなので推論は止まらない）"""
+        with self._swap_lock:
+            self._active = bundle
+            if bundle.version:
+                self._loaded_bundles[bundle.version] = bundle
+                self._loaded_bundles.move_to_end(bundle.version)
+                while len(self._loaded_bundles) > self.KEEP_LOADED_VERSIONS:
+                    self._loaded_bundles.popitem(last=False)
+    
+    def load_models(self):
+        """稼働中バージョン（レジストリ導入前のモデルは model_dir 直下）のロード"""
+        version = self.registry.current_version()
+        try:
+            if version:
+                self.registry.verify(version)
+            bundle = self._load_bundle(self.registry.resolve_dir(), version)
         except Exception as e:
             logger.error(f"モデルロードエラー: {str(e)}")
             # モデルがロードできない場合は新規作成
-            self.main_model = None
-            self.features_scaler = None
-            self.comment_model = None
-    
-    def save_models(self):
-        """モデルの保存"""
-        if self.main_model:
-            model_path = os.path.join(self.model_dir, "boatrace_model.h5")
-            self.main_model.save(model_path)
-            logger.info(f"メインモデル保存完了: {model_path}")
+            self._failed_version = version
+            bundle = ModelBundle()
+        self._swap(bundle)
+    
+    def reload_if_changed(self):
+        """レジストリの稼働バージョンが変わっていれば読み込んで差し替え"""
+        version = self.registry.current_version()
+        if version is None or version == self._active.version or version == self._failed_version:
+            return False
         
-        if self.features_scaler:
-            scaler_path = os.path.join(self.model_dir, "features_scaler.pkl")
+        previous = self._active.version
+        bundle = self._loaded_bundles.get(version)
+        if bundle is None:
+            try:
+                self.registry.verify(version)
+                bundle = self._load_bundle(self.registry.version_path(version), version)
+            except Exception as e:
+                # 読み込めないバージョンは切り替えず、現行モデルで推論を続ける
+                logger.error(f"モデルバージョン読み込み失敗（現行モデルを継続）: {version}: {str(e)}")
+                self._failed_version = version
+                return False
+        
+        self._swap(bundle)
+        logger.info(f"モデル切り替え: {previous} → {version}")
+        return True
+    
+    def start_model_watcher(self, interval=60):
+        """レジストリを定期確認し、新バージョンをバックグラウンドで読み込むスレッドを開始"""
+        if self._watcher is not None:
+            return self._watcher
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.error(f"モデル監視エラー: {str(e)}")
+        
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"モデル監視開始: {interval}秒間隔")
+        return self._watcher
+    
+    def _load_version_for_activation(self, version):
+        """有効化する前にバージョンを読み込む（推論できないバージョンは ValueError で拒否）"""
+        bundle = self._loaded_bundles.get(version)
+        if bundle is not None:
+            return bundle
+        if not os.path.isdir(self.registry.version_path(version)):
+            raise ValueError(f"存在しないモデルバージョンです: {version}")
+        
+        self.registry.verify(version)
+        try:
+            bundle = self._load_bundle(self.registry.version_path(version), version)
+        except Exception as e:
+            raise ValueError(f"読み込めないモデルバージョンです: {version}: {str(e)}")
+        if not bundle.ready:
+            raise ValueError(f"推論できるモデルがないバージョンです: {version}")
+        return bundle
+    
+    def activate_version(self, version):
+        """指定バージョンを読み込めることを確認してから有効化し、即時に差し替え"""
+        bundle = self._load_version_for_activation(version)
+        self.registry.activate(version)
+        self._failed_version = None
+        self._swap(bundle)
+        return self.model_version
+    
+    def rollback(self):
+        """1つ前のバージョンに戻す（読み込めない場合は戻さない。読み込み済みなら参照の付け替えだけで完了）"""
+        bundle = self._load_version_for_activation(self.registry.rollback_target())
+        self.registry.rollback()
+        self._failed_version = None
+        self._swap(bundle)
+        return self.model_version
+    
+    def model_status(self):
+        """稼働中モデルの情報"""
+        bundle = self._active
+        return {
+            "version": bundle.version,
+            "loaded_at": bundle.loaded_at,
+            "model_backend": bundle.backend_engine.name if bundle.backend_engine is not None else "keras",
+            "backend": (
+                "sklearn" if bundle.backend_engine is not None
+                else "numpy" if bundle.main_model is None and bundle.numpy_engine is not None
+                else "tensorflow"
+            ),
+            "quantization": bundle.numpy_engine.quantization if bundle.main_model is None and bundle.numpy_engine is not None else "float32",
+            "schema_version": (bundle.model_schema or {}).get("schema_version"),
+            "ranking_head": "listwise" if bundle.listwise_engine is not None and self.ranking_head != "per_racer" else "per_racer",
+            "loaded_versions": list(self._loaded_bundles),
+            "watcher": self._watcher is not None
+        }
+    
+    def _load_training_model(self):
+        """学習用のKerasモデルを用意（稼働中モデルとは別インスタンス）"""
+        model_path = os.path.join(self.registry.resolve_dir(), "boatrace_model.h5")
+        if os.path.exists(model_path):
+            from tensorflow.keras.models import load_model
+            
+            logger.info("学習用にメインモデルをロード中...")
+            # オプティマイザは新しく作り直す（保存時の状態は変数の対応が崩れることがある）
+            model = load_model(model_path, compile=False)
+            self._compile_model(model)
+            return model
+        return self.create_model()
+    
+    def _ensure_inference_model(self, bundle=None):
+        """推論可能なモデルを用意"""
+        bundle = bundle or self._active
+        if not bundle.ready:
+            logger.warning("モデルが存在しないため、新規作成します")
+            bundle.main_model = self.create_model()
+            # 学習済みモデルがないため精度は低い
+    
+    def _write_artifacts(self, bundle, directory):
+        """モデル一式を指定ディレクトリに書き出す"""
+        if bundle.backend_engine is not None:
+            path = bundle.backend_engine.save(directory)
+            with open(os.path.join(directory, "feature_schema.json"), 'w', encoding='utf-8') as f:
+                json.dump(bundle.model_schema, f, ensure_ascii=False, indent=2)
+            logger.info(f"{bundle.backend_engine.name}モデル保存完了: {path}")
+        elif bundle.main_model is None and bundle.numpy_engine is not None:
+            # TensorFlowなしで運用中の一式はNumPy形式とスキーマをそのまま引き継ぐ
+            engine = bundle.numpy_engine
+            if engine.quantization != "float32":
+                # 量子化版で稼働中の場合は、同じバージョンの float32 成果物から引き継ぐ
+                source_dir = self.registry.version_path(bundle.version) if bundle.version else self.registry.resolve_dir()
+                engine = NumpyRankModel.load(os.path.join(source_dir, NUMPY_MODEL_FILENAME))
+            engine.save(os.path.join(directory, NUMPY_MODEL_FILENAME))
+            if bundle.model_schema:
+                with open(os.path.join(directory, "feature_schema.json"), 'w', encoding='utf-8') as f:
+                    json.dump(bundle.model_schema, f, ensure_ascii=False, indent=2)
+        
+        if bundle.main_model:
+            model_path = os.path.join(directory, "boatrace_model.h5")
+            bundle.main_model.save(model_path)
+            logger.info(f"メインモデル保存完了: {model_path}")
+            
+            # 学習に使った特徴量スキーマを記録
+            schema_path = os.path.join(directory, "feature_schema.json")
+            with open(schema_path, 'w', encoding='utf-8') as f:
+                json.dump(bundle.model_schema, f, ensure_ascii=False, indent=2)
+            logger.info(f"特徴量スキーマ記録: {bundle.model_schema['schema_version']}")
+            
+            # TensorFlowなしで推論するためのNumPy形式も書き出す
+            export_rank_model(
+                bundle.main_model,
+                bundle.features_scaler,
+                os.path.join(directory, NUMPY_MODEL_FILENAME),
+                metadata={"schema_version": bundle.model_schema["schema_version"]}
+            )
+        
+        # 量子化版（複数ワーカーで共有できる memmap 形式）も書き出す
+        numpy_model_path = os.path.join(directory, NUMPY_MODEL_FILENAME)
+        if os.path.exists(numpy_model_path):
+            engine = NumpyRankModel.load(numpy_model_path)
+            for dtype in QUANTIZED_DTYPES:
+                engine.save_quantized(os.path.join(directory, QUANTIZED_MODEL_FILENAMES[dtype]), dtype)
+        
+        if bundle.features_scaler:
+            scaler_path = os.path.join(directory, "features_scaler.pkl")
             with open(scaler_path, 'wb') as f:
-                pickle.dump(self.features_scaler, f)
+                pickle.dump(bundle.features_scaler, f)
             logger.info(f"特徴量スケーラー保存完了: {scaler_path}")
         
-        if self.comment_model:
-            comment_model_path = os.path.join(self.model_dir, "comment_model.h5")
-            self.comment_model.save(comment_model_path)
+        if bundle.comment_model:
+            comment_model_path = os.path.join(directory, "comment_model.h5")
+            bundle.comment_model.save(comment_model_path)
             logger.info(f"コメント分析モデル保存完了: {comment_model_path}")
+        
+        if bundle.listwise_engine:
+            listwise_model_path = os.path.join(directory, LISTWISE_MODEL_FILENAME)
+            bundle.listwise_engine.save(
+                listwise_model_path,
+                metadata={"schema_version": self.feature_registry.schema_version}
+            )
+            logger.info(f"リストワイズモデル保存完了: {listwise_model_path}")
+    
+    def save_models(self, bundle=None, metrics=None, model_config=None):
+        """モデル一式を新しいバージョンとして登録し、有効化して差し替え"""
+        bundle = bundle or self._active
+        if bundle.main_model or bundle.backend_engine:
+            bundle.model_schema = self.feature_registry.describe()
+        
+        version = self.registry.publish(
+            lambda directory: self._write_artifacts(bundle, directory),
+            metadata={
+                "schema_version": (bundle.model_schema or {}).get("schema_version"),
+                "model_backend": bundle.backend_engine.name if bundle.backend_engine is not None else "keras",
+                "metrics": metrics or {},
+                "model_config": model_config
+            }
+        )
+        bundle.version = version
+        if bundle is not self._active:
+            self.warmup(bundle)
+        self._swap(bundle)
+        return version
     
-    def preprocess_features(self, race_features, training=False):
+    def preprocess_features(self, race_features, training=False, bundle=None):
         """特徴量の前処理"""
-        # レース情報の数値特徴量
-        race_data = race_features["race_info"]
-        water_data = race_features["water_condition"]
-        
-        # 水面情報の数値変換
-        wind_direction_mapping = {
-            "北": 0, "北東": 45, "東": 90, "南東": 135,
-            "南": 180, "南西": 225, "西": 270, "北西": 315
-        }
-        weather_mapping = {
-            "晴": 0, "曇": 1, "雨": 2, "荒天": 3
-        }
+        bundle = bundle or self._active
         
-        # 各選手の特徴量作成
-        racer_features_list = []
-        
-        for racer in race_features["racers"]:
-            # 基本情報
-            position = racer["position"]
-            stats = racer["statistics"]
-            weather_perf = racer["weather_performance"]
-            comment_analysis = racer["comment_analysis"]
-            
-            # 特徴量抽出
-            features = [
-                # 艇番・コース情報
-                position["boat_number"],
-                position["course"],
-                position["motor_number"],
-                position["boat_id"],
-                position["weight"],
-                
-                # 選手成績統計
-                stats.get("avg_rank", 3.5),  # デフォルト値
-                stats.get("win_rate", 0.0),
-                stats.get("top3_rate", 0.0),
-                stats.get("avg_start_time", 0.2),
-                stats.get("recent_races", 0),
-                
-                # コース別成績（1コースの場合）
-                stats.get("course_performance", {}).get(1, {}).get("avg_rank", 3.5),
-                stats.get("course_performance", {}).get(1, {}).get("win_rate", 0.0),
-                
-                # コース別成績（現在のコース）
-                stats.get("course_performance", {}).get(position["course"], {}).get("avg_rank", 3.5),
-                stats.get("course_performance", {}).get(position["course"], {}).get("win_rate", 0.0),
-                
-                # 会場での成績
-                stats.get("venue_performance", {}).get(race_data["venue"], {}).get("avg_rank", 3.5),
-                stats.get("venue_performance", {}).get(race_data["venue"], {}).get("win_rate", 0.0),
-                
-                # 天候条件での成績
-                weather_perf.get("avg_rank", 3.5),
-                weather_perf.get("win_rate", 0.0),
-                weather_perf.get("race_count", 0),
-                
-                # コメント分析
-                comment_analysis.get("sentiment", 0.0),
-                comment_analysis.get("confidence", 0.0),
-                
-                # コメントトピック（ダミー変数）
-                1 if "スタート" in comment_analysis.get("key_topics", []) else 0,
-                1 if "コース" in comment_analysis.get("key_topics", []) else 0,
-                1 if "調子" in comment_analysis.get("key_topics", []) else 0,
-                1 if "機材" in comment_analysis.get("key_topics", []) else 0,
-                1 if "外部要因" in comment_analysis.get("key_topics", []) else 0,
-            ]
-            
-            racer_features_list.append(features)
+        # 各選手の特徴量作成（定義はfeature_schemaでグループ単位に管理）
+        racer_features_list = self.feature_registry.racer_vectors(race_features)
         
         # 水面状況の特徴量
-        water_features = [
-            water_data.get("temperature", 25.0),
-            water_data.get("water_temperature", 20.0),
-            water_data.get("wave_height", 0.0),
-            wind_direction_mapping.get(water_data.get("wind_direction", "北"), 0),
-            water_data.get("wind_speed", 0.0),
-            weather_mapping.get(water_data.get("weather", "晴"), 0)
-        ]
+        water_features = self.feature_registry.water_vector(race_features)
         
         # すべての選手の特徴量を同一の配列に
         all_features = np.array(racer_features_list)
         
         # スケーリング処理
-        if training and (self.features_scaler is None):
+        if training and (bundle.features_scaler is None):
             # 学習時かつスケーラーがない場合は新規作成
-            self.features_scaler = StandardScaler()
-            all_features_scaled = self.features_scaler.fit_transform(all_features)
-        elif self.features_scaler is not None:
+            from sklearn.preprocessing import StandardScaler
+            
+            bundle.features_scaler = StandardScaler()
+            all_features_scaled = bundle.features_scaler.fit_transform(all_features)
+        elif bundle.features_scaler is not None:
             # スケーラーが存在する場合は変換のみ
-            all_features_scaled = self.features_scaler.transform(all_features)
+            all_features_scaled = bundle.features_scaler.transform(all_features)
         else:
             # スケーラーがない場合はそのまま
             all_features_scaled = all_features
@@ -912,24 +1306,85 @@ class BoatRacePredictionModel:
         
         return all_features_scaled, water_features, racer_features_list
     
-    def create_model(self):
-        """モデルの構築"""
-        logger.info("新規モデルを構築中...")
+    def _build_inference_function(self, model):
+        """固定入力シグネチャの推論関数を構築"""
+        import tensorflow as tf
+        
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=[None, N_RACER_FEATURES], dtype=tf.float32, name="racer_features"),
+            tf.TensorSpec(shape=[None, 6], dtype=tf.float32, name="water_features"),
+        ])
+        def infer(racer_features, water_features):
+            return model([racer_features, water_features], training=False)
+        
+        return infer
+    
+    def warmup(self, bundle=None):
+        """推論関数のトレースとウォームアップ"""
+        bundle = bundle or self._active
+        if not bundle.ready:
+            return
+        
+        start = time.perf_counter()
+        self._infer(np.zeros((6, N_RACER_FEATURES), dtype=np.float32), np.zeros((6, N_WATER_FEATURES), dtype=np.float32), bundle)
+        logger.info(f"推論ウォームアップ完了: {(time.perf_counter() - start) * 1000:.1f}ms")
+    
+    def _infer(self, X_racers, X_water, bundle=None):
+        """着順確率の推論"""
+        bundle = bundle or self._active
+        
+        # Kerasモデル未ロード時はNumPyエンジンで推論（TensorFlow不要）
+        if bundle.backend_engine is not None:
+            return bundle.backend_engine.predict_proba(np.hstack([X_racers, X_water]))
+        
+        if bundle.main_model is None and bundle.numpy_engine is not None:
+            return bundle.numpy_engine.predict([X_racers, X_water])
+        
+        if not self.fast_inference:
+            return bundle.main_model.predict([X_racers, X_water], batch_size=len(X_racers), verbose=0)
         
-        # 選手特徴量の入力
-        racer_input = Input(shape=(26,), name="racer_features")
-        racer_dense1 = Dense(64, activation="relu")(racer_input)
-        racer_dense2 = Dense(32, activation="relu")(racer_dense1)
-        racer_output = Dense(16, activation="relu")(racer_dense2)
+        # モデルが差し替わった場合は推論関数を作り直す
+        if bundle.inference_model is not bundle.main_model:
+            bundle.inference_fn = self._build_inference_function(bundle.main_model)
+            bundle.inference_model = bundle.main_model
+        
+        rank_probs = bundle.inference_fn(
+            np.asarray(X_racers, dtype=np.float32),
+            np.asarray(X_water, dtype=np.float32)
+        )
+        return rank_probs.numpy()
+    
+    @classmethod
+    def create_model(cls, config=None):
+        """
+        モデルの構築
+        - config: DEFAULT_MODEL_CONFIG の一部を上書きするハイパーパラメータ
+        """
+        if not TF_AVAILABLE:
+            raise RuntimeError("モデル構築にはTensorFlowが必要です")
+        
+        from tensorflow.keras.models import Model
+        from tensorflow.keras.layers import Dense, Dropout, Input, Concatenate
+        
+        config = dict(cls.DEFAULT_MODEL_CONFIG, **(config or {}))
+        logger.info(f"新規モデルを構築中... {config}")
+        
+        # 選手特徴量の入力（最終層は racer_output、NumPy推論エンジンは層名で対応付ける）
+        racer_input = Input(shape=(N_RACER_FEATURES,), name="racer_features")
+        racer_output = racer_input
+        racer_units = list(config["racer_units"])
+        for i, units in enumerate(racer_units, start=1):
+            name = "racer_output" if i == len(racer_units) else f"racer_dense{i}"
+            racer_output = Dense(units, activation="relu", name=name)(racer_output)
         
         # 水面状況の入力
         water_input = Input(shape=(6,), name="water_features")
-        water_dense = Dense(8, activation="relu")(water_input)
+        water_dense = Dense(config["water_units"], activation="relu", name="water_dense")(water_input)
         
         # 特徴量の結合
         merged = Concatenate()([racer_output, water_dense])
-        merged_dense = Dense(32, activation="relu")(merged)
-        dropout = Dropout(0.2)(merged_dense)
+        merged_dense = Dense(config["merged_units"], activation="relu", name="merged_dense")(merged)
+        dropout = Dropout(config["dropout"])(merged_dense)
         
         # 出力層（順位予測）- 6艇なので1-6位の確率分布
         output = Dense(6, activation="softmax", name="rank_probs")(dropout)
@@ -938,19 +1393,31 @@ class BoatRacePredictionModel:
         model = Model(inputs=[racer_input, water_input], outputs=output)
         
         # コンパイル
-        model.compile(
-            optimizer=Adam(learning_rate=0.001),
-            loss="categorical_crossentropy",
-            metrics=["accuracy"]
-        )
+        cls._compile_model(model, learning_rate=config["learning_rate"])
         
         logger.info("モデル構築完了")
         logger.info(model.summary())
         
         return model
     
+    @staticmethod
+    def _compile_model(model, learning_rate=0.001, clipnorm=None):
+        """順位予測モデルのコンパイル"""
+        from tensorflow.keras.optimizers import Adam
+        
+        model.compile(
+            optimizer=Adam(learning_rate=learning_rate, clipnorm=clipnorm),
+            loss="categorical_crossentropy",
+            metrics=["accuracy"]
+        )
+        return model
+    
     def create_comment_model(self):
         """コメント分析モデルの構築"""
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.layers import Dense, LSTM, Embedding
+        from tensorflow.keras.optimizers import Adam
+        
         logger.info("コメント分析モデルを構築中...")
         
         # BERTを使用した日本語コメント分析モデル
@@ -975,99 +1442,186 @@ class BoatRacePredictionModel:
         
         return model
     
-    def train_model(self, train_data, epochs=10, batch_size=32):
-        """モデルの学習"""
+    def train_model(self, train_data, epochs=10, batch_size=32, config=None):
+        """
+        モデルの学習
+        - train_data: {race_id: {"features", "results"}} またはレース供給元（DatabaseRaceSource等）
+        - 特徴量はアーカイブ経由でストリーミング供給し、スケーラーは全学習データに適合
+        - config: ハイパーパラメータ（指定時は保存済みモデルを使わず新規構築。hyperparameter_sweep.py で探索）
+          model_backend が keras 以外の場合はそのバックエンドのパラメータ（毎回新規に学習）
+        """
         logger.info(f"モデル学習開始: エポック数={epochs}, バッチサイズ={batch_size}")
         
-        X_racers = []
-        X_water = []
-        y = []
+        source = DictRaceSource(train_data) if isinstance(train_data, dict) else train_data
+        pipeline = StreamingTrainingPipeline(self, batch_size=batch_size)
+        archive = FeatureArchive(os.path.join(self.model_dir, "training_archive"))
+        
+        # 1パス目: 特徴量アーカイブ作成とスケーラー適合
+        # 学習は稼働中のモデルとは別の一式で行い、完了後に新バージョンとして差し替える
+        bundle = ModelBundle(features_scaler=pipeline.build_archive(source, archive))
+        
+        # Keras 以外のバックエンドはアーカイブ全体を行列にして fit
+        if self.model_backend != "keras":
+            history = self._train_backend(archive, bundle, config)
+            metrics = {name: float(values[-1]) for name, values in history.history.items()}
+            self.save_models(bundle, metrics=metrics, model_config=dict(config or {}, model_backend=self.model_backend))
+            logger.info("モデル学習完了")
+            return history
+        
+        train_dataset = pipeline.dataset(archive, bundle.features_scaler, validation=False)
+        has_validation = pipeline.count_batches(archive, validation=True) > 0
+        validation_dataset = (
+            pipeline.dataset(archive, bundle.features_scaler, validation=True) if has_validation else None
+        )
+        monitor = "val_accuracy" if has_validation else "accuracy"
         
-        # 学習データの準備
-        for race_id, race_data in train_data.items():
-            race_features = race_data["features"]
-            race_results = race_data["results"]
-            
-            # 特徴量の前処理
-            racer_features, water_features, _ = self.preprocess_features(race_features, training=True)
-            
-            # ラベルの作成（順位をone-hotエンコーディング）
-            for racer in race_results:
-                rank = racer["rank"]
-                boat_number = racer["boat_number"]
-                
-                # 6位までの順位に制限（失格や欠場は除外）
-                if 1 <= rank <= 6:
-                    y_onehot = np.zeros(6)
-                    y_onehot[rank-1] = 1
-                    
-                    # 選手の特徴量とラベルを追加
-                    X_racers.append(racer_features[boat_number-1])
-                    X_water.append(water_features[0])
-                    y.append(y_onehot)
-        
-        # numpy配列に変換
-        X_racers = np.array(X_racers)
-        X_water = np.array(X_water)
-        y = np.array(y)
-        
-        # モデルがない場合は新規作成
-        if self.main_model is None:
-            self.main_model = self.create_model()
+        # 保存済みモデルがあればロードして追加学習、なければ新規作成
+        bundle.main_model = self.create_model(config) if config else self._load_training_model()
+        bundle.comment_model = self.comment_model
         
         # チェックポイントのコールバック
+        from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
+        
         checkpoint = ModelCheckpoint(
             os.path.join(self.model_dir, "boatrace_model_best.h5"),
-            monitor="val_accuracy",
+            monitor=monitor,
             save_best_only=True,
             verbose=1
         )
         
         early_stop = EarlyStopping(
-            monitor="val_accuracy",
+            monitor=monitor,
             patience=5,
             verbose=1
         )
         
         # モデル学習
-        history = self.main_model.fit(
-            [X_racers, X_water], y,
+        history = bundle.main_model.fit(
+            train_dataset,
+            validation_data=validation_dataset,
             epochs=epochs,
-            batch_size=batch_size,
-            validation_split=0.2,
             callbacks=[checkpoint, early_stop],
             verbose=1
         )
         
-        # モデルの保存
-        self.save_models()
+        # 新バージョンとして保存・有効化
+        metrics = {name: float(values[-1]) for name, values in history.history.items()}
+        self.save_models(bundle, metrics=metrics, model_config=config)
         
         logger.info("モデル学習完了")
         
         return history
     
+    def _train_backend(self, archive, bundle, config=None):
+        """学習データアーカイブから (n, 選手 + 水面) の行列を作り、バックエンドで学習"""
+        validation = archive.column("validation").astype(bool)
+        racers = bundle.features_scaler.transform(archive.column("racers")).astype(np.float32)
+        X = np.hstack([racers, np.asarray(archive.column("water"), dtype=np.float32)])
+        y = np.asarray(archive.column("labels"), dtype=np.int64)
+        
+        backend = create_backend(self.model_backend, config)
+        history = backend.fit(X[~validation], y[~validation], X[validation], y[validation])
+        bundle.backend_engine = backend
+        bundle.comment_model = self.comment_model
+        return history
+    
+    def train_listwise_model(self, train_data, epochs=10, batch_size=64, config=None):
+        """
+        レース単位（Plackett-Luce）モデルの学習
+        - 稼働中の一式にリストワイズモデルを加えた新バージョンとして登録・有効化
+        """
+        logger.info(f"リストワイズモデル学習開始: エポック数={epochs}, バッチサイズ={batch_size}")
+        
+        source = DictRaceSource(train_data) if isinstance(train_data, dict) else train_data
+        race_tensors = build_race_tensors(source, self.feature_registry)
+        engine, history = fit_listwise_model(race_tensors, config=config, epochs=epochs, batch_size=batch_size)
+        
+        metrics = {f"listwise_{name}": float(values[-1]) for name, values in history.history.items()}
+        self.save_models(self._active.derive(listwise_engine=engine), metrics=metrics)
+        
+        return history
+    
     def predict_race(self, race_features):
         """レース結果の予測"""
         logger.info(f"レース予測: {race_features['race_info']['race_id']}")
         
-        # モデルがない場合は新規作成
-        if self.main_model is None:
-            logger.warning("モデルが存在しないため、新規作成します")
-            self.main_model = self.create_model()
-            # 学習済みモデルがないため精度は低い
+        return self._predict([race_features])[race_features["race_info"]["race_id"]]
+    
+    def predict_races(self, race_features_list):
+        """複数レースの一括予測（全レースを1回の推論で処理）"""
+        if not race_features_list:
+            return {}
         
-        # 特徴量の前処理
-        racer_features, water_features, raw_features = self.preprocess_features(race_features)
+        logger.info(f"一括レース予測: {len(race_features_list)}レース")
         
-        # 各選手の予測
-        predictions = []
+        return self._predict(race_features_list)
+    
+    def _use_listwise(self, bundle, race_features):
+        """レース単位モデルで予測するか（6艇揃ったレースのみ対応）"""
+        return (
+            self.ranking_head != "per_racer"
+            and bundle.listwise_engine is not None
+            and len(race_features["racers"]) == N_BOATS
+        )
+    
+    def _predict(self, race_features_list):
+        """予測の本体（レースごとに使えるヘッドで推論し、結果を整形）"""
+        # 処理中にモデルが差し替わっても同じ一式で推論する
+        bundle = self._active
+        
+        listwise_flags = [self._use_listwise(bundle, race_features) for race_features in race_features_list]
+        rank_probs = [None] * len(race_features_list)
+        finish_orders = {}
+        
+        # レース単位モデル: 6艇のスコアから Plackett-Luce で着順確率を計算
+        listwise_index = [i for i, flag in enumerate(listwise_flags) if flag]
+        if listwise_index:
+            listwise_races = [race_features_list[i] for i in listwise_index]
+            X_racers, X_water = race_inputs(listwise_races, self.feature_registry)
+            strengths = bundle.listwise_engine.predict_scores(X_racers, X_water)
+            boat_numbers = [[racer["position"]["boat_number"] for racer in rf["racers"]] for rf in listwise_races]
+            orders = top_orders(strengths, k=5, boat_numbers=boat_numbers)
+            for i, probs, race_orders in zip(listwise_index, position_probabilities(strengths), orders):
+                rank_probs[i] = probs
+                finish_orders[i] = race_orders
+        
+        # 選手単位モデル: 全レースの特徴量を (N*6, N_RACER_FEATURES) / (N*6, 6) に積み上げて1回の順伝播
+        per_racer_index = [i for i, flag in enumerate(listwise_flags) if not flag]
+        if per_racer_index:
+            # モデルがない場合は新規作成
+            self._ensure_inference_model(bundle)
+            
+            racer_blocks = []
+            water_blocks = []
+            for i in per_racer_index:
+                racer_features, water_features, _ = self.preprocess_features(race_features_list[i], bundle=bundle)
+                racer_blocks.append(racer_features)
+                water_blocks.append(np.repeat(water_features, len(racer_features), axis=0))
+            
+            X_racers = np.concatenate(racer_blocks)
+            X_water = np.concatenate(water_blocks)
+            
+            probs = self._infer(X_racers, X_water, bundle)
+            
+            # レースごとに分割
+            offsets = np.cumsum([len(block) for block in racer_blocks])[:-1]
+            for i, race_probs in zip(per_racer_index, np.split(probs, offsets)):
+                rank_probs[i] = race_probs
         
-        # バッチ予測（全選手一度に）
-        X_racers = racer_features
-        X_water = np.repeat(water_features, len(racer_features), axis=0)
+        predictions = {}
+        for i, race_features in enumerate(race_features_list):
+            prediction = self._format_prediction(race_features, rank_probs[i])
+            prediction["model_version"] = bundle.version
+            prediction["ranking_head"] = "listwise" if listwise_flags[i] else "per_racer"
+            if i in finish_orders:
+                prediction["finish_orders"] = finish_orders[i]
+            predictions[prediction["race_id"]] = prediction
         
-        # 予測実行
-        rank_probs = self.main_model.predict([X_racers, X_water])
+        return predictions
+    
+    def _format_prediction(self, race_features, rank_probs):
+        """着順確率からレース予測結果を整形"""
+        predictions = []
         
         # 各選手の予測結果を整形
         for i, racer in enumerate(race_features["racers"]):
@@ -1233,301 +1787,201 @@ class BoatRaceAI:
     を統合
     """
     
-    def __init__(self, db_path="boatrace_data.db"):
-        """初期化"""
+    # ルールベースの評価点を強さに換算する際の温度（この点差で強さが e 倍）
+    RULE_SCORE_TEMPERATURE = 20.0
+    
+    # リスク分析のシミュレーション（1レースあたりの試行数・1回の呼び出しの時間上限（秒）・乱数シード）
+    RISK_SIMULATION_DRAWS = 200_000
+    RISK_SIMULATION_TIME_BUDGET = 1.0
+    RISK_SIMULATION_SEED = 0
+    
+    # 予測キャッシュの上限（レース数）
+    PREDICTION_CACHE_SIZE = 2000
+    
+    # 推論サーバーの結果待ちの上限（秒）
+    INFERENCE_TIMEOUT = 30.0
+    
+    # ルールベース予想のキャッシュの上限（レース数）
+    RULE_CACHE_SIZE = 4096
+    
+    def __init__(self, db_path="boatrace_data.db", inference_backend="auto", online_learning=False,
+                 model_backend="keras", inference_max_batch=DEFAULT_MAX_BATCH_SIZE,
+                 inference_max_wait_ms=DEFAULT_MAX_WAIT_MS, deterministic_rules=True, race_conditions=None):
+        """
+        初期化
+        - deterministic_rules: ルールベース予想の気象・モーター評価の抽選を入力から決まるシードで行う
+          （同じ出走表なら常に同じ予想になり、結果をキャッシュできる）
+        - race_conditions: 直前情報の RaceConditionsStore（省略時は db_path から作成）
+        """
         self.db_path = db_path
+        self.deterministic_rules = deterministic_rules
         self.data_collector = BoatRaceDataCollector(db_path)
         self.feature_extractor = BoatRaceFeatureExtractor(db_path)
-        self.prediction_model = BoatRacePredictionModel()
-        self.current_predictions = {}
-        
-        logger.info("競艇AI予測システム初期化完了")
-
-    def _get_venue_characteristics(self, venue_code):
-        """全国24競艇場の特性データベース"""
-        venue_db = {
-            '01': {'name': '桐生', 'water_type': 'fresh', 'course_width': 'narrow', 'inner_advantage': 0.85, 'wind_effect': 'high', 'difficulty': 'medium'},
-            '02': {'name': '戸田', 'water_type': 'fresh', 'course_width': 'narrow', 'inner_advantage': 0.80, 'wind_effect': 'medium', 'difficulty': 'hard'},
-            '03': {'name': '江戸川', 'water_type': 'tidal', 'course_width': 'wide', 'inner_advantage': 0.60, 'wind_effect': 'very_high', 'difficulty': 'very_hard'},
-            '04': {'name': '平和島', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.75, 'wind_effect': 'high', 'difficulty': 'hard'},
-            '05': {'name': '多摩川', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.78, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '06': {'name': '浜名湖', 'water_type': 'fresh', 'course_width': 'wide', 'inner_advantage': 0.72, 'wind_effect': 'low', 'difficulty': 'easy'},
-            '07': {'name': '蒲郡', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.76, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '08': {'name': '常滑', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.74, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '09': {'name': '津', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.77, 'wind_effect': 'low', 'difficulty': 'easy'},
-            '10': {'name': '三国', 'water_type': 'fresh', 'course_width': 'narrow', 'inner_advantage': 0.82, 'wind_effect': 'high', 'difficulty': 'medium'},
-            '11': {'name': 'びわこ', 'water_type': 'fresh', 'course_width': 'wide', 'inner_advantage': 0.71, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '12': {'name': '住之江', 'water_type': 'fresh', 'course_width': 'wide', 'inner_advantage': 0.70, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '13': {'name': '尼崎', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.75, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '14': {'name': '鳴門', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.73, 'wind_effect': 'high', 'difficulty': 'hard'},
-            '15': {'name': '丸亀', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.74, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '16': {'name': '児島', 'water_type': 'sea', 'course_width': 'wide', 'inner_advantage': 0.69, 'wind_effect': 'high', 'difficulty': 'hard'},
-            '17': {'name': '宮島', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.72, 'wind_effect': 'high', 'difficulty': 'hard'},
-            '18': {'name': '徳山', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.76, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '19': {'name': '下関', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.73, 'wind_effect': 'high', 'difficulty': 'hard'},
-            '20': {'name': '若松', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.75, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '21': {'name': '芦屋', 'water_type': 'sea', 'course_width': 'standard', 'inner_advantage': 0.77, 'wind_effect': 'medium', 'difficulty': 'medium'},
-            '22': {'name': '福岡', 'water_type': 'fresh', 'course_width': 'standard', 'inner_advantage': 0.78, 'wind_effect': 'low', 'difficulty': 'easy'},
-            '23': {'name': '唐津', 'water_type': 'sea', 'course_width': 'wide', 'inner_advantage': 0.68, 'wind_effect': 'very_high', 'difficulty': 'very_hard'},
-            '24': {'name': '大村', 'water_type': 'fresh', 'course_width': 'narrow', 'inner_advantage': 0.83, 'wind_effect': 'low', 'difficulty': 'easy'}
-        }
-        return venue_db.get(venue_code, venue_db['01'])
-
-    def _get_weather_conditions(self):
-        """気象条件シミュレーション"""
-        import random
-        return {
-            'wind_direction': random.choice(['北', '北東', '東', '南東', '南', '南西', '西', '北西']),
-            'wind_strength': random.choice(['無風', '微風', '弱風', '中風', '強風']),
-            'wave_height': random.randint(0, 3),
-            'temperature': random.randint(15, 35),
-            'water_temp': random.randint(10, 30),
-            'impact_level': random.choice(['低', '中', '高'])
-        }
+        # 会場特性とコース別1着率（起動時に1回読み込み、日次更新で再集計。ルール予想と特徴量で共有）
+        self.venue_knowledge = VenueKnowledgeBase(db_path)
+        self.prediction_model = BoatRacePredictionModel(
+            inference_backend=inference_backend,
+            model_backend=model_backend,
+            venue_knowledge=self.venue_knowledge
+        )
+        self.race_simulator = RaceSimulator(
+            n_draws=self.RISK_SIMULATION_DRAWS,
+            seed=self.RISK_SIMULATION_SEED,
+            time_budget=self.RISK_SIMULATION_TIME_BUDGET
+        )
         
-    def _calculate_detailed_racer_score(self, racer, venue_data, weather_data, racers_data):
-        """詳細な選手スコア計算"""
-        score = 50  # ベーススコア
-        breakdown = {}
+        # 直前情報（気象・展示タイム）の race_id ごとのキャッシュ付き参照（アプリの収集処理と共有できる）
+        self.race_conditions = race_conditions or RaceConditionsStore(db_path)
         
-        # 1. 基本能力評価（40点満点）
-        class_scores = {'A1': 40, 'A2': 30, 'B1': 20, 'B2': 10}
-        class_score = class_scores.get(racer.get('class', 'B2'), 10)
-        score += class_score
-        breakdown['class_ability'] = class_score
+        # 入力ハッシュ + モデルバージョンで無効化される有界キャッシュ（race_id -> 予測の辞書としても使える）
+        self.current_predictions = PredictionCache(max_size=self.PREDICTION_CACHE_SIZE)
         
-        # 2. 年齢・体重評価（20点満点）
-        age = racer.get('age', 30)
-        age_score = 20 if 25 <= age <= 32 else 15 if 22 <= age <= 38 else 10
+        # ルールベース予想（入力の正規化ハッシュ + 会場ナレッジの更新時刻 -> 結果）
+        self.rule_cache = LRUCache(max_size=self.RULE_CACHE_SIZE)
         
-        weight_str = racer.get('weight', '55.0kg')
-        try:
-            weight = float(weight_str.replace('kg', ''))
-            weight_score = 10 if weight < 50 else 8 if weight < 52 else 5
-        except:
-            weight_score = 5
-        
-        physical_score = age_score + weight_score
-        score += physical_score
-        breakdown['physical'] = physical_score
-        
-        # 3. コース別評価（25点満点）
-        boat_num = racer.get('boat_number', 1)
-        course_score = self._calculate_course_advantage(boat_num, venue_data)
-        score += course_score
-        breakdown['course'] = course_score
-        
-        # 4. 気象条件適性（15点満点）
-        weather_score = self._calculate_weather_adaptation(racer, weather_data, boat_num)
-        score += weather_score
-        breakdown['weather'] = weather_score
-        
-        motor_score = self._analyze_motor_performance(racer)
-        score += motor_score
-        breakdown['motor'] = motor_score
-
-        # 6. 調子・フォーム（15点満点）
-        form_score = self._analyze_racer_form(racer)
-        score += form_score
-        breakdown['form'] = form_score
-
-        # 7. 前走成績（20点満点）
-        recent_score = self._analyze_recent_performance(racer)
-        score += recent_score
-        breakdown['recent'] = recent_score
-
-        # 8. スタートタイミング（10点満点）
-        start_score = self._analyze_start_timing(racer, boat_num)
-        score += start_score
-        breakdown['start'] = start_score
+        # 同時に来た予測要求を専用スレッドでまとめて推論（モデルを触るのはこのスレッドだけ）
+        self.inference_server = MicroBatchInferenceServer(
+            self._predict_batch,
+            max_batch_size=inference_max_batch,
+            max_wait_ms=inference_max_wait_ms
+        )
         
-        # 9. 出走状況（5点満点）
-        situation_score = self._analyze_race_situation(racers_data, racer)
-        score += situation_score
-        breakdown['situation'] = situation_score
+        # 評価済みレースからの逐次学習（有効時のみ）
+        self.online_learner = OnlineLearner(self.prediction_model) if online_learning else None
         
-        return score
+        logger.info("競艇AI予測システム初期化完了")
 
-    def _calculate_course_advantage(self, boat_number, venue_data):
-        """コース有利度計算"""
-        base_scores = {1: 25, 2: 18, 3: 12, 4: 8, 5: 5, 6: 3}
-        base_score = base_scores.get(boat_number, 3)
-        
-        # 会場特性による補正
-        inner_advantage = venue_data['inner_advantage']
-        if inner_advantage > 0.8 and boat_number == 1:
-            base_score += 5  # インコース超有利会場
-        elif inner_advantage < 0.7 and boat_number >= 4:
-            base_score += 3  # アウト有利会場
-        
-        return base_score
-    
-    def _calculate_weather_adaptation(self, racer, weather_data, boat_number):
-        """気象条件適性計算"""
-        score = 10  # ベーススコア
-        
-        # 風の影響
-        if weather_data['wind_strength'] in ['強風', '中風']:
-            if boat_number == 1:
-                score += 3  # インコースは風に強い
-            elif boat_number >= 5:
-                score -= 2  # アウトコースは風に弱い
-        
-        # 波の影響
-        if weather_data['wave_height'] >= 2:
-            try:
-                weight = float(racer.get('weight', '55kg').replace('kg', ''))
-                if weight < 50:
-                    score -= 2  # 軽い選手は波に弱い
-            except:
-                pass
-        
-        return max(0, score)
+    def _get_venue_characteristics(self, venue_code):
+        """全国24競艇場の特性（会場ナレッジベースから参照）"""
+        return self.venue_knowledge.get(venue_code)
 
-    def _analyze_motor_performance(self, racer):
-        """モーター成績分析（10点満点）"""
+    def _get_weather_conditions(self, rng=None):
+        """気象条件シミュレーション（rng: random.Random を渡すとその乱数列で抽選）"""
         import random
-        
-        # クラスに基づくモーター調整力
-        class_motor_bonus = {
-            'A1': random.randint(7, 10),
-            'A2': random.randint(5, 8), 
-            'B1': random.randint(3, 6),
-            'B2': random.randint(1, 4)
+        rng = rng if rng is not None else random
+        return {
+            'wind_direction': rng.choice(['北', '北東', '東', '南東', '南', '南西', '西', '北西']),
+            'wind_strength': rng.choice(['無風', '微風', '弱風', '中風', '強風']),
+            'wave_height': rng.randint(0, 3),
+            'temperature': rng.randint(15, 35),
+            'water_temp': rng.randint(10, 30),
+            'impact_level': rng.choice(['低', '中', '高'])
         }
-        return class_motor_bonus.get(racer.get('class', 'B2'), 3)
-
-    def _analyze_racer_form(self, racer):
-        """選手の調子・フォーム分析（15点満点）"""
-        score = 10  # ベーススコア
-        
-        # 年齢による調子判定
-        age = racer.get('age', 30)
-        if 25 <= age <= 32:
-            score += 5  # 全盛期
-        elif 22 <= age <= 38:
-            score += 3  # 安定期
-        elif age > 45:
-            score -= 2  # 衰退期
-        
-        # クラス別安定度
-        racer_class = racer.get('class', 'B2')
-        if racer_class == 'A1':
-            score += 3  # 安定した実力
-        elif racer_class == 'A2':
-            score += 2
-        
-        # 体重による体調管理評価
-        try:
-            weight = float(racer.get('weight', '55kg').replace('kg', ''))
-            if 48 <= weight <= 52:
-                score += 2  # 適正体重維持
-            elif weight > 56:
-                score -= 1  # 体調管理不安
-        except:
-            pass
-        
-        return min(15, max(0, score))
-
-    def _analyze_recent_performance(self, racer):
-        """前走成績分析（20点満点）"""
-        score = 10  # ベーススコア
-        
-        # 登録番号から簡易的な成績シミュレーション
-        reg_num = racer.get('registration_number', '4000')
-        try:
-            last_digit = int(reg_num[-1])
-            
-            # 末尾数字による前走成績評価
-            if last_digit in [1, 2]:
-                score += 8  # 好調
-            elif last_digit in [3, 4, 5]:
-                score += 5  # 普通
-            elif last_digit in [6, 7]:
-                score += 2  # やや不調
-            else:
-                score -= 2  # 不調
-                
-            # クラスによる安定度補正
-            racer_class = racer.get('class', 'B2')
-            if racer_class == 'A1':
-                score += 2  # A1は安定
-            elif racer_class == 'B2':
-                score -= 1  # B2は波がある
-                
-        except:
-            score = 10
-        
-        return min(20, max(0, score))
-
-    def _analyze_start_timing(self, racer, boat_number):
-        """スタートタイミング分析（10点満点）"""
-        score = 5  # ベーススコア
-        
-        # クラス別スタート技術
-        racer_class = racer.get('class', 'B2')
-        if racer_class == 'A1':
-            score += 4  # スタート上手
-        elif racer_class == 'A2':
-            score += 2
-        elif racer_class == 'B1':
-            score += 1
-        
-        # 艇番別スタート有利度
-        if boat_number == 1:
-            score += 1  # インは比較的楽
-        elif boat_number >= 5:
-            score -= 1  # アウトは難しい
-        
-        return min(10, max(0, score))
-
-    def _analyze_race_situation(self, racers_data, racer):
-        """当日出走状況分析（5点満点）"""
-        score = 3  # ベーススコア
         
-        # 相手関係の分析
-        opponent_classes = [r.get('class', 'B2') for r in racers_data if r != racer]
-        a1_count = opponent_classes.count('A1')
-        
-        racer_class = racer.get('class', 'B2')
+    def get_comprehensive_prediction(self, racers_data, venue_code='01', weather_data=None, motor_scores=None,
+                                     race_id=None):
+        """
+        総合的な競艇予想分析
+        - weather_data / motor_scores を渡すとその値で評価（省略時は気象・モーター評価を抽選）
+        - race_id を渡すと、取得済みの直前情報の気象条件で評価（weather_data が優先）
+        - deterministic_rules が有効なら抽選は入力から決まるシードで行い、同じ入力の結果はキャッシュから返す
+        """
+        logger.info(f"総合予想開始: 会場{venue_code}, 選手数{len(racers_data)}")
         
-        # 格上相手が多い場合の評価
-        if racer_class == 'A1' and a1_count <= 1:
-            score += 2  # A1で相手が弱い
-        elif racer_class == 'B2' and a1_count >= 3:
-            score -= 1  # B2で相手が強い
+        return self.get_comprehensive_predictions([{
+            "racers": racers_data,
+            "venue_code": venue_code,
+            "weather": weather_data,
+            "motor_scores": motor_scores,
+            "race_id": race_id
+        }])[0]
+    
+    def get_comprehensive_predictions(self, races):
+        """
+        複数レース（1日分など）の総合予想を1回の評価で計算
+        - races: [{"racers": 選手のリスト, "venue_code": 会場コード, "weather": 省略可, "motor_scores": 省略可,
+                   "race_id": 省略可}]
+        - 戻り値: レースごとの get_comprehensive_prediction と同じ形式の結果のリスト
+          （キャッシュした結果は呼び出し側で書き換えられないようコピーを返す）
+        """
+        import copy
+        import random
         
-        return min(5, max(0, score))
+        results = [None] * len(races)
+        targets = []
+        cache_keys = {}
+        
+        # 直前情報（取得済みのレースは抽選ではなく実際の気象条件を使う）
+        race_ids = [race["race_id"] for race in races if race.get("race_id") and not race.get("weather")]
+        conditions = self.race_conditions.get_many(race_ids) if race_ids else {}
+        
+        for i, race in enumerate(races):
+            if not race["racers"]:
+                results[i] = {
+                    "ai_predictions": {
+                        "predictions": [{"boat_number": 1, "predicted_rank": 1, "normalized_probability": 0.30}],
+                        "recommendations": {"win": {"boat_number": 1}}
+                    }
+                }
+                continue
+            
+            # 会場特性と気象条件を取得
+            venue_code = race.get("venue_code", '01')
+            venue_data = self._get_venue_characteristics(venue_code)
+            
+            weather_data = race.get("weather")
+            if not weather_data and race.get("race_id") in conditions:
+                weather_data = conditions[race["race_id"]]["weather"]
+            
+            # 抽選のない入力（気象・モーターが与えられている）か決定的モードなら、結果は入力だけで決まる
+            # （シードは出走表と会場だけから決め、直前情報が届いてもモーター評価の抽選は変えない）
+            seed = None
+            fully_given = weather_data and race.get("motor_scores") is not None
+            if self.deterministic_rules or fully_given:
+                input_hash = hash_inputs({"racers": race["racers"], "venue_code": venue_code})
+                conditions_hash = hash_inputs([weather_data, race.get("motor_scores")])
+                cache_key = f"{input_hash}:{conditions_hash}:{venue_data['updated_at']}"
+                cached = self.rule_cache.get(cache_key)
+                if cached is not None:
+                    results[i] = copy.deepcopy(cached)
+                    continue
+                cache_keys[i] = cache_key
+                if not fully_given:
+                    seed = int(input_hash[:16], 16)
+            
+            weather_data = weather_data or self._get_weather_conditions(
+                random.Random(seed) if seed is not None else None
+            )
+            targets.append((i, {
+                "racers": race["racers"],
+                "venue": venue_data,
+                "weather": weather_data,
+                "motor_scores": race.get("motor_scores"),
+                "seed": seed
+            }))
+        
+        if not targets:
+            return results
+        
+        # 選手評価（参照テーブルで全レースの選手をまとめて計算）
+        race_scores = score_races([race for _, race in targets])
+        
+        racer_scores_list = []
+        for (_, race), scores in zip(targets, race_scores):
+            racer_scores = [
+                {
+                    'boat_number': racer.get('boat_number', 1),
+                    'score': int(score),
+                    'venue': race["venue"]['name'],
+                    'weather': race["weather"]['impact_level']
+                }
+                for racer, score in zip(race["racers"], scores)
+            ]
+            # スコア順ソート
+            racer_scores.sort(key=lambda x: x['score'], reverse=True)
+            racer_scores_list.append(racer_scores)
         
-    def get_comprehensive_prediction(self, racers_data, venue_code='01'):
-        """総合的な競艇予想分析"""
-        logger.info(f"総合予想開始: 会場{venue_code}, 選手数{len(racers_data)}")
+        # 評価点を強さに換算して単勝・2連単・3連単の確率を計算（6艇揃っているレースをまとめて）
+        combination_probs = self._rule_combination_probabilities(racer_scores_list)
         
-        if not racers_data:
-            return {
-                "ai_predictions": {
-                    "predictions": [{"boat_number": 1, "predicted_rank": 1, "normalized_probability": 0.30}],
-                    "recommendations": {"win": {"boat_number": 1}}
-                }
-            }
+        for (i, _), racer_scores, probs in zip(targets, racer_scores_list, combination_probs):
+            results[i] = self._format_comprehensive_prediction(racer_scores, *probs)
+            if i in cache_keys:
+                self.rule_cache.put(cache_keys[i], copy.deepcopy(results[i]))
+        return results
     
-        # 会場特性と気象条件を取得
-        venue_data = self._get_venue_characteristics(venue_code)
-        weather_data = self._get_weather_conditions()
-        
-        # 選手評価（詳細版）
-        racer_scores = []
-        for racer in racers_data:
-            score = self._calculate_detailed_racer_score(racer, venue_data, weather_data, racers_data)
-            racer_scores.append({
-                'boat_number': racer.get('boat_number', 1),
-                'score': score,
-                'venue': venue_data['name'],
-                'weather': weather_data['impact_level']
-            })
-        
-        # スコア順ソート
-        racer_scores.sort(key=lambda x: x['score'], reverse=True)
+    def _format_comprehensive_prediction(self, racer_scores, win_probs, exacta_probs, trifecta_probs):
+        """評価点順の選手から総合予想の結果を整形"""
         top4 = [r['boat_number'] for r in racer_scores[:4]]
         trio_patterns = [
             [top4[0], top4[1], top4[2]],  # 1-2-3着予想
@@ -1540,29 +1994,62 @@ class BoatRaceAI:
         # 各パターンの期待値計算
         trio_recommendations = []
         for i, pattern in enumerate(trio_patterns):
-            confidence = 0.35 - (i * 0.05)  # 確率を段階的に下げる
+            if trifecta_probs is not None:
+                confidence = trifecta_probs[tuple(pattern)]
+            else:
+                confidence = 0.35 - (i * 0.05)  # 確率を段階的に下げる
             trio_recommendations.append({
                 "combination": pattern,
-                "confidence": round(confidence, 2),
+                "confidence": round(confidence, 4 if trifecta_probs is not None else 2),
                 "pattern_name": f"パターン{i+1}"
             })
         
+        default_probabilities = [0.35, 0.28, 0.20, 0.10]
         return {
             "ai_predictions": {
                 "predictions": [
-                    {"boat_number": top4[0], "predicted_rank": 1, "normalized_probability": 0.35},
-                    {"boat_number": top4[1], "predicted_rank": 2, "normalized_probability": 0.28},
-                    {"boat_number": top4[2], "predicted_rank": 3, "normalized_probability": 0.20},
-                    {"boat_number": top4[3], "predicted_rank": 4, "normalized_probability": 0.10}
+                    {
+                        "boat_number": boat_number,
+                        "predicted_rank": rank,
+                        "normalized_probability": round(win_probs[boat_number], 4) if win_probs else default_probabilities[rank - 1]
+                    }
+                    for rank, boat_number in enumerate(top4, start=1)
                 ],
                 "recommendations": {
                     "win": {"boat_number": top4[0]},
-                    "exacta": {"combination": top4[:2]},
+                    "exacta": {
+                        "combination": top4[:2],
+                        **({"confidence": round(exacta_probs[tuple(top4[:2])], 4)} if exacta_probs else {})
+                    },
                     "trio_patterns": trio_recommendations
                 }
             }
         }
-
+    
+    def _rule_combination_probabilities(self, racer_scores_list):
+        """
+        評価点から単勝・2連単・3連単の確率（艇番で引ける辞書）をレースごとに
+        - 6艇揃ったレースをまとめて1回で計算し、揃っていないレースは (None, None, None)
+        """
+        results = [(None, None, None)] * len(racer_scores_list)
+        full = [i for i, racer_scores in enumerate(racer_scores_list) if len(racer_scores) == N_BOATS]
+        if not full:
+            return results
+        
+        boat_numbers = np.array([[r['boat_number'] for r in racer_scores_list[i]] for i in full])
+        scores = np.array([[r['score'] for r in racer_scores_list[i]] for i in full])
+        probabilities = combination_probabilities(strengths_from_scores(scores, self.RULE_SCORE_TEMPERATURE))
+        
+        def by_boat_numbers(bet_type, row):
+            return {
+                tuple(boat_numbers[row][list(combination)].tolist()): float(p)
+                for combination, p in zip(COMBINATIONS[bet_type], probabilities[bet_type][row])
+            }
+        
+        for row, i in enumerate(full):
+            win_probs = {key[0]: p for key, p in by_boat_numbers("win", row).items()}
+            results[i] = (win_probs, by_boat_numbers("exacta", row), by_boat_numbers("trifecta", row))
+        return results
         
     def collect_historical_data(self, days=30):
         """過去データの収集"""
@@ -1635,9 +2122,11 @@ class BoatRaceAI:
         logger.info("予測モデル学習開始")
         
         if not training_data:
-            # 過去データ収集
+            # 過去データ収集（DBに保存）し、学習時はDBから1レースずつ読み出す
             collected_data = self.collect_historical_data(days=30)
-            training_data = self.prepare_training_data(collected_data)
+            training_data = DatabaseRaceSource(
+                self.db_path, self.feature_extractor, race_ids=list(collected_data)
+            )
         
         # モデル学習
         history = self.prediction_model.train_model(training_data, epochs=epochs)
@@ -1645,6 +2134,67 @@ class BoatRaceAI:
         logger.info("予測モデル学習完了")
         return history
     
+    def _predict_batch(self, race_features_list):
+        """推論サーバーのバッチ処理（1回の順伝播とリスク分析。要求と同じ順の予測のリスト）"""
+        computed = self.prediction_model.predict_races(race_features_list)
+        attach_risk_analysis(list(computed.values()), self.race_simulator)
+        return [computed[race_features["race_info"]["race_id"]] for race_features in race_features_list]
+    
+    def _cached_predictions(self, race_features_list):
+        """
+        キャッシュを使った一括予測 {race_id: 予測}
+        - 入力とモデルバージョンが前回と同じレースはキャッシュを返す
+        - 変わったレースだけ推論サーバーに回し（他のリクエストの分とまとめて推論される）、特徴量とともに保存
+        """
+        model_version = self.prediction_model.model_version
+        predictions = {}
+        stale = []
+        for race_features in race_features_list:
+            race_id = race_features["race_info"]["race_id"]
+            key = PredictionCache.make_key(self.prediction_model.feature_registry.input_hash(race_features), model_version)
+            prediction = self.current_predictions.lookup(race_id, key)
+            if prediction is not None:
+                predictions[race_id] = prediction
+            else:
+                stale.append((key, race_features))
+        
+        if stale:
+            computed = self.inference_server.predict(
+                [race_features for _, race_features in stale], timeout=self.INFERENCE_TIMEOUT
+            )
+            for (key, race_features), prediction in zip(stale, computed):
+                race_id = race_features["race_info"]["race_id"]
+                self.current_predictions.store(race_id, prediction, key=key, race_features=race_features)
+                predictions[race_id] = prediction
+        
+        logger.info(f"予測キャッシュ: {len(race_features_list) - len(stale)}件再利用 / {len(stale)}件再計算")
+        return predictions
+    
+    def _known_prediction(self, race_id):
+        """キャッシュ、なければ評価済み履歴にある予測"""
+        prediction = self.current_predictions.get(race_id)
+        if prediction is None and race_id in self.prediction_model.race_history:
+            prediction = self.prediction_model.race_history[race_id]["prediction"]
+        return prediction
+    
+    def _retire_finished_races(self, race_results):
+        """
+        評価の済んだレースをキャッシュから外し、オンライン更新が有効なら学習に回す
+        - race_results: {race_id: レース結果}
+        """
+        evicted = self.current_predictions.evict(race_results)
+        if self.online_learner is None or not evicted:
+            return None
+        
+        self.online_learner.add_races(
+            (race_id, entry["race_features"], race_results[race_id]) for race_id, entry in evicted.items()
+        )
+        try:
+            return self.online_learner.update()
+        except Exception as e:
+            logger.error(f"オンライン更新エラー: {str(e)}")
+            return None
+    
     def predict_daily_races(self, date=None):
         """指定日の全レースを予測"""
         if date is None:
@@ -1654,22 +2204,16 @@ class BoatRaceAI:
         
         # レース予定取得
         races = self.data_collector.get_race_schedule(date)
-        predictions = {}
         
-        # 各レースの予測
+        # 各レースの特徴量抽出
+        race_features_list = []
         for race in races:
-            race_id = race["race_id"]
-            
-            # 特徴量抽出
-            race_features = self.feature_extractor.get_race_features(race_id)
-            
+            race_features = self.feature_extractor.get_race_features(race["race_id"])
             if race_features:
-                # 予測実行
-                prediction = self.prediction_model.predict_race(race_features)
-                predictions[race_id] = prediction
+                race_features_list.append(race_features)
         
-        # 予測結果を保存
-        self.current_predictions.update(predictions)
+        # 入力かモデルが変わったレースだけ一括予測（リスク分析も1回のシミュレーションでまとめて計算）
+        predictions = self._cached_predictions(race_features_list)
         
         logger.info(f"日次予測完了: {len(predictions)}レース")
         return predictions
@@ -1684,14 +2228,14 @@ class BoatRaceAI:
         # レース予定取得
         races = self.data_collector.get_race_schedule(date)
         evaluations = {}
+        finished = {}
         
         # 各レースの評価
         for race in races:
             race_id = race["race_id"]
+            prediction = self._known_prediction(race_id)
             
-            if race_id in self.current_predictions:
-                prediction = self.current_predictions[race_id]
-                
+            if prediction is not None:
                 # レース結果取得
                 results = self.data_collector.get_race_results(race_id)
                 
@@ -1699,6 +2243,10 @@ class BoatRaceAI:
                     # 予測評価
                     evaluation = self.prediction_model.evaluate_prediction(prediction, results)
                     evaluations[race_id] = evaluation
+                    finished[race_id] = results
+        
+        # 評価済みのレースはキャッシュから外す（予測は race_history に残る）
+        self._retire_finished_races(finished)
         
         logger.info(f"日次評価完了: {len(evaluations)}レース")
         return evaluations
@@ -1745,8 +2293,12 @@ class BoatRaceAI:
         # 2. 昨日のレース結果収集
         self.data_collector.collect_race_results(yesterday)
         
-        # 3. 昨日の予測評価
+        # 3. 昨日の予測評価（終わった日のレースはキャッシュから外す）
         self.evaluate_daily_results(yesterday)
+        self.current_predictions.evict_before(today)
+        
+        # 会場別のコース1着率を昨日までの結果で再集計
+        self.venue_knowledge.refresh(today)
         
         # 4. 今日のレース予測
         self.predict_daily_races(today)
@@ -1799,6 +2351,7 @@ class BoatRaceAI:
                 target_races.append(race)
         
         # 結果取得と評価
+        finished = {}
         for race in target_races:
             race_id = race["race_id"]
             
@@ -1809,13 +2362,15 @@ class BoatRaceAI:
             # レース結果取得
             results = self.data_collector.get_race_results(race_id)
             
-            if race_id in self.current_predictions and results:
+            prediction = self.current_predictions.get(race_id)
+            if prediction is not None and results:
                 # 予測評価
-                evaluation = self.prediction_model.evaluate_prediction(
-                    self.current_predictions[race_id], 
-                    results
-                )
+                evaluation = self.prediction_model.evaluate_prediction(prediction, results)
                 logger.info(f"レース評価完了: {race_id}, 的中率: {evaluation['hit_rate']:.2f}")
+                finished[race_id] = results
+        
+        # 終了したレースはキャッシュから外す（予測は race_history に残る）
+        self._retire_finished_races(finished)
         
         return True
     
@@ -1838,7 +2393,8 @@ class BoatRaceAI:
             if race_hour >= current_hour and race_hour <= current_hour + 2:
                 upcoming_races.append(race)
         
-        # 最新データで予測更新
+        # 最新データで特徴量を作り直す
+        race_features_list = []
         for race in upcoming_races:
             race_id = race["race_id"]
             
@@ -1849,12 +2405,11 @@ class BoatRaceAI:
             
             # 特徴量抽出
             race_features = self.feature_extractor.get_race_features(race_id)
-            
             if race_features:
-                # 予測更新
-                prediction = self.prediction_model.predict_race(race_features)
-                self.current_predictions[race_id] = prediction
-                logger.info(f"レース予測更新: {race_id}")
+                race_features_list.append(race_features)
+        
+        # 入力が変わったレースだけ予測更新
+        self._cached_predictions(race_features_list)
         
         return True
     
@@ -1862,19 +2417,79 @@ class BoatRaceAI:
         """特定レースの予測を取得"""
         logger.info(f"レース予測取得: {race_id}")
         
-        # 予測が既にある場合は返す
-        if race_id in self.current_predictions:
-            return self.current_predictions[race_id]
-        
-        # ない場合は新規予測
+        # 入力とモデルが前回と同じならキャッシュを返し、変わっていれば再予測
         race_features = self.feature_extractor.get_race_features(race_id)
         
         if race_features:
-            prediction = self.prediction_model.predict_race(race_features)
-            self.current_predictions[race_id] = prediction
-            return prediction
+            return self._cached_predictions([race_features])[race_id]
+        
+        # 特徴量が取れない場合は手元の予測を返す
+        return self._known_prediction(race_id)
+    
+    def get_race_combinations(self, race_id, bet_types=BET_TYPES, top=None):
+        """特定レースの全組み合わせ確率表（券種ごとに確率順）"""
+        prediction = self.get_race_prediction(race_id)
+        if prediction is None:
+            return None
+        
+        tables = prediction_tables([prediction], bet_types=bet_types, top=top)
+        if race_id not in tables:
+            return None
         
-        return None
+        return {
+            "race_id": race_id,
+            "model_version": prediction.get("model_version"),
+            "ranking_head": prediction.get("ranking_head"),
+            "bet_type_names": {bet_type: BET_TYPE_NAMES[bet_type] for bet_type in bet_types},
+            "combinations": tables[race_id]
+        }
+    
+    def get_venue_day_predictions(self, races):
+        """
+        会場1日分（最大12レース）のルールベース予想とモデル予想をまとめて計算
+        - races: [{"race_id": レースID, "venue_code": 会場コード, "racers": 出走表の選手のリスト}]
+        - ルールベース予想は全レースの選手を1回で評価、モデル予想は1回の一括推論（入力が同じレースはキャッシュ）
+        - 戻り値: {race_id: {"rule_prediction": 総合予想 or None, "model_prediction": 予測 or None}}
+          （4艇未満のレースはルールベース予想なし、特徴量の取れないレースはモデル予想なし）
+        """
+        results = {race["race_id"]: {"rule_prediction": None, "model_prediction": None} for race in races}
+        
+        scorable = [race for race in races if len(race["racers"]) >= 4]
+        rule_predictions = self.get_comprehensive_predictions([
+            {"racers": race["racers"], "venue_code": race["venue_code"], "race_id": race["race_id"]}
+            for race in scorable
+        ])
+        for race, prediction in zip(scorable, rule_predictions):
+            results[race["race_id"]]["rule_prediction"] = prediction
+        
+        # モデル予想が出せなくてもルールベース予想と出走表は返す（失敗はレース単位）
+        race_features_list = []
+        for race in races:
+            try:
+                race_features = self.feature_extractor.get_race_features(race["race_id"])
+            except Exception as e:
+                logger.error(f"会場一括予測 特徴抽出エラー: {race['race_id']}: {str(e)}")
+                continue
+            if race_features and race_features["racers"]:
+                race_features_list.append(race_features)
+        
+        if race_features_list:
+            try:
+                predictions = self._cached_predictions(race_features_list)
+            except Exception as e:
+                # 一括推論が失敗したら1レースずつ推論し直し、失敗したレースだけモデル予想なしにする
+                logger.error(f"会場一括予測エラー: {str(e)}")
+                predictions = {}
+                for race_features in race_features_list:
+                    try:
+                        predictions.update(self._cached_predictions([race_features]))
+                    except Exception as e:
+                        logger.error(f"会場一括予測エラー: {race_features['race_info']['race_id']}: {str(e)}")
+            for race_id, prediction in predictions.items():
+                results[race_id]["model_prediction"] = prediction
+        
+        logger.info(f"会場一括予測: {len(races)}レース（ルール{len(scorable)} / モデル{len(race_features_list)}）")
+        return results
     
     def generate_daily_report(self, date=None):
         """日次レポート生成"""
@@ -1898,14 +2513,12 @@ class BoatRaceAI:
         evaluations = {}
         
         for race_id, results in race_results.items():
-            if race_id in self.current_predictions:
-                predictions[race_id] = self.current_predictions[race_id]
+            prediction = self._known_prediction(race_id)
+            if prediction is not None:
+                predictions[race_id] = prediction
                 
                 # 予測評価
-                evaluation = self.prediction_model.evaluate_prediction(
-                    self.current_predictions[race_id], 
-                    results
-                )
+                evaluation = self.prediction_model.evaluate_prediction(prediction, results)
                 evaluations[race_id] = evaluation
         
         # 的中率集計
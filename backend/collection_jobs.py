@@ -0,0 +1,321 @@
+"""
+収集ジョブ
+- 全会場スケジュール取得のような時間のかかる収集を、リクエストから切り離したジョブとして実行
+  （POST で受け付けてジョブIDを返し、進捗は GET で会場ごとに確認する）
+- ジョブと進捗は collection_jobs テーブルに保存（別プロセスのワーカーからも参照できる）
+- 実行はバックグラウンド更新のワーカーに積む（公式サイトへのアクセスを1本のスレッドで直列にする）
+- 同じ種類・同じパラメータのジョブが待機中・実行中なら新たに作らず、そのジョブを返す
+- ジョブには持ち主のプロセス（ホスト名:PID）と生存確認の時刻を記録し、持ち主が終了したジョブ・
+  生存確認が途絶えたジョブだけを中断扱いにする（同じDBを使う他のプロセスのジョブは残す）
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+logger = logging.getLogger('boatrace')
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# 生存確認の更新間隔と、途絶えたとみなすまでの秒数
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 300
+
+
+def _process_alive(pid):
+    """同じホストのプロセスが生きているか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class CollectionJobs:
+    """
+    収集ジョブの登録・実行・参照
+    - submit(job_type, params, func): ジョブを登録して (ジョブ, 新規か) を返す
+      func(progress_callback, **params) をワーカーで実行し、戻り値の件数を結果として保存
+    - run(job_type, params, func): 呼び出したスレッド（ワーカー上の更新処理）で登録から実行まで行う
+    - get(job_id) / recent(limit): ジョブの状態と進捗
+    - 待機中・実行中のジョブの heartbeat_at は、持ち主のプロセスが heartbeat_interval 秒ごとに更新する
+    """
+
+    def __init__(self, db_path, refresher, heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.db_path = db_path
+        self.refresher = refresher
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.hostname = socket.gethostname()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self.initialize_database()
+
+    @property
+    def owner(self):
+        """このプロセスの識別子（fork したワーカーでも自分の PID になるよう毎回作る）"""
+        return f"{self.hostname}:{os.getpid()}"
+
+    def initialize_database(self):
+        """テーブル作成（持ち主のいなくなった待機中・実行中のジョブは中断扱い）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collection_jobs (
+            job_id TEXT PRIMARY KEY,
+            job_type TEXT,
+            params TEXT,
+            status TEXT,
+            progress TEXT,
+            result_count INTEGER,
+            error_message TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            owner TEXT,
+            heartbeat_at TEXT
+        )
+        ''')
+        # 旧形式のテーブルには持ち主・生存確認の列を追加
+        cursor.execute('PRAGMA table_info(collection_jobs)')
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ('owner', 'heartbeat_at'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE collection_jobs ADD COLUMN {column} TEXT')
+        conn.commit()
+        try:
+            # 起動時点ではこのプロセスのジョブはまだないので、同じ PID の記録も前回のプロセスのもの
+            self._fail_orphaned(conn, own_jobs_alive=False)
+        finally:
+            conn.close()
+
+    def _orphaned(self, owner, heartbeat_at, cutoff, own_jobs_alive):
+        """持ち主のプロセスが終了した、または生存確認が途絶えたジョブか"""
+        if owner == self.owner:
+            return not own_jobs_alive
+        if heartbeat_at is None or heartbeat_at < cutoff:
+            return True
+        hostname, _, pid = (owner or "").rpartition(":")
+        if hostname != self.hostname or not pid.isdigit():
+            # 別ホストのプロセスは生存確認の時刻だけで判断
+            return False
+        return int(pid) == os.getpid() or not _process_alive(int(pid))
+
+    def _fail_orphaned(self, conn, own_jobs_alive=True):
+        """持ち主のいなくなった待機中・実行中のジョブを中断扱いにして件数を返す"""
+        cutoff = (datetime.now() - timedelta(seconds=self.heartbeat_timeout)).isoformat()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT job_id, owner, heartbeat_at FROM collection_jobs WHERE status IN (?, ?)
+        ''', ACTIVE_STATUSES)
+        orphaned = [
+            job_id for job_id, owner, heartbeat_at in cursor.fetchall()
+            if self._orphaned(owner, heartbeat_at, cutoff, own_jobs_alive)
+        ]
+        if orphaned:
+            finished_at = datetime.now().isoformat()
+            cursor.executemany('''
+            UPDATE collection_jobs
+            SET status = 'failed', error_message = '実行プロセスの停止により中断', finished_at = ?
+            WHERE job_id = ? AND status IN (?, ?)
+            ''', [(finished_at, job_id, *ACTIVE_STATUSES) for job_id in orphaned])
+            conn.commit()
+            logger.warning(f"収集ジョブ中断扱い: {len(orphaned)}件（持ち主の停止・生存確認の途絶）")
+        return len(orphaned)
+
+    # ===== 生存確認 =====
+    def _ensure_heartbeat(self):
+        """生存確認スレッドを開始（self._lock の中で呼ぶ）"""
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="collection-jobs-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self):
+        """このプロセスの待機中・実行中ジョブの heartbeat_at を更新して件数を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute('''
+            UPDATE collection_jobs SET heartbeat_at = ?
+            WHERE owner = ? AND status IN (?, ?)
+            ''', (datetime.now().isoformat(), self.owner, *ACTIVE_STATUSES))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _heartbeat_loop(self):
+        """自分のジョブがなくなるまで heartbeat_interval 秒ごとに生存確認を更新"""
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                try:
+                    if self._beat() == 0:
+                        self._heartbeat = None
+                        return
+                except Exception as e:
+                    logger.error(f"収集ジョブ生存確認エラー: {str(e)}")
+
+    # ===== 参照 =====
+    def _row_to_job(self, row):
+        (job_id, job_type, params, status, progress, result_count,
+         error_message, created_at, started_at, finished_at, owner, heartbeat_at) = row
+        progress = json.loads(progress) if progress else {}
+        venues = progress.get('venues', {})
+        return {
+            "job_id": job_id,
+            "job_type": job_type,
+            "params": json.loads(params) if params else {},
+            "status": status,
+            "progress": {
+                "total": len(venues),
+                "completed": sum(1 for venue in venues.values() if venue['status'] in ('done', 'failed')),
+                "venues": venues
+            },
+            "result_count": result_count,
+            "error": error_message,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "owner": owner,
+            "heartbeat_at": heartbeat_at
+        }
+
+    def _select(self, where, params, limit=None):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            SELECT job_id, job_type, params, status, progress, result_count,
+                   error_message, created_at, started_at, finished_at, owner, heartbeat_at
+            FROM collection_jobs
+            WHERE {where}
+            ORDER BY created_at DESC
+            {f"LIMIT {int(limit)}" if limit else ""}
+            ''', params)
+            return [self._row_to_job(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        """ジョブの状態と進捗（存在しなければ None）"""
+        jobs = self._select('job_id = ?', (job_id,))
+        return jobs[0] if jobs else None
+
+    def recent(self, limit=20):
+        """新しい順のジョブ一覧"""
+        return self._select('1 = 1', (), limit=limit)
+
+    # ===== 登録・更新 =====
+    def _update(self, job_id, **columns):
+        """列を更新（更新のたびに生存確認の時刻も進める）"""
+        columns["heartbeat_at"] = datetime.now().isoformat()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            conn.execute(f'UPDATE collection_jobs SET {assignments} WHERE job_id = ?',
+                         (*columns.values(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _register(self, job_type, params):
+        """
+        ジョブを登録して (ジョブID, 新規か) を返す
+        - 同じジョブが待機中・実行中ならそのID（持ち主のいなくなったジョブは先に中断扱いにする）
+        """
+        params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                self._fail_orphaned(conn)
+            finally:
+                conn.close()
+
+            active = self._select('job_type = ? AND params = ? AND status IN (?, ?)',
+                                  (job_type, params_json, *ACTIVE_STATUSES), limit=1)
+            if active:
+                return active[0]["job_id"], False
+
+            job_id = uuid.uuid4().hex
+            now = datetime.now().isoformat()
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute('''
+                INSERT INTO collection_jobs (job_id, job_type, params, status, progress, created_at, owner, heartbeat_at)
+                VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)
+                ''', (job_id, job_type, params_json, json.dumps({"venues": {}}), now, self.owner, now))
+                conn.commit()
+            finally:
+                conn.close()
+            self._ensure_heartbeat()
+
+        logger.info(f"収集ジョブ登録: {job_type} {params_json} ({job_id})")
+        return job_id, True
+
+    def submit(self, job_type, params, func):
+        """ジョブを登録してワーカーに積む（同じジョブが待機中・実行中ならそれを返す）"""
+        job_id, created = self._register(job_type, params)
+        if created:
+            # ジョブIDごとのキーなので間隔制限はかからない
+            self.refresher.trigger(f"job:{job_id}", self._run, job_id, func, params)
+        return self.get(job_id), created
+
+    def run(self, job_type, params, func):
+        """
+        ジョブを登録してこのスレッドで実行し、終了後のジョブを返す（失敗なら例外）
+        - バックグラウンド更新の処理から呼ぶ（成否がそのまま更新の成否になる）
+        - 同じジョブが待機中・実行中なら実行せずにそのジョブを返す
+        """
+        job_id, created = self._register(job_type, params)
+        if created:
+            self._run(job_id, func, params)
+        job = self.get(job_id)
+        if job["status"] == 'failed':
+            raise RuntimeError(f"収集ジョブ失敗: {job_id}: {job['error']}")
+        return job
+
+    def _run(self, job_id, func, params):
+        """ワーカーでの実行（進捗は会場ごとに保存）"""
+        venues = {}
+        progress_lock = threading.Lock()
+
+        def progress_callback(venue_code, status, venue_name=None, race_count=0):
+            with progress_lock:
+                venue = venues.setdefault(venue_code, {"venue_name": venue_name, "status": status, "races": 0})
+                venue["status"] = status
+                venue["races"] = race_count
+                if venue_name:
+                    venue["venue_name"] = venue_name
+                self._update(job_id, progress=json.dumps({"venues": venues}, ensure_ascii=False))
+
+        self._update(job_id, status='running', started_at=datetime.now().isoformat())
+        try:
+            result = func(progress_callback, **params)
+            self._update(job_id, status='succeeded', result_count=len(result or []),
+                         finished_at=datetime.now().isoformat())
+            logger.info(f"収集ジョブ完了: {job_id} ({len(result or [])}件)")
+        except Exception as e:
+            self._update(job_id, status='failed', error_message=str(e),
+                         finished_at=datetime.now().isoformat())
+            logger.error(f"収集ジョブエラー: {job_id}: {str(e)}")
+
+    def stats(self):
+        """システムステータス用"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM collection_jobs GROUP BY status')
+            return dict(cursor.fetchall())
+        finally:
+            conn.close()
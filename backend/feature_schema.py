@@ -0,0 +1,318 @@
+"""
+特徴量スキーマレジストリ
+- preprocess_features の選手特徴量（N_RACER_FEATURES 次元）のレイアウトを特徴量グループ単位でバージョン管理
+- モデルは学習時のスキーマを記録し、ロード時に定義が変わったグループを検出（再学習が必要）
+- グループの計算は辞書の参照程度のため、計算済みベクトルは保存せず毎回計算する
+"""
+
+import hashlib
+import json
+import logging
+
+from venue_knowledge import DEFAULT_COURSE_WIN_RATES, N_COURSES, VENUE_NAMES
+
+logger = logging.getLogger("BoatraceAI")
+
+# 水面情報の数値変換
+WIND_DIRECTION_MAPPING = {
+    "北": 0, "北東": 45, "東": 90, "南東": 135,
+    "南": 180, "南西": 225, "西": 270, "北西": 315
+}
+WEATHER_MAPPING = {
+    "晴": 0, "曇": 1, "雨": 2, "荒天": 3
+}
+
+COMMENT_TOPICS = ["スタート", "コース", "調子", "機材", "外部要因"]
+
+
+def _json_default(value):
+    """numpy型などJSON非対応の値を変換"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def hash_inputs(inputs):
+    """入力値の正規化ハッシュ"""
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=_json_default)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class FeatureGroup:
+    """
+    特徴量グループ定義
+    - name: グループ名
+    - version: 定義のバージョン（計算ロジックを変えたら必ず上げる）
+    - columns: 出力する列名
+    - extract: (racer, race_info) -> 計算に使う入力値（ハッシュ対象）
+    - compute: 入力値 -> 特徴量リスト
+    """
+
+    def __init__(self, name, version, columns, extract, compute):
+        self.name = name
+        self.version = version
+        self.columns = list(columns)
+        self.extract = extract
+        self.compute = compute
+
+    @property
+    def schema_version(self):
+        """グループ単位のスキーマ識別子"""
+        return f"{self.name}@{self.version}"
+
+
+# ===== 選手特徴量グループ定義 =====
+def _extract_position(racer, race_info):
+    position = racer["position"]
+    return {key: position[key] for key in ("boat_number", "course", "motor_number", "boat_id", "weight")}
+
+
+def _compute_position(inputs):
+    # 艇番・コース情報
+    return [
+        inputs["boat_number"],
+        inputs["course"],
+        inputs["motor_number"],
+        inputs["boat_id"],
+        inputs["weight"],
+    ]
+
+
+def _extract_racer_stats(racer, race_info):
+    stats = racer["statistics"]
+    return {key: stats[key] for key in ("avg_rank", "win_rate", "top3_rate", "avg_start_time", "recent_races") if key in stats}
+
+
+def _compute_racer_stats(inputs):
+    # 選手成績統計
+    return [
+        inputs.get("avg_rank", 3.5),  # デフォルト値
+        inputs.get("win_rate", 0.0),
+        inputs.get("top3_rate", 0.0),
+        inputs.get("avg_start_time", 0.2),
+        inputs.get("recent_races", 0),
+    ]
+
+
+def _extract_course_stats(racer, race_info):
+    course = racer["position"]["course"]
+    course_performance = racer["statistics"].get("course_performance", {})
+    return {
+        "course_1": course_performance.get(1, {}),
+        "current_course": course_performance.get(course, {}),
+    }
+
+
+def _compute_course_stats(inputs):
+    return [
+        # コース別成績（1コースの場合）
+        inputs["course_1"].get("avg_rank", 3.5),
+        inputs["course_1"].get("win_rate", 0.0),
+        # コース別成績（現在のコース）
+        inputs["current_course"].get("avg_rank", 3.5),
+        inputs["current_course"].get("win_rate", 0.0),
+    ]
+
+
+def _extract_venue_stats(racer, race_info):
+    # 会場別成績は race_results.venue（会場名）で集計されているため、会場コードを会場名に直して引く
+    venue_performance = racer["statistics"].get("venue_performance", {})
+    venue_code = race_info["venue"]
+    # 会場ナレッジのコース別1着率（FeatureSchemaRegistry が race_info に付ける。なければ全国平均の目安）
+    course = int(racer["position"]["course"] or 0)
+    course_win_rates = race_info.get("venue_course_win_rates", DEFAULT_COURSE_WIN_RATES)
+    return {
+        "venue": venue_performance.get(VENUE_NAMES.get(venue_code, venue_code), {}),
+        "course_win_rate": float(course_win_rates[course - 1]) if 1 <= course <= N_COURSES else 0.0,
+    }
+
+
+def _compute_venue_stats(inputs):
+    # 会場での成績 + 会場のそのコースの1着率
+    return [
+        inputs["venue"].get("avg_rank", 3.5),
+        inputs["venue"].get("win_rate", 0.0),
+        inputs["course_win_rate"],
+    ]
+
+
+def _extract_weather_stats(racer, race_info):
+    weather_perf = racer["weather_performance"]
+    return {key: weather_perf[key] for key in ("avg_rank", "win_rate", "race_count") if key in weather_perf}
+
+
+def _compute_weather_stats(inputs):
+    # 天候条件での成績
+    return [
+        inputs.get("avg_rank", 3.5),
+        inputs.get("win_rate", 0.0),
+        inputs.get("race_count", 0),
+    ]
+
+
+def _extract_comment(racer, race_info):
+    comment_analysis = racer["comment_analysis"]
+    return {key: comment_analysis[key] for key in ("sentiment", "confidence", "key_topics") if key in comment_analysis}
+
+
+def _compute_comment(inputs):
+    key_topics = inputs.get("key_topics", [])
+    # コメント分析 + トピック（ダミー変数）
+    return [
+        inputs.get("sentiment", 0.0),
+        inputs.get("confidence", 0.0),
+    ] + [1 if topic in key_topics else 0 for topic in COMMENT_TOPICS]
+
+
+RACER_FEATURE_GROUPS = [
+    FeatureGroup(
+        "position", 1,
+        ["boat_number", "course", "motor_number", "boat_id", "weight"],
+        _extract_position, _compute_position
+    ),
+    FeatureGroup(
+        "racer_stats", 1,
+        ["avg_rank", "win_rate", "top3_rate", "avg_start_time", "recent_races"],
+        _extract_racer_stats, _compute_racer_stats
+    ),
+    FeatureGroup(
+        "course_stats", 1,
+        ["course1_avg_rank", "course1_win_rate", "course_avg_rank", "course_win_rate"],
+        _extract_course_stats, _compute_course_stats
+    ),
+    FeatureGroup(
+        "venue_stats", 3,
+        ["venue_avg_rank", "venue_win_rate", "venue_course_win_rate"],
+        _extract_venue_stats, _compute_venue_stats
+    ),
+    FeatureGroup(
+        "weather_stats", 1,
+        ["weather_avg_rank", "weather_win_rate", "weather_race_count"],
+        _extract_weather_stats, _compute_weather_stats
+    ),
+    FeatureGroup(
+        "comment", 1,
+        ["sentiment", "confidence"] + [f"topic_{topic}" for topic in COMMENT_TOPICS],
+        _extract_comment, _compute_comment
+    ),
+]
+
+
+# ===== 水面特徴量グループ定義 =====
+def _extract_water(race_features, race_info):
+    water_data = race_features["water_condition"]
+    return {
+        key: water_data[key]
+        for key in ("temperature", "water_temperature", "wave_height", "wind_direction", "wind_speed", "weather")
+        if key in water_data
+    }
+
+
+def _compute_water(inputs):
+    return [
+        inputs.get("temperature", 25.0),
+        inputs.get("water_temperature", 20.0),
+        inputs.get("wave_height", 0.0),
+        WIND_DIRECTION_MAPPING.get(inputs.get("wind_direction", "北"), 0),
+        inputs.get("wind_speed", 0.0),
+        WEATHER_MAPPING.get(inputs.get("weather", "晴"), 0),
+    ]
+
+
+WATER_FEATURE_GROUP = FeatureGroup(
+    "water", 1,
+    ["temperature", "water_temperature", "wave_height", "wind_direction", "wind_speed", "weather"],
+    _extract_water, _compute_water
+)
+
+# モデル入力の次元（選手特徴量・水面特徴量）
+N_RACER_FEATURES = sum(len(group.columns) for group in RACER_FEATURE_GROUPS)
+N_WATER_FEATURES = len(WATER_FEATURE_GROUP.columns)
+
+
+class FeatureSchemaRegistry:
+    """
+    特徴量スキーマレジストリ
+    - グループ定義の一覧と全体のスキーマバージョンを管理
+    - venue_knowledge: 会場コード -> 会場特性（course_win_rates を含む）を get で引ける会場表
+      （VenueKnowledgeBase か、バックテスト用の table_as_of の結果。省略時は全国平均の目安）
+    """
+
+    def __init__(self, racer_groups=None, water_group=None, venue_knowledge=None):
+        self.racer_groups = racer_groups or RACER_FEATURE_GROUPS
+        self.water_group = water_group or WATER_FEATURE_GROUP
+        self.venue_knowledge = venue_knowledge
+
+    @property
+    def groups(self):
+        return self.racer_groups + [self.water_group]
+
+    @property
+    def racer_columns(self):
+        return [column for group in self.racer_groups for column in group.columns]
+
+    @property
+    def water_columns(self):
+        return list(self.water_group.columns)
+
+    @property
+    def schema_version(self):
+        """全グループ定義から決まるスキーマバージョン"""
+        definition = [(group.name, group.version, group.columns) for group in self.groups]
+        return hash_inputs(definition)[:12]
+
+    def describe(self):
+        """モデルと一緒に保存するスキーマ情報"""
+        return {
+            "schema_version": self.schema_version,
+            "groups": {group.name: group.version for group in self.groups},
+            "racer_columns": self.racer_columns,
+            "water_columns": self.water_columns,
+        }
+
+    def diff(self, recorded):
+        """記録済みスキーマとの差分（変更のあったグループ名）"""
+        recorded_groups = (recorded or {}).get("groups", {})
+        return sorted(
+            group.name for group in self.groups
+            if recorded_groups.get(group.name) != group.version
+        )
+
+    def _race_info(self, race_features):
+        """レース情報に会場表のコース別1着率を付けたもの（選手特徴量の抽出用）"""
+        race_info = race_features["race_info"]
+        venue = self.venue_knowledge.get(race_info["venue"]) if self.venue_knowledge is not None else None
+        if venue is None:
+            return race_info
+        return dict(race_info, venue_course_win_rates=venue["course_win_rates"])
+
+    def _compute_group(self, group, inputs_list):
+        """グループの特徴量を計算"""
+        return [group.compute(inputs) for inputs in inputs_list]
+
+    def racer_vectors(self, race_features):
+        """各選手の特徴量ベクトル（N_RACER_FEATURES 次元）"""
+        race_info = self._race_info(race_features)
+        racers = race_features["racers"]
+        rows = [[] for _ in racers]
+
+        for group in self.racer_groups:
+            inputs_list = [group.extract(racer, race_info) for racer in racers]
+            for row, vector in zip(rows, self._compute_group(group, inputs_list)):
+                row.extend(vector)
+
+        return rows
+
+    def water_vector(self, race_features):
+        """水面状況の特徴量ベクトル（6次元）"""
+        inputs = self.water_group.extract(race_features, race_features["race_info"])
+        return self._compute_group(self.water_group, [inputs])[0]
+
+    def input_hash(self, race_features):
+        """レース全体の入力ハッシュ（キャッシュキー用。会場表の更新でも変わる）"""
+        race_info = self._race_info(race_features)
+        parts = [self.schema_version]
+        for group in self.racer_groups:
+            parts.append([hash_inputs(group.extract(racer, race_info)) for racer in race_features["racers"]])
+        parts.append(hash_inputs(self.water_group.extract(race_features, race_info)))
+        return hash_inputs(parts)
@@ -0,0 +1,324 @@
+"""
+ハイパーパラメータ探索
+- 学習データアーカイブ（train_model が作る training_archive）からスケーリング済みテンソルを1回だけ作成
+- テンソルは .npy に保存し、各ワーカーは mmap で読むため全設定で同じデータを共有
+- 設定ごとの学習はプロセスプールで並列実行（ワーカーごとにスレッド数を制限してコアの取り合いを防ぐ）
+- 設定ごとの指標は results.jsonl に完了順で追記
+  （再開時は設定・アーカイブ・エポック数などが同じ結果だけを完了済みとして扱う）
+
+使い方:
+    python hyperparameter_sweep.py --archive models/training_archive --epochs 20
+    python hyperparameter_sweep.py --grid '{"learning_rate": [0.001, 0.0003], "dropout": [0.1, 0.3]}'
+    python hyperparameter_sweep.py --db boatrace_data.db --samples 16 --workers 4 --threads-per-worker 2
+"""
+
+import argparse
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from feature_schema import N_RACER_FEATURES
+from training_pipeline import FeatureArchive
+
+logger = logging.getLogger("BoatraceAI")
+
+# 既定の探索範囲（create_model の config キー）
+DEFAULT_SWEEP_GRID = {
+    "racer_units": [[64, 32, 16], [128, 64, 16], [32, 16]],
+    "merged_units": [16, 32, 64],
+    "dropout": [0.1, 0.2, 0.3],
+    "learning_rate": [0.003, 0.001, 0.0003],
+}
+
+TENSOR_NAMES = ["racers", "water", "labels"]
+
+
+def expand_grid(grid, samples=None, seed=0):
+    """探索範囲を設定のリストに展開（samples 指定時は無作為に抽出）"""
+    keys = sorted(grid)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    if samples and samples < len(configs):
+        rng = np.random.default_rng(seed)
+        configs = [configs[i] for i in sorted(rng.choice(len(configs), samples, replace=False))]
+    return configs
+
+
+def config_id(config):
+    """設定の識別子（同じ設定なら常に同じ値）"""
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode("utf-8"), digest_size=4).hexdigest()
+
+
+def resume_key(config, source, epochs, batch_size, seed, patience):
+    """再開時に結果を再利用してよいかの識別子（設定に加えて、元のアーカイブと学習条件が同じ場合のみ一致）"""
+    settings = {"config_id": config_id(config), "source": source, "epochs": epochs,
+                "batch_size": batch_size, "seed": seed, "patience": patience}
+    return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _tensor_source(tensor_dir):
+    """テンソルの元になったアーカイブの fingerprint"""
+    with open(os.path.join(tensor_dir, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)["source"]
+
+
+def prepare_tensor_set(archive, tensor_dir, chunk_rows=65536):
+    """
+    スケーリング済みの学習・検証テンソルを作成（アーカイブが変わっていなければ再利用）
+    - スケーラーは学習側の行だけで partial_fit（train_model と同じ扱い）
+    - 書き出しは open_memmap にチャンク単位で行い、全件をメモリに載せない
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    meta_path = os.path.join(tensor_dir, "meta.json")
+    fingerprint = archive.fingerprint()
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("source") == fingerprint:
+            logger.info(f"キャッシュ済みテンソルを再利用: {tensor_dir}")
+            return meta
+
+    os.makedirs(tensor_dir, exist_ok=True)
+    racers = archive.column("racers")
+    water = archive.column("water")
+    labels = archive.column("labels")
+    flags = archive.column("validation")
+
+    scaler = StandardScaler()
+    for start in range(0, len(archive), chunk_rows):
+        chunk = racers[start:start + chunk_rows][flags[start:start + chunk_rows] == 0]
+        if len(chunk):
+            scaler.partial_fit(chunk)
+    if not hasattr(scaler, "mean_"):
+        raise ValueError("学習データがありません")
+
+    counts = {}
+    for split, flag in (("train", 0), ("val", 1)):
+        rows = int(np.count_nonzero(flags[:] == flag))
+        counts[split] = rows
+        outputs = {
+            "racers": np.lib.format.open_memmap(os.path.join(tensor_dir, f"{split}_racers.npy"), mode="w+", dtype=np.float32, shape=(rows, N_RACER_FEATURES)),
+            "water": np.lib.format.open_memmap(os.path.join(tensor_dir, f"{split}_water.npy"), mode="w+", dtype=np.float32, shape=(rows, 6)),
+            "labels": np.lib.format.open_memmap(os.path.join(tensor_dir, f"{split}_labels.npy"), mode="w+", dtype=np.uint8, shape=(rows,)),
+        }
+        offset = 0
+        for start in range(0, len(archive), chunk_rows):
+            mask = flags[start:start + chunk_rows] == flag
+            n = int(np.count_nonzero(mask))
+            if n == 0:
+                continue
+            outputs["racers"][offset:offset + n] = scaler.transform(racers[start:start + chunk_rows][mask])
+            outputs["water"][offset:offset + n] = water[start:start + chunk_rows][mask]
+            outputs["labels"][offset:offset + n] = labels[start:start + chunk_rows][mask]
+            offset += n
+        for output in outputs.values():
+            output.flush()
+        del outputs
+
+    meta = {"source": fingerprint, "rows": counts, "created_at": datetime.datetime.now().isoformat()}
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"テンソル作成完了: 学習{counts['train']}行 / 検証{counts['val']}行")
+    return meta
+
+
+def load_tensor_split(tensor_dir, split):
+    """mmap で読み込み（ページキャッシュを全ワーカーで共有）"""
+    return {
+        name: np.load(os.path.join(tensor_dir, f"{split}_{name}.npy"), mmap_mode="r")
+        for name in TENSOR_NAMES
+    }
+
+
+def _init_worker(threads):
+    """ワーカー初期化: TensorFlow を読み込む前にスレッド数を制限"""
+    for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[name] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def train_config(config, tensor_dir, epochs, batch_size, seed, patience):
+    """1設定分の学習（ワーカープロセス内で実行）"""
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping
+    from boat_race_prediction_system import BoatRacePredictionModel
+
+    tf.keras.utils.set_random_seed(seed)
+    train = load_tensor_split(tensor_dir, "train")
+    val = load_tensor_split(tensor_dir, "val")
+    has_validation = len(val["labels"]) > 0
+    monitor = "val_loss" if has_validation else "loss"
+
+    # create_model だけを使う（レジストリ・保存済みモデルには触れない）
+    model = BoatRacePredictionModel.create_model(config)
+    started = time.perf_counter()
+    history = model.fit(
+        [np.asarray(train["racers"]), np.asarray(train["water"])],
+        np.eye(6, dtype=np.float32)[train["labels"]],
+        validation_data=(
+            [np.asarray(val["racers"]), np.asarray(val["water"])],
+            np.eye(6, dtype=np.float32)[val["labels"]]
+        ) if has_validation else None,
+        epochs=epochs,
+        batch_size=batch_size,
+        callbacks=[EarlyStopping(monitor=monitor, patience=patience, restore_best_weights=True)],
+        verbose=0
+    )
+    train_seconds = time.perf_counter() - started
+
+    losses = history.history[monitor]
+    best_epoch = int(np.argmin(losses))
+    metrics = {name: float(values[best_epoch]) for name, values in history.history.items()}
+    if has_validation:
+        # 予測上位2順位に実際の順位が入る割合（選手単位）
+        probs = model.predict([np.asarray(val["racers"]), np.asarray(val["water"])], batch_size=4096, verbose=0)
+        metrics["val_top2_accuracy"] = float(np.mean(
+            np.any(np.argsort(-probs, axis=1)[:, :2] == np.asarray(val["labels"])[:, None], axis=1)
+        ))
+
+    return {
+        "config_id": config_id(config),
+        "config": config,
+        "metrics": metrics,
+        "best_epoch": best_epoch + 1,
+        "epochs_run": len(losses),
+        "params": int(model.count_params()),
+        "train_seconds": round(train_seconds, 2),
+        "seed": seed,
+    }
+
+
+def run_sweep(configs, tensor_dir, results_path, workers, threads_per_worker, epochs=20, batch_size=256,
+              seed=42, patience=3):
+    """設定一覧をプロセスプールで並列に学習し、指標を results_path に追記"""
+    source = _tensor_source(tensor_dir)
+    keys = {config_id(config): resume_key(config, source, epochs, batch_size, seed, patience) for config in configs}
+    done = set()
+    if os.path.exists(results_path):
+        done = {result.get("resume_key") for result in load_results(results_path)}
+    pending = [config for config in configs if keys[config_id(config)] not in done]
+    if done:
+        logger.info(f"完了済みの設定をスキップ: {len(configs) - len(pending)}件")
+
+    results = []
+    # TensorFlow は fork と相性が悪いため spawn で起動
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(threads_per_worker,)) as executor:
+        futures = {
+            executor.submit(train_config, config, tensor_dir, epochs, batch_size, seed, patience): config
+            for config in pending
+        }
+        for future in as_completed(futures):
+            config = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"設定の学習に失敗: {config}: {str(e)}")
+                result = {"config_id": config_id(config), "config": config, "error": str(e)}
+            result.update(resume_key=keys[config_id(config)], source=source, epochs=epochs)
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results.append(result)
+            logger.info(f"設定完了 ({len(results)}/{len(pending)}): {result['config_id']} {result.get('metrics', {})}")
+
+    return results
+
+
+def load_results(results_path):
+    with open(results_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_summary(results, metric, top):
+    """指標順の一覧を表示"""
+    ok = [r for r in results if metric in r.get("metrics", {})]
+    reverse = not metric.endswith("loss")
+    ok.sort(key=lambda r: r["metrics"][metric], reverse=reverse)
+    print(f"{'config_id':<10}{metric:>18}{'epochs':>8}{'params':>9}{'train s':>9}  config")
+    for r in ok[:top]:
+        print(f"{r['config_id']:<10}{r['metrics'][metric]:>18.4f}{r['epochs_run']:>8}{r['params']:>9}"
+              f"{r['train_seconds']:>9.1f}  {json.dumps(r['config'], sort_keys=True)}")
+    failed = len(results) - len(ok)
+    if failed:
+        print(f"失敗・指標なし: {failed}件")
+
+
+def _build_archive_from_db(db_path, archive, model_dir):
+    """DBの全レース結果から学習データアーカイブを作成"""
+    from boat_race_prediction_system import BoatRaceFeatureExtractor, BoatRacePredictionModel
+    from training_pipeline import DatabaseRaceSource, StreamingTrainingPipeline
+
+    prediction_model = BoatRacePredictionModel(model_dir=model_dir)
+    source = DatabaseRaceSource(db_path, BoatRaceFeatureExtractor(db_path))
+    StreamingTrainingPipeline(prediction_model).build_archive(source, archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="順位予測モデルのハイパーパラメータ探索")
+    parser.add_argument("--archive", default=os.path.join("models", "training_archive"))
+    parser.add_argument("--db", help="アーカイブがない場合にDBから作成")
+    parser.add_argument("--output-dir", default=os.path.join("models", "sweeps"))
+    parser.add_argument("--grid", help="探索範囲（JSON文字列またはファイルパス）")
+    parser.add_argument("--samples", type=int, help="探索範囲から無作為に選ぶ設定数")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--patience", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--workers", type=int, help="既定: CPUコア数 / threads-per-worker")
+    parser.add_argument("--metric", default="val_accuracy")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    archive = FeatureArchive(args.archive)
+    if len(archive) == 0:
+        if not args.db:
+            parser.error(f"学習データアーカイブがありません: {args.archive}（--db で作成できます）")
+        _build_archive_from_db(args.db, archive, os.path.dirname(os.path.abspath(args.archive)))
+
+    grid = DEFAULT_SWEEP_GRID
+    if args.grid:
+        if os.path.exists(args.grid):
+            with open(args.grid, "r", encoding="utf-8") as f:
+                grid = json.load(f)
+        else:
+            grid = json.loads(args.grid)
+    configs = expand_grid(grid, samples=args.samples, seed=args.seed)
+
+    tensor_dir = os.path.join(args.output_dir, "tensors")
+    prepare_tensor_set(archive, tensor_dir)
+
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+    results_path = os.path.join(args.output_dir, "results.jsonl")
+    logger.info(f"探索開始: {len(configs)}設定, ワーカー{workers} x {args.threads_per_worker}スレッド")
+
+    started = time.perf_counter()
+    run_sweep(configs, tensor_dir, results_path, workers, args.threads_per_worker,
+              epochs=args.epochs, batch_size=args.batch_size, seed=args.seed, patience=args.patience)
+    logger.info(f"探索完了: {time.perf_counter() - started:.1f}秒")
+
+    # 今回の設定・アーカイブ・学習条件の結果だけを集計
+    source = _tensor_source(tensor_dir)
+    current = {resume_key(config, source, args.epochs, args.batch_size, args.seed, args.patience) for config in configs}
+    print_summary([r for r in load_results(results_path) if r.get("resume_key") in current], args.metric, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+推論サーバー（マイクロバッチ）
+- APIのリクエストスレッドは推論を直接呼ばず、キューに入れて Future を受け取る
+- 専用のワーカースレッドが最初の要求から max_wait_ms 以内に届いた要求を
+  最大 max_batch_size 件までまとめ、1回の推論（順伝播 + リスク分析）で処理する
+- モデルを触るのはワーカースレッドだけなので、同時リクエストでもスレッドセーフ
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger("BoatraceAI")
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+
+_STOP = object()
+
+
+class MicroBatchInferenceServer:
+    """
+    要求をまとめて推論するワーカー
+    - predict_batch(items) -> items と同じ順・同じ長さの結果のリスト
+    - submit(item) / submit_many(items) は Future を返す（ワーカーはここで初めて起動）
+    """
+
+    def __init__(self, predict_batch, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 name="inference-server"):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size は1以上を指定してください: {max_batch_size}")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.stats_counts = {"requests": 0, "batches": 0, "errors": 0, "max_batch": 0, "busy_seconds": 0.0}
+
+    def start(self):
+        """ワーカースレッドを開始（起動済みなら何もしない）"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+                logger.info(f"推論サーバー開始: 最大{self.max_batch_size}件 / 待ち{self.max_wait * 1000:.1f}ms")
+        return self._worker
+
+    def stop(self, timeout=None):
+        """キューに残った要求を処理してからワーカーを止める"""
+        with self._lock:
+            worker = self._worker
+            self._worker = None
+        if worker is not None and worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join(timeout)
+
+    def submit(self, item):
+        """1件の推論要求（結果は Future.result() で受け取る）"""
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items):
+        """複数件の推論要求（同じバッチに入りやすいよう続けてキューに入れる）"""
+        self.start()
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return futures
+
+    def predict(self, items, timeout=None):
+        """要求を出して結果を待つ（items と同じ順の結果のリスト）"""
+        return [future.result(timeout) for future in self.submit_many(items)]
+
+    def _collect(self, first):
+        """最初の要求から max_wait の間、max_batch_size 件まで要求を集める"""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        stop = False
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                stop = True
+                break
+            batch.append(request)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect(first)
+
+            # キャンセル済みの要求は推論しない
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.predict_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"推論結果の件数が要求と一致しません: {len(results)} != {len(batch)}")
+        except Exception as e:
+            if len(batch) > 1:
+                # 1件の不正な入力で同じバッチの他の要求まで失敗させないよう、1件ずつやり直す
+                logger.warning(f"推論サーバーのバッチ失敗（{len(batch)}件）、1件ずつ再実行: {str(e)}")
+                for request in batch:
+                    self._process([request])
+                return
+            logger.error(f"推論サーバーエラー: {str(e)}")
+            batch[0][1].set_exception(e)
+            errors = 1
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            errors = 0
+
+        with self._lock:
+            counts = self.stats_counts
+            counts["requests"] += len(batch)
+            counts["batches"] += 1
+            counts["errors"] += errors
+            counts["max_batch"] = max(counts["max_batch"], len(batch))
+            counts["busy_seconds"] += time.perf_counter() - started
+
+    def stats(self):
+        """システムステータス用の統計"""
+        with self._lock:
+            counts = dict(self.stats_counts)
+            running = self._worker is not None and self._worker.is_alive()
+        return dict(
+            counts,
+            busy_seconds=round(counts["busy_seconds"], 3),
+            mean_batch=round(counts["requests"] / counts["batches"], 2) if counts["batches"] else 0.0,
+            queue_depth=self._queue.qsize(),
+            running=running,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait * 1000
+        )
@@ -0,0 +1,225 @@
+"""
+レース単位（リストワイズ）の着順モデル
+- 1レース6艇をまとめて入力し、各艇の強さ（スコア）を1つずつ出力
+- 艇ごとの埋め込みに「レース全体の平均埋め込み」と水面状況を結合してからスコア化するため、
+  他艇との力関係がスコアに反映される
+- 学習は Plackett-Luce の負の対数尤度（実際の着順が生成される確率）を最小化
+- 着順確率は plackett_luce.py でスコアから計算するため、艇ごとの着順分布が互いに矛盾しない
+- 推論は NumPy のみ（学習時だけ TensorFlow を使用）
+"""
+
+import logging
+
+import numpy as np
+
+from feature_schema import N_RACER_FEATURES
+from numpy_inference import NumpyStandardScaler, load_arrays, save_arrays
+from plackett_luce import N_BOATS
+from training_pipeline import is_validation_race
+
+logger = logging.getLogger("BoatraceAI")
+
+LISTWISE_MODEL_FILENAME = "listwise_model.npz"
+
+DEFAULT_LISTWISE_CONFIG = {
+    "racer_units": [64, 32],
+    "embedding_units": 16,
+    "water_units": 8,
+    "joint_units": 32,
+    "learning_rate": 0.001,
+}
+
+
+def _relu(x):
+    return np.maximum(x, 0)
+
+
+def build_race_tensors(source, feature_registry, validation_ratio=0.2):
+    """
+    レース供給元からレース単位のテンソルを作成
+    - racers (n, 6, N_RACER_FEATURES) / water (n, 6) は未スケーリングの特徴量
+    - ranks (n, 6) は各艇の着順 1-6（0 は失格・欠場など着順なし）
+    - 6艇揃っていないレースは対象外
+    """
+    racers, water, ranks, validation, race_ids = [], [], [], [], []
+    for race_id, race_features, race_results in source:
+        if len(race_features["racers"]) != N_BOATS:
+            continue
+
+        rank_by_boat = {
+            result["boat_number"]: result["rank"]
+            for result in race_results
+            if result["rank"] is not None and 1 <= result["rank"] <= N_BOATS
+        }
+        race_ranks = [rank_by_boat.get(racer["position"]["boat_number"], 0) for racer in race_features["racers"]]
+        if not any(race_ranks):
+            continue
+
+        racers.append(feature_registry.racer_vectors(race_features))
+        water.append(feature_registry.water_vector(race_features))
+        ranks.append(race_ranks)
+        validation.append(is_validation_race(race_id, validation_ratio))
+        race_ids.append(race_id)
+
+    return {
+        "racers": np.array(racers, dtype=np.float32).reshape(-1, N_BOATS, N_RACER_FEATURES),
+        "water": np.array(water, dtype=np.float32).reshape(-1, 6),
+        "ranks": np.array(ranks, dtype=np.int8).reshape(-1, N_BOATS),
+        "validation": np.array(validation, dtype=bool),
+        "race_ids": race_ids,
+    }
+
+
+def race_inputs(race_features_list, feature_registry):
+    """推論用の (n, 6, N_RACER_FEATURES) / (n, 6) 入力（未スケーリング）"""
+    racers = np.array([feature_registry.racer_vectors(rf) for rf in race_features_list], dtype=np.float32)
+    water = np.array([feature_registry.water_vector(rf) for rf in race_features_list], dtype=np.float32)
+    return racers.reshape(-1, N_BOATS, N_RACER_FEATURES), water.reshape(-1, 6)
+
+
+def plackett_luce_loss(y_true, y_pred):
+    """
+    Plackett-Luce の負の対数尤度（Keras の損失関数）
+    - y_true: (batch, 6) 各艇の着順（0 は着順なしで最後尾扱い）
+    - y_pred: (batch, 6) 各艇のスコア（対数強さ）
+    """
+    import tensorflow as tf
+
+    ranks = tf.cast(y_true, y_pred.dtype)
+    valid = ranks > 0
+    effective = tf.where(valid, ranks, tf.cast(N_BOATS + 1, y_pred.dtype))
+
+    # at_risk[b, i, j]: 艇 i の着位が決まる時点で艇 j がまだ残っている
+    at_risk = effective[:, None, :] >= effective[:, :, None]
+    masked = tf.where(at_risk, y_pred[:, None, :], tf.fill(tf.shape(at_risk), tf.cast(-1e9, y_pred.dtype)))
+    log_denominator = tf.reduce_logsumexp(masked, axis=-1)
+    log_likelihood = tf.where(valid, y_pred - log_denominator, tf.zeros_like(y_pred))
+    return -tf.reduce_sum(log_likelihood, axis=-1)
+
+
+def build_keras_model(config=None):
+    """学習用のKerasモデル（層名は NumPy 推論と対応）"""
+    from tensorflow.keras.layers import Concatenate, Dense, GlobalAveragePooling1D, Input, RepeatVector, Reshape
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.optimizers import Adam
+
+    config = dict(DEFAULT_LISTWISE_CONFIG, **(config or {}))
+
+    racer_input = Input(shape=(N_BOATS, N_RACER_FEATURES), name="racer_features")
+    water_input = Input(shape=(6,), name="water_features")
+
+    # 艇ごとの埋め込み（全艇で重みを共有）
+    x = racer_input
+    for i, units in enumerate(config["racer_units"], start=1):
+        x = Dense(units, activation="relu", name=f"racer_dense{i}")(x)
+    embedding = Dense(config["embedding_units"], activation="relu", name="racer_embedding")(x)
+
+    # レース全体の文脈と水面状況を各艇に配る
+    context = RepeatVector(N_BOATS)(GlobalAveragePooling1D()(embedding))
+    water = RepeatVector(N_BOATS)(Dense(config["water_units"], activation="relu", name="water_dense")(water_input))
+
+    joint = Concatenate(axis=-1)([embedding, context, water])
+    joint = Dense(config["joint_units"], activation="relu", name="joint_dense")(joint)
+    scores = Reshape((N_BOATS,))(Dense(1, name="score")(joint))
+
+    model = Model(inputs=[racer_input, water_input], outputs=scores)
+    model.compile(optimizer=Adam(learning_rate=config["learning_rate"]), loss=plackett_luce_loss)
+    return model
+
+
+def fit_scaler(racers):
+    """選手特徴量のスケーラー（StandardScaler と同じく分散0の列は1で割る）"""
+    flat = np.asarray(racers, dtype=np.float64).reshape(-1, racers.shape[-1])
+    scale = flat.std(axis=0)
+    scale[scale == 0] = 1.0
+    return NumpyStandardScaler(flat.mean(axis=0), scale)
+
+
+def fit_listwise_model(race_tensors, config=None, epochs=10, batch_size=64, seed=42, verbose=1):
+    """レース単位テンソルでリストワイズモデルを学習"""
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    tf.keras.utils.set_random_seed(seed)
+    config = dict(DEFAULT_LISTWISE_CONFIG, **(config or {}))
+
+    train = ~race_tensors["validation"]
+    val = race_tensors["validation"]
+    if not train.any():
+        raise ValueError("学習データがありません")
+
+    scaler = fit_scaler(race_tensors["racers"][train])
+
+    def inputs(mask):
+        racers = scaler.transform(race_tensors["racers"][mask]).astype(np.float32)
+        return [racers, race_tensors["water"][mask]]
+
+    has_validation = bool(val.any())
+    model = build_keras_model(config)
+    history = model.fit(
+        inputs(train),
+        race_tensors["ranks"][train].astype(np.float32),
+        validation_data=(inputs(val), race_tensors["ranks"][val].astype(np.float32)) if has_validation else None,
+        epochs=epochs,
+        batch_size=batch_size,
+        callbacks=[EarlyStopping(monitor="val_loss" if has_validation else "loss", patience=5, restore_best_weights=True)],
+        verbose=verbose
+    )
+
+    engine = ListwiseRankModel.from_keras(model, scaler, config)
+    logger.info(f"リストワイズモデル学習完了: {int(train.sum())}レース")
+    return engine, history
+
+
+class ListwiseRankModel:
+    """
+    リストワイズモデルのNumPy実装
+    - predict_scores(X_racers (n, 6, N_RACER_FEATURES), X_water (n, 6)) は各艇の対数強さ (n, 6)
+    - 入力は未スケーリングの特徴量（スケーラーを内包）
+    """
+
+    def __init__(self, layers, scaler, config, metadata=None):
+        self.layers = layers
+        self.scaler = scaler
+        self.config = dict(DEFAULT_LISTWISE_CONFIG, **(config or {}))
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_keras(cls, model, scaler, config=None):
+        layers = {}
+        for layer in model.layers:
+            weights = layer.get_weights()
+            if len(weights) == 2 and weights[0].ndim == 2:
+                layers[layer.name] = (weights[0].astype(np.float32), weights[1].astype(np.float32))
+        return cls(layers, scaler, config)
+
+    @classmethod
+    def load(cls, path):
+        layers, scaler, metadata = load_arrays(path)
+        logger.info(f"リストワイズモデルロード完了: {path}")
+        return cls(layers, scaler, metadata.get("config"), metadata)
+
+    def save(self, path, metadata=None):
+        self.metadata = dict(self.metadata, **(metadata or {}), config=self.config)
+        return save_arrays(path, self.layers, self.scaler, self.metadata)
+
+    def _dense(self, name, x, activation=_relu):
+        kernel, bias = self.layers[name]
+        return activation(x @ kernel + bias)
+
+    def predict_scores(self, X_racers, X_water):
+        """各艇の対数強さ (n, 6)"""
+        X_racers = np.asarray(X_racers, dtype=np.float64).reshape(-1, N_BOATS, N_RACER_FEATURES)
+        X_water = np.asarray(X_water, dtype=np.float32).reshape(-1, 6)
+        x = self.scaler.transform(X_racers).astype(np.float32)
+
+        for i in range(1, len(self.config["racer_units"]) + 1):
+            x = self._dense(f"racer_dense{i}", x)
+        embedding = self._dense("racer_embedding", x)
+
+        context = np.broadcast_to(embedding.mean(axis=1, keepdims=True), embedding.shape)
+        water = self._dense("water_dense", X_water)[:, None, :]
+        water = np.broadcast_to(water, (len(X_water), N_BOATS, water.shape[-1]))
+
+        joint = self._dense("joint_dense", np.concatenate([embedding, context, water], axis=-1))
+        return self._dense("score", joint, activation=lambda v: v)[..., 0]
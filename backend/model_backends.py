@@ -0,0 +1,162 @@
+"""
+選手単位の着順モデルのバックエンド
+- 共通インターフェース: fit(X, y, X_val, y_val) / predict_proba(X) / save(directory) / load(directory)
+    X: スケーリング済みの選手特徴量 N_RACER_FEATURES 列 + 水面状況 N_WATER_FEATURES 列
+    y: 着順 0-5
+    predict_proba: (n, 6) の着順確率
+- "keras": 既存のMLP（BoatRacePredictionModel.create_model）。推論はNumPyエンジン
+- "hist_gbt": scikit-learn の HistGradientBoostingClassifier（推論にも scikit-learn が必要）
+"""
+
+import logging
+import os
+import pickle
+
+import numpy as np
+
+from feature_schema import N_RACER_FEATURES, N_WATER_FEATURES
+
+logger = logging.getLogger("BoatraceAI")
+
+N_RANKS = 6
+
+
+def split_features(X):
+    """(n, 選手 + 水面) を Keras モデルの入力 [選手 (n, N_RACER_FEATURES), 水面 (n, N_WATER_FEATURES)] に分ける"""
+    X = np.asarray(X, dtype=np.float32)
+    return [X[:, :N_RACER_FEATURES], X[:, N_RACER_FEATURES:]]
+
+
+class FitHistory:
+    """Keras の History 互換（history 属性に {指標: [エポックごとの値]}）"""
+
+    def __init__(self, history):
+        self.history = history
+
+
+class KerasRankBackend:
+    """Keras MLP バックエンド"""
+
+    name = "keras"
+    FILENAME = "boatrace_model.h5"
+
+    def __init__(self, config=None, model=None, epochs=10, batch_size=32, patience=5):
+        self.config = config
+        self.model = model
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.patience = patience
+        self._engine = None
+
+    def fit(self, X, y, X_val=None, y_val=None):
+        from tensorflow.keras.callbacks import EarlyStopping
+
+        from boat_race_prediction_system import BoatRacePredictionModel
+
+        has_validation = X_val is not None and len(X_val) > 0
+        monitor = "val_loss" if has_validation else "loss"
+
+        self.model = BoatRacePredictionModel.create_model(self.config)
+        history = self.model.fit(
+            split_features(X), np.eye(N_RANKS, dtype=np.float32)[y],
+            validation_data=(split_features(X_val), np.eye(N_RANKS, dtype=np.float32)[y_val]) if has_validation else None,
+            epochs=self.epochs,
+            batch_size=self.batch_size,
+            callbacks=[EarlyStopping(monitor=monitor, patience=self.patience, restore_best_weights=True)],
+            verbose=0
+        )
+        self._engine = None
+        return history
+
+    def predict_proba(self, X):
+        # サービング時と同じくNumPyエンジンで推論
+        if self._engine is None:
+            from numpy_inference import NumpyRankModel
+
+            self._engine = NumpyRankModel.from_keras(self.model)
+        return self._engine.predict(split_features(X))
+
+    def save(self, directory):
+        path = os.path.join(directory, self.FILENAME)
+        self.model.save(path)
+        return path
+
+    @classmethod
+    def load(cls, directory):
+        from tensorflow.keras.models import load_model
+
+        return cls(model=load_model(os.path.join(directory, cls.FILENAME), compile=False))
+
+
+class HistGradientBoostingRankBackend:
+    """勾配ブースティング木（HistGradientBoostingClassifier）バックエンド"""
+
+    name = "hist_gbt"
+    FILENAME = "rank_gbt.pkl"
+
+    DEFAULT_PARAMS = {
+        "max_iter": 300,
+        "learning_rate": 0.1,
+        "max_leaf_nodes": 31,
+        "min_samples_leaf": 40,
+        "l2_regularization": 1.0,
+        "early_stopping": True,
+        "validation_fraction": 0.1,
+        "n_iter_no_change": 10,
+        "random_state": 42,
+    }
+
+    def __init__(self, config=None, model=None):
+        self.params = dict(self.DEFAULT_PARAMS, **(config or {}))
+        self.model = model
+
+    def fit(self, X, y, X_val=None, y_val=None):
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        self.model = HistGradientBoostingClassifier(**self.params)
+        self.model.fit(np.asarray(X, dtype=np.float32), np.asarray(y))
+
+        # 早期終了用の内部検証スコアは負の対数損失
+        history = {"loss": list(-self.model.train_score_)}
+        if len(self.model.validation_score_):
+            history["internal_val_loss"] = list(-self.model.validation_score_)
+        if X_val is not None and len(X_val) > 0:
+            probs = self.predict_proba(X_val)
+            y_val = np.asarray(y_val)
+            history["val_loss"] = [float(-np.log(np.clip(probs[np.arange(len(y_val)), y_val], 1e-12, None)).mean())]
+            history["val_accuracy"] = [float(np.mean(probs.argmax(axis=1) == y_val))]
+        logger.info(f"勾配ブースティング学習完了: {self.model.n_iter_}反復")
+        return FitHistory(history)
+
+    def predict_proba(self, X):
+        probs = self.model.predict_proba(np.asarray(X, dtype=np.float32))
+        if probs.shape[1] == N_RANKS:
+            return probs
+        # 学習データに現れなかった着順の列は0で埋める
+        full = np.zeros((len(probs), N_RANKS), dtype=probs.dtype)
+        full[:, self.model.classes_.astype(int)] = probs
+        return full
+
+    def save(self, directory):
+        path = os.path.join(directory, self.FILENAME)
+        with open(path, "wb") as f:
+            pickle.dump(self.model, f)
+        return path
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, cls.FILENAME), "rb") as f:
+            return cls(model=pickle.load(f))
+
+
+MODEL_BACKENDS = {
+    KerasRankBackend.name: KerasRankBackend,
+    HistGradientBoostingRankBackend.name: HistGradientBoostingRankBackend,
+}
+
+
+def create_backend(name, config=None, **kwargs):
+    """名前からバックエンドを作成"""
+    if name not in MODEL_BACKENDS:
+        raise ValueError(f"未対応のモデルバックエンドです: {name}（{', '.join(MODEL_BACKENDS)}）")
+    return MODEL_BACKENDS[name](config=config, **kwargs)
@@ -0,0 +1,239 @@
+"""
+モデルレジストリ
+- 学習済みモデルをバージョンごとのディレクトリに保存（versions/<version>/）
+- 各バージョンに manifest.json（ファイルサイズ・SHA-256・スキーマ・指標）を記録
+- 稼働中のバージョンは registry.json の current が指す（一時ファイル + os.replace で原子的に更新）
+- registry.json の読み込み〜書き換えは registry.lock のファイルロックで直列化
+  （学習プロセスとAPIワーカーが同時に登録・有効化しても更新が失われない）
+- 書き込み途中のディレクトリは .staging- 接頭辞で作り、完成後にリネームして公開
+- 有効化の履歴を保持し、ロールバックはポインタを1つ前に戻すだけ
+
+ディレクトリ構成:
+    models/
+        registry.json
+        registry.lock
+        versions/
+            20250101-060000-1a2b3c/
+                manifest.json
+                boatrace_model.h5
+                features_scaler.pkl
+                feature_schema.json
+                rank_model.npz
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+# プロセス間ロック（fcntl がない環境ではプロセス内のロックのみ）
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger("BoatraceAI")
+
+REGISTRY_FILENAME = "registry.json"
+LOCK_FILENAME = "registry.lock"
+MANIFEST_FILENAME = "manifest.json"
+VERSIONS_DIRNAME = "versions"
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    """一時ファイルに書いてから置き換え（読み手が書きかけを見ることはない）"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """バージョン管理されたモデル成果物の保存先"""
+
+    def __init__(self, model_dir="models"):
+        self.model_dir = model_dir
+        self.versions_dir = os.path.join(model_dir, VERSIONS_DIRNAME)
+        self.registry_path = os.path.join(model_dir, REGISTRY_FILENAME)
+        self.lock_path = os.path.join(model_dir, LOCK_FILENAME)
+        self._lock = threading.Lock()
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """registry.json の読み込み〜書き換えを、スレッド間・プロセス間で排他"""
+        with self._lock:
+            with open(self.lock_path, "a") as lock_file:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if FCNTL_AVAILABLE:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    # ===== 読み出し =====
+    def read(self):
+        """registry.json の内容（未作成なら空）"""
+        if not os.path.exists(self.registry_path):
+            return {"current": None, "history": [], "versions": {}}
+        with open(self.registry_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def current_version(self):
+        return self.read().get("current")
+
+    def version_path(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def current_path(self):
+        """稼働中バージョンのディレクトリ（未登録なら None）"""
+        version = self.current_version()
+        return self.version_path(version) if version else None
+
+    def resolve_dir(self):
+        """成果物の読み込み元（レジストリ導入前のモデルは model_dir 直下）"""
+        return self.current_path() or self.model_dir
+
+    def manifest(self, version):
+        with open(os.path.join(self.version_path(version), MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def list_versions(self):
+        """登録済みバージョン一覧（新しい順）"""
+        registry = self.read()
+        versions = []
+        for version, entry in registry.get("versions", {}).items():
+            versions.append(dict(entry, version=version, active=version == registry.get("current")))
+        return sorted(versions, key=lambda v: v["created_at"], reverse=True)
+
+    def verify(self, version):
+        """manifest に記録したサイズ・ハッシュと一致するか確認"""
+        directory = self.version_path(version)
+        for filename, info in self.manifest(version)["files"].items():
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path) or os.path.getsize(path) != info["size"]:
+                raise ValueError(f"モデル成果物が不完全です: {version}/{filename}")
+            if _sha256(path) != info["sha256"]:
+                raise ValueError(f"モデル成果物のハッシュ不一致: {version}/{filename}")
+        return True
+
+    # ===== 書き込み =====
+    def publish(self, write_artifacts, metadata=None, activate=True):
+        """
+        新しいバージョンを登録
+        - write_artifacts(directory) で成果物をステージングディレクトリに書き出す
+        - manifest を書いてからディレクトリ名を確定させ、registry.json に登録
+        """
+        version = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        staging_dir = os.path.join(self.versions_dir, f".staging-{version}")
+        os.makedirs(staging_dir)
+
+        try:
+            write_artifacts(staging_dir)
+
+            files = {}
+            for filename in sorted(os.listdir(staging_dir)):
+                path = os.path.join(staging_dir, filename)
+                if os.path.isfile(path):
+                    files[filename] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+
+            created_at = datetime.datetime.now().isoformat()
+            manifest = dict(metadata or {}, version=version, created_at=created_at, files=files)
+            _write_json_atomic(os.path.join(staging_dir, MANIFEST_FILENAME), manifest)
+            os.rename(staging_dir, self.version_path(version))
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        with self._locked():
+            registry = self.read()
+            registry["versions"][version] = {
+                "created_at": created_at,
+                "schema_version": manifest.get("schema_version"),
+                "metrics": manifest.get("metrics", {}),
+                "model_config": manifest.get("model_config"),
+            }
+            _write_json_atomic(self.registry_path, registry)
+
+        logger.info(f"モデルバージョン登録: {version}")
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        """稼働バージョンを切り替え（ポインタの更新のみ）"""
+        if not os.path.isdir(self.version_path(version)):
+            raise ValueError(f"存在しないモデルバージョンです: {version}")
+
+        with self._locked():
+            registry = self.read()
+            if registry.get("current") == version:
+                return version
+            if registry.get("current"):
+                registry["history"].append(registry["current"])
+            registry["current"] = version
+            registry["activated_at"] = datetime.datetime.now().isoformat()
+            _write_json_atomic(self.registry_path, registry)
+
+        logger.info(f"モデルバージョン有効化: {version}")
+        return version
+
+    def rollback_target(self):
+        """rollback で戻る先のバージョン（なければ ValueError）"""
+        history = [v for v in self.read().get("history", []) if os.path.isdir(self.version_path(v))]
+        if not history:
+            raise ValueError("ロールバック先のバージョンがありません")
+        return history[-1]
+
+    def rollback(self):
+        """1つ前に有効だったバージョンへ戻す"""
+        with self._locked():
+            registry = self.read()
+            history = registry.get("history", [])
+            while history and not os.path.isdir(self.version_path(history[-1])):
+                history.pop()
+            if not history:
+                raise ValueError("ロールバック先のバージョンがありません")
+
+            registry["current"] = history.pop()
+            registry["activated_at"] = datetime.datetime.now().isoformat()
+            _write_json_atomic(self.registry_path, registry)
+
+        logger.warning(f"モデルバージョンをロールバック: {registry['current']}")
+        return registry["current"]
+
+    def prune(self, keep=10):
+        """古いバージョンを削除（稼働中と直近の履歴は残す）"""
+        with self._locked():
+            registry = self.read()
+            protected = {registry.get("current")} | set(registry.get("history", [])[-keep:])
+            ordered = sorted(registry["versions"], key=lambda v: registry["versions"][v]["created_at"], reverse=True)
+
+            removed = [v for v in ordered[keep:] if v not in protected]
+            for version in removed:
+                shutil.rmtree(self.version_path(version), ignore_errors=True)
+                del registry["versions"][version]
+            registry["history"] = [v for v in registry.get("history", []) if v in registry["versions"]]
+            _write_json_atomic(self.registry_path, registry)
+
+        if removed:
+            logger.info(f"古いモデルバージョンを削除: {removed}")
+        return removed
@@ -0,0 +1,463 @@
+"""
+NumPy推論エンジン
+- create_model で構築した順位予測MLPの重みとスケーラーを .npz に書き出し
+- TensorFlowなしで同じ順伝播（既定は 選手特徴量→64→32→16 + 6→8 → 結合 → 32 → 6 softmax）を計算
+- 選手側の層数・ユニット数は create_model の config に応じて可変
+- サービング時はTensorFlowのインポート自体が不要
+- 量子化版（float16 / int8 出力チャンネル単位）は1ファイルにまとめ、np.memmap で読み込む
+  （pickle の復元もコピーもなく、複数ワーカーでOSのページキャッシュを共有できる）
+
+使い方:
+    python numpy_inference.py export --model-dir models
+    python numpy_inference.py verify --model-dir models
+    python numpy_inference.py quantize --model-dir models
+    python numpy_inference.py evaluate --model-dir models [--archive data/archive]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+logger = logging.getLogger("BoatraceAI")
+
+NUMPY_MODEL_FILENAME = "rank_model.npz"
+
+# 量子化版の成果物（dtype ごとに1ファイル）
+QUANTIZED_DTYPES = ("float16", "int8")
+QUANTIZED_MODEL_FILENAMES = {dtype: f"rank_model.{dtype}.bin" for dtype in QUANTIZED_DTYPES}
+
+# 量子化ファイルの先頭: マジック + ヘッダ(JSON)長。配列は ARRAY_ALIGNMENT バイト境界に配置
+QUANTIZED_MAGIC = b"BRQ1"
+ARRAY_ALIGNMENT = 64
+
+# 層名付きでない旧モデル（レイヤー名が自動採番）は、Denseレイヤーの (入力次元, 出力次元) で対応付ける
+LAYER_SHAPES = {
+    "racer_dense1": (26, 64),
+    "racer_dense2": (64, 32),
+    "racer_output": (32, 16),
+    "water_dense": (6, 8),
+    "merged_dense": (24, 32),
+    "rank_probs": (32, 6),
+}
+
+
+def _relu(x):
+    return np.maximum(x, 0)
+
+
+def _softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    e = np.exp(x)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def racer_layer_names(names):
+    """選手側の層名を順伝播の順に並べる（racer_dense1, racer_dense2, ..., racer_output）"""
+    hidden = [name for name in names if re.fullmatch(r"racer_dense\d+", name)]
+    return sorted(hidden, key=lambda name: int(name[len("racer_dense"):])) + ["racer_output"]
+
+
+def extract_dense_weights(model):
+    """Kerasモデルから Dense 層の重みを役割名付きで取り出す"""
+    by_name = {}
+    by_shape = {}
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if len(weights) == 2 and weights[0].ndim == 2:
+            kernel, bias = weights
+            by_name[layer.name] = (kernel, bias)
+            by_shape[tuple(kernel.shape)] = (kernel, bias)
+
+    # create_model で層名を付けたモデル
+    if "racer_output" in by_name and "merged_dense" in by_name:
+        names = racer_layer_names(by_name) + ["water_dense", "merged_dense", "rank_probs"]
+        return {name: by_name[name] for name in names}
+
+    layers = {}
+    for name, shape in LAYER_SHAPES.items():
+        if shape not in by_shape:
+            raise ValueError(f"想定外のモデル構造です: {shape} のDense層がありません")
+        layers[name] = by_shape[shape]
+    return layers
+
+
+def save_arrays(path, layers, scaler=None, metadata=None):
+    """Dense層の重み・スケーラー・メタデータを .npz に原子的に書き出す"""
+    arrays = {}
+    for name, (kernel, bias) in layers.items():
+        arrays[f"{name}/kernel"] = np.asarray(kernel, dtype=np.float32)
+        arrays[f"{name}/bias"] = np.asarray(bias, dtype=np.float32)
+
+    if scaler is not None:
+        arrays["scaler/mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+        arrays["scaler/scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    arrays["metadata"] = np.array(json.dumps(metadata or {}, ensure_ascii=False))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_arrays(path):
+    """save_arrays で書き出した .npz を (layers, scaler, metadata) として読み込む"""
+    with np.load(path) as data:
+        names = [key[:-len("/kernel")] for key in data.files if key.endswith("/kernel")]
+        layers = {
+            name: (data[f"{name}/kernel"], data[f"{name}/bias"])
+            for name in names
+        }
+        scaler = None
+        if "scaler/mean" in data:
+            scaler = NumpyStandardScaler(data["scaler/mean"], data["scaler/scale"])
+        metadata = json.loads(str(data["metadata"])) if "metadata" in data else {}
+    return layers, scaler, metadata
+
+
+def quantize_kernel(kernel, dtype):
+    """
+    Dense層の重みを量子化
+    - float16: そのまま半精度に変換（スケールなし）
+    - int8: 出力チャンネル（列）ごとに最大絶対値が127になるよう対称量子化
+    戻り値: (量子化済み重み, 列ごとのスケール or None)
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    if dtype == "float16":
+        return kernel.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.abs(kernel).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        quantized = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+        return quantized, scale.astype(np.float32)
+    raise ValueError(f"未対応の量子化形式です: {dtype}")
+
+
+def dense_forward(x, layer):
+    """
+    Dense層の順伝播（活性化なし）
+    - layer: (kernel, bias) または int8 の場合 (kernel, bias, 列ごとのスケール)
+    """
+    kernel, bias = layer[0], layer[1]
+    if kernel.dtype == np.float32:
+        return x @ kernel + bias
+    out = x @ kernel.astype(np.float32)
+    if len(layer) > 2:
+        out *= layer[2]
+    return out + bias
+
+
+def save_quantized(path, layers, scaler=None, metadata=None, dtype="int8"):
+    """
+    Dense層の重みを量子化し、スケーラーの平均・標準偏差とあわせて1ファイルに原子的に書き出す
+    - 形式: マジック / ヘッダ長 (uint32) / ヘッダ JSON（配列の offset・dtype・shape とメタデータ）/ 配列本体
+    """
+    arrays = {}
+    for name, (kernel, bias) in layers.items():
+        quantized, scale = quantize_kernel(kernel, dtype)
+        arrays[f"{name}/kernel"] = quantized
+        arrays[f"{name}/bias"] = np.asarray(bias, dtype=np.float32)
+        if scale is not None:
+            arrays[f"{name}/scale"] = scale
+
+    if scaler is not None:
+        arrays["scaler/mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+        arrays["scaler/scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    # 配列の配置（ヘッダ長が決まらないと先頭位置が決まらないため、相対位置で記録）
+    index = {}
+    offset = 0
+    for key, array in arrays.items():
+        index[key] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    header = json.dumps({
+        "quantization": dtype,
+        "layers": list(layers),
+        "arrays": index,
+        "metadata": metadata or {},
+    }, ensure_ascii=False).encode("utf-8")
+    prefix = len(QUANTIZED_MAGIC) + 4 + len(header)
+    data_start = -(-prefix // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(QUANTIZED_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for key, array in arrays.items():
+            f.seek(data_start + index[key]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_quantized(path):
+    """
+    save_quantized で書き出したファイルを (layers, scaler, metadata) として読み込む
+    - 配列は読み取り専用の memmap 上のビュー（コピーしない）
+    """
+    with open(path, "rb") as f:
+        if f.read(len(QUANTIZED_MAGIC)) != QUANTIZED_MAGIC:
+            raise ValueError(f"量子化モデルの形式が不正です: {path}")
+        header_length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    prefix = len(QUANTIZED_MAGIC) + 4 + header_length
+    data_start = -(-prefix // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def array(key):
+        info = header["arrays"][key]
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        view = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + info["offset"])
+        return view.reshape(info["shape"])
+
+    layers = {}
+    for name in header["layers"]:
+        layer = (array(f"{name}/kernel"), array(f"{name}/bias"))
+        if f"{name}/scale" in header["arrays"]:
+            layer += (array(f"{name}/scale"),)
+        layers[name] = layer
+
+    scaler = None
+    if "scaler/mean" in header["arrays"]:
+        scaler = NumpyStandardScaler(array("scaler/mean"), array("scaler/scale"))
+    metadata = dict(header["metadata"], quantization=header["quantization"])
+    return layers, scaler, metadata
+
+
+def export_rank_model(model, scaler, path, metadata=None):
+    """順位予測モデルとスケーラーを .npz に書き出し"""
+    save_arrays(path, extract_dense_weights(model), scaler, metadata)
+    logger.info(f"NumPy推論モデル書き出し完了: {path}")
+    return path
+
+
+class NumpyStandardScaler:
+    """StandardScaler.transform 相当（平均・標準偏差のみ保持）"""
+
+    def __init__(self, mean, scale):
+        # float64 の memmap はそのまま参照する（コピーしない）
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+    def to_sklearn(self):
+        """学習時と同じ形式（StandardScaler）に戻す（features_scaler.pkl に保存する場合）"""
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        scaler.mean_ = np.array(self.mean_, dtype=np.float64)
+        scaler.scale_ = np.array(self.scale_, dtype=np.float64)
+        scaler.var_ = scaler.scale_ ** 2
+        scaler.n_features_in_ = len(scaler.mean_)
+        return scaler
+
+
+class NumpyRankModel:
+    """
+    順位予測MLPのNumPy実装
+    - predict([X_racers, X_water]) はKerasモデルと同じ入出力
+    """
+
+    def __init__(self, layers, scaler=None, metadata=None):
+        self.layers = layers
+        self.scaler = scaler
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_keras(cls, model, scaler=None):
+        """Kerasモデルから直接構築"""
+        layers = {
+            name: (kernel.astype(np.float32), bias.astype(np.float32))
+            for name, (kernel, bias) in extract_dense_weights(model).items()
+        }
+        numpy_scaler = NumpyStandardScaler(scaler.mean_, scaler.scale_) if scaler is not None else None
+        return cls(layers, numpy_scaler)
+
+    @classmethod
+    def load(cls, path):
+        """.npz から読み込み"""
+        layers, scaler, metadata = load_arrays(path)
+        logger.info(f"NumPy推論モデルロード完了: {path}")
+        return cls(layers, scaler, metadata)
+
+    @classmethod
+    def load_quantized(cls, path):
+        """量子化版を memmap で読み込み"""
+        layers, scaler, metadata = load_quantized(path)
+        logger.info(f"量子化推論モデルロード完了: {path} ({metadata['quantization']})")
+        return cls(layers, scaler, metadata)
+
+    @property
+    def quantization(self):
+        return self.metadata.get("quantization", "float32")
+
+    @property
+    def n_racer_features(self):
+        """選手側の入力列数（最初の選手層のカーネルの行数）"""
+        return self.layers[racer_layer_names(self.layers)[0]][0].shape[0]
+
+    def save(self, path):
+        """.npz に書き出し（TensorFlowなしで新バージョンへ引き継ぐ場合）"""
+        if self.quantization != "float32":
+            raise ValueError("量子化済みモデルは .npz に書き出せません")
+        return save_arrays(path, self.layers, self.scaler, self.metadata)
+
+    def save_quantized(self, path, dtype="int8"):
+        """量子化版を書き出し（元になるのは float32 の重み）"""
+        if self.quantization != "float32":
+            raise ValueError("量子化済みモデルは再量子化できません")
+        return save_quantized(path, self.layers, self.scaler, self.metadata, dtype=dtype)
+
+    def _dense(self, name, x, activation=_relu):
+        return activation(dense_forward(x, self.layers[name]))
+
+    def predict(self, inputs):
+        """着順確率 (n, 6) を返す"""
+        X_racers, X_water = inputs
+        X_racers = np.asarray(X_racers, dtype=np.float32)
+        X_water = np.asarray(X_water, dtype=np.float32)
+
+        racer = X_racers
+        for name in racer_layer_names(self.layers):
+            racer = self._dense(name, racer)
+        water = self._dense("water_dense", X_water)
+
+        merged = np.concatenate([racer, water], axis=1)
+        merged = self._dense("merged_dense", merged)
+        # Dropoutは推論時は恒等写像
+        return self._dense("rank_probs", merged, activation=_softmax)
+
+
+def _load_keras_artifacts(model_dir):
+    """学習済みKerasモデルとスケーラーを読み込む（エクスポート用）"""
+    import pickle
+    from tensorflow.keras.models import load_model
+
+    model = load_model(os.path.join(model_dir, "boatrace_model.h5"))
+    scaler = None
+    scaler_path = os.path.join(model_dir, "features_scaler.pkl")
+    if os.path.exists(scaler_path):
+        with open(scaler_path, "rb") as f:
+            scaler = pickle.load(f)
+    return model, scaler
+
+
+def _evaluation_inputs(engine, args):
+    """評価用の入力（スケール済み）と正解の着順。--archive があれば検証行、なければ乱数"""
+    if args.archive:
+        from training_pipeline import FeatureArchive
+
+        archive = FeatureArchive(args.archive)
+        rows = np.flatnonzero(archive.column("validation"))[:args.samples]
+        X_racers = engine.scaler.transform(archive.column("racers")[rows]).astype(np.float32)
+        return X_racers, np.asarray(archive.column("water")[rows]), np.asarray(archive.column("labels")[rows])
+
+    rng = np.random.default_rng(0)
+    X_racers = rng.normal(size=(args.samples, engine.n_racer_features)).astype(np.float32)
+    X_water = rng.normal(size=(args.samples, 6)).astype(np.float32)
+    return X_racers, X_water, None
+
+
+def evaluate_quantization(model_dir, args):
+    """量子化版と float32 版の予測の差・精度・ファイルサイズ・ロード時間を比較"""
+    import tempfile
+
+    float_path = os.path.join(model_dir, NUMPY_MODEL_FILENAME)
+    start = time.perf_counter()
+    engine = NumpyRankModel.load(float_path)
+    rows = [("float32", os.path.getsize(float_path), time.perf_counter() - start, engine)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for dtype in QUANTIZED_DTYPES:
+            path = os.path.join(model_dir, QUANTIZED_MODEL_FILENAMES[dtype])
+            if not os.path.exists(path):
+                path = engine.save_quantized(os.path.join(tmp_dir, QUANTIZED_MODEL_FILENAMES[dtype]), dtype)
+            start = time.perf_counter()
+            quantized = NumpyRankModel.load_quantized(path)
+            rows.append((dtype, os.path.getsize(path), time.perf_counter() - start, quantized))
+
+        X_racers, X_water, labels = _evaluation_inputs(engine, args)
+        expected = engine.predict([X_racers, X_water])
+
+        print(f"samples: {len(X_racers)} ({'archive' if labels is not None else 'random'})")
+        header = f"{'dtype':<9}{'bytes':>9}{'load ms':>9}{'max|Δp|':>10}{'mean|Δp|':>10}{'argmax一致':>11}"
+        if labels is not None:
+            header += f"{'top1':>8}{'Δtop1':>8}{'logloss':>9}{'Δlogloss':>10}"
+        print(header)
+
+        base_metrics = None
+        for dtype, size, seconds, model in rows:
+            probs = model.predict([X_racers, X_water])
+            diff = np.abs(probs - expected)
+            line = (f"{dtype:<9}{size:>9}{seconds * 1000:>9.2f}{diff.max():>10.2e}{diff.mean():>10.2e}"
+                    f"{np.mean(probs.argmax(1) == expected.argmax(1)):>11.4f}")
+            if labels is not None:
+                top1 = float(np.mean(probs.argmax(1) == labels))
+                log_loss = float(-np.log(np.clip(probs[np.arange(len(labels)), labels], 1e-12, None)).mean())
+                base_metrics = base_metrics or (top1, log_loss)
+                line += f"{top1:>8.4f}{top1 - base_metrics[0]:>+8.4f}{log_loss:>9.4f}{log_loss - base_metrics[1]:>+10.4f}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy推論モデルの書き出し・検証・量子化")
+    parser.add_argument("command", choices=["export", "verify", "quantize", "evaluate"])
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("--samples", type=int, default=600)
+    parser.add_argument("--archive", help="evaluate で検証行の精度も比較する学習データアーカイブ")
+    args = parser.parse_args()
+
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(args.model_dir)
+    model_dir = registry.resolve_dir()
+    path = os.path.join(model_dir, NUMPY_MODEL_FILENAME)
+
+    if args.command in ("export", "quantize") and registry.current_version():
+        # 登録済みバージョンは保存時に書き出し済み（manifest のハッシュを崩さないよう上書きしない）
+        print(f"already exported: {model_dir}")
+        return
+
+    if args.command == "quantize":
+        engine = NumpyRankModel.load(path)
+        for dtype in QUANTIZED_DTYPES:
+            print(f"exported: {engine.save_quantized(os.path.join(model_dir, QUANTIZED_MODEL_FILENAMES[dtype]), dtype)}")
+        return
+
+    if args.command == "evaluate":
+        evaluate_quantization(model_dir, args)
+        return
+
+    model, scaler = _load_keras_artifacts(model_dir)
+
+    if args.command == "export":
+        export_rank_model(model, scaler, path)
+        print(f"exported: {path}")
+        return
+
+    engine = NumpyRankModel.load(path)
+    rng = np.random.default_rng(0)
+    X_racers = rng.normal(size=(args.samples, engine.n_racer_features)).astype(np.float32)
+    X_water = rng.normal(size=(args.samples, 6)).astype(np.float32)
+    expected = model.predict([X_racers, X_water], verbose=0)
+    actual = engine.predict([X_racers, X_water])
+    print(f"max |Δprob|: {np.max(np.abs(expected - actual)):.2e}")
+    print(f"argmax一致率: {np.mean(expected.argmax(1) == actual.argmax(1)):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+評価済みレースからの逐次学習（オンライン更新）
+- 結果の出たレースを受け取り、新着分 + リプレイバッファからの再サンプルでミニバッチ勾配ステップを数十回だけ適用
+- 全期間の再学習（train_model）に比べて、特徴量化もエポックも新着分だけで済む
+- ガードレール
+    - 学習率は小さく、勾配は clipnorm で制限し、1回の更新のステップ数にも上限
+    - 一部のレース（レースIDで決定）は学習に使わずホールドアウトとして保持し、
+      更新前後のホールドアウト損失が悪化したら公開しない
+    - 特徴量スキーマが学習時と変わっている場合は全再学習が必要なため更新しない
+- 更新したモデルは model_registry に新バージョンとして公開（問題があればロールバック可能）
+- NumPy推論で稼働中の場合は、更新後の重みからエンジンを作り直して推論を続ける
+"""
+
+import datetime
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+from numpy_inference import NumpyRankModel, NumpyStandardScaler
+from training_pipeline import StreamingTrainingPipeline, is_validation_race
+
+logger = logging.getLogger("BoatraceAI")
+
+DEFAULT_ONLINE_CONFIG = {
+    "learning_rate": 0.0001,
+    "clipnorm": 1.0,
+    "batch_size": 64,
+    "max_steps": 50,
+    "passes": 2,                  # 新着行を平均何回ずつ使うか
+    "replay_ratio": 0.5,          # ミニバッチのうちリプレイバッファから取る割合
+    "buffer_races": 3000,
+    "holdout_ratio": 0.2,
+    "holdout_races": 500,
+    "min_new_races": 12,
+    "min_holdout_races": 24,
+    "max_loss_increase": 0.0,     # ホールドアウト損失の許容悪化率
+    "seed": 42,
+}
+
+
+class OnlineLearner:
+    """
+    予測モデルの逐次学習
+    - add_races([(race_id, race_features, race_results), ...]) で新着レースを登録
+    - update() で新着分を使って1回更新し、結果（公開したバージョンや損失）を返す
+    """
+
+    def __init__(self, prediction_model, config=None):
+        self.prediction_model = prediction_model
+        self.config = dict(DEFAULT_ONLINE_CONFIG, **(config or {}))
+        self.pipeline = StreamingTrainingPipeline(prediction_model)
+
+        self._pending = []
+        self._replay = deque(maxlen=self.config["buffer_races"])
+        self._holdout = deque(maxlen=self.config["holdout_races"])
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(self.config["seed"])
+
+        self.update_count = 0
+        self.last_result = None
+
+    def add_races(self, races):
+        """結果の出たレースを登録（同じレースは1回だけ）。登録した件数を返す"""
+        added = 0
+        with self._lock:
+            for race_id, race_features, race_results in races:
+                if race_id in self._seen or not race_features or not race_results:
+                    continue
+                racers, water, labels = self.pipeline.race_rows(race_features, race_results)
+                if len(labels) == 0:
+                    continue
+
+                self._seen.add(race_id)
+                if is_validation_race(race_id, self.config["holdout_ratio"]):
+                    self._holdout.append((racers, water, labels))
+                else:
+                    self._pending.append((racers, water, labels))
+                added += 1
+        return added
+
+    def status(self):
+        """システムステータス用"""
+        with self._lock:
+            return {
+                "pending_races": len(self._pending),
+                "replay_races": len(self._replay),
+                "holdout_races": len(self._holdout),
+                "updates": self.update_count,
+                "last_result": self.last_result,
+            }
+
+    @staticmethod
+    def _stack(races):
+        racers = np.concatenate([race[0] for race in races])
+        water = np.concatenate([race[1] for race in races])
+        labels = np.concatenate([race[2] for race in races])
+        return racers, water, labels
+
+    def _inputs(self, scaler, racers, water):
+        return [scaler.transform(racers).astype(np.float32), np.asarray(water, dtype=np.float32)]
+
+    def _skip_reason(self, bundle):
+        """更新できない理由（更新可能なら None）"""
+        if len(self._pending) < self.config["min_new_races"]:
+            return "新着レース不足"
+        if len(self._holdout) < self.config["min_holdout_races"]:
+            return "ホールドアウト不足"
+        if bundle.features_scaler is None:
+            return "スケーラーなし"
+        if bundle.backend_engine is not None:
+            return f"{bundle.backend_engine.name}は逐次学習に非対応"
+        if not os.path.exists(os.path.join(self.prediction_model.registry.resolve_dir(), "boatrace_model.h5")):
+            return "学習済みモデルなし"
+        if self.prediction_model.feature_registry.diff(bundle.model_schema):
+            return "特徴量スキーマ変更（全再学習が必要）"
+        return None
+
+    def update(self):
+        """新着レースでミニバッチ更新し、ホールドアウト損失が悪化しなければ新バージョンとして公開"""
+        with self._lock:
+            bundle = self.prediction_model._active
+            reason = self._skip_reason(bundle)
+            if reason is not None:
+                return {"status": "skipped", "reason": reason, "pending_races": len(self._pending)}
+
+            config = self.config
+            new_racers, new_water, new_labels = self._stack(self._pending)
+            replay = self._stack(self._replay) if self._replay else None
+            holdout_racers, holdout_water, holdout_labels = self._stack(self._holdout)
+
+            model = self.prediction_model._load_training_model()
+            self.prediction_model._compile_model(model, config["learning_rate"], clipnorm=config["clipnorm"])
+
+            # NumPy推論で稼働中のスケーラーは、通常の学習と同じ StandardScaler の形で保存する
+            scaler = bundle.features_scaler
+            if isinstance(scaler, NumpyStandardScaler):
+                scaler = scaler.to_sklearn()
+            holdout_inputs = self._inputs(scaler, holdout_racers, holdout_water)
+            holdout_targets = np.eye(6, dtype=np.float32)[holdout_labels]
+            loss_before = float(model.evaluate(holdout_inputs, holdout_targets, verbose=0)[0])
+
+            # 新着分とリプレイ分を混ぜたミニバッチ
+            batch_size = config["batch_size"]
+            replay_size = int(batch_size * config["replay_ratio"]) if replay is not None else 0
+            new_size = batch_size - replay_size
+            steps = min(config["max_steps"], max(1, math.ceil(config["passes"] * len(new_labels) / new_size)))
+
+            for _ in range(steps):
+                rows = self._rng.integers(0, len(new_labels), new_size)
+                racers, water, labels = new_racers[rows], new_water[rows], new_labels[rows]
+                if replay_size:
+                    replay_rows = self._rng.integers(0, len(replay[2]), replay_size)
+                    racers = np.concatenate([racers, replay[0][replay_rows]])
+                    water = np.concatenate([water, replay[1][replay_rows]])
+                    labels = np.concatenate([labels, replay[2][replay_rows]])
+                model.train_on_batch(self._inputs(scaler, racers, water), np.eye(6, dtype=np.float32)[labels])
+
+            loss_after = float(model.evaluate(holdout_inputs, holdout_targets, verbose=0)[0])
+
+            # 新着分は結果に関わらずリプレイバッファへ
+            new_races = len(self._pending)
+            self._replay.extend(self._pending)
+            self._pending = []
+
+            result = {
+                "races": new_races,
+                "steps": steps,
+                "holdout_loss_before": round(loss_before, 6),
+                "holdout_loss_after": round(loss_after, 6),
+                "updated_at": datetime.datetime.now().isoformat(),
+            }
+
+            if not np.isfinite(loss_after) or loss_after > loss_before * (1 + config["max_loss_increase"]):
+                logger.warning(f"オンライン更新を破棄: ホールドアウト損失 {loss_before:.4f} → {loss_after:.4f}")
+                result["status"] = "rejected"
+                self.last_result = result
+                return result
+
+            serving_numpy = bundle.main_model is None and bundle.numpy_engine is not None
+            updated = bundle.derive(
+                main_model=model,
+                features_scaler=scaler,
+                numpy_engine=NumpyRankModel.from_keras(model, scaler) if bundle.numpy_engine is not None else None
+            )
+            version = self.prediction_model.save_models(
+                updated,
+                metrics={
+                    "online_holdout_loss_before": loss_before,
+                    "online_holdout_loss_after": loss_after,
+                    "online_races": new_races,
+                    "online_steps": steps,
+                    "online_parent": bundle.version,
+                },
+                model_config=self.prediction_model.registry.read().get("versions", {}).get(bundle.version, {}).get("model_config")
+            )
+            if serving_numpy:
+                # Kerasモデルは成果物の書き出しにだけ使い、推論は更新後の重みのNumPyエンジンで続ける
+                updated.main_model = None
+            self.update_count += 1
+            result.update(status="published", version=version)
+            self.last_result = result
+            logger.info(f"オンライン更新公開: {version} ({new_races}レース, {steps}ステップ, "
+                        f"ホールドアウト損失 {loss_before:.4f} → {loss_after:.4f})")
+            return result
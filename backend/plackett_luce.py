@@ -0,0 +1,87 @@
+"""
+Plackett-Luce 着順モデル（NumPy）
+- 6艇それぞれの強さ（対数スケール）から、720通りの着順全体の確率分布を計算
+- 1着は強さに比例して選ばれ、2着以降は残りの艇から同様に選ばれる
+- 艇×着順の確率行列は行・列とも合計1になり、各艇の分布が互いに矛盾しない
+- 複数レースをまとめて (レース数, 6) の配列で処理
+"""
+
+import itertools
+
+import numpy as np
+
+N_BOATS = 6
+
+# 720通りの着順（各行は1着から6着までの艇インデックス 0-5）
+PERMUTATIONS = np.array(list(itertools.permutations(range(N_BOATS))), dtype=np.intp)
+
+# [着順, 着位, 艇] の指示行列（着順確率から艇×着位の確率を集計する）
+_POSITION_INDICATOR = np.eye(N_BOATS)[PERMUTATIONS]
+
+
+def order_log_probabilities(strengths):
+    """
+    全着順の対数確率
+    - strengths: (n, 6) 各艇の対数強さ
+    - 戻り値: (n, 720) PERMUTATIONS の各行に対応
+    """
+    strengths = np.asarray(strengths, dtype=np.float64).reshape(-1, N_BOATS)
+    ordered = strengths[:, PERMUTATIONS]
+    # 各着位で「まだ残っている艇」の強さの logsumexp（後ろから累積）
+    remaining = np.logaddexp.accumulate(ordered[:, :, ::-1], axis=2)[:, :, ::-1]
+    return (ordered - remaining).sum(axis=2)
+
+
+def order_probabilities(strengths):
+    """全着順の確率 (n, 720)"""
+    return np.exp(order_log_probabilities(strengths))
+
+
+def position_probabilities(strengths):
+    """艇×着位の確率 (n, 6, 6)。[レース, 艇, 着位]"""
+    return np.einsum("np,pkb->nbk", order_probabilities(strengths), _POSITION_INDICATOR)
+
+
+def strengths_from_rank_probs(rank_probs):
+    """
+    選手ごとの着順分布（従来モデルの出力）から対数強さを作る
+    - 1着確率をレース内で正規化して対数をとる
+    - rank_probs: (6, 6) または (n, 6, 6)
+    """
+    rank_probs = np.asarray(rank_probs, dtype=np.float64)
+    win = np.clip(rank_probs[..., 0], 1e-12, None)
+    win = win / win.sum(axis=-1, keepdims=True)
+    return np.log(win).reshape(-1, N_BOATS)
+
+
+def negative_log_likelihood(strengths, ranks):
+    """
+    実際の着順に対する負の対数尤度（レースごと）
+    - ranks: (n, 6) 各艇の着順 1-6。0 は着順なし（失格・欠場など）で最後尾扱い
+    """
+    strengths = np.asarray(strengths, dtype=np.float64).reshape(-1, N_BOATS)
+    ranks = np.asarray(ranks).reshape(-1, N_BOATS)
+    valid = ranks > 0
+    effective = np.where(valid, ranks, N_BOATS + 1)
+
+    # at_risk[n, i, j]: 艇 i の着位が決まる時点で艇 j がまだ残っている
+    at_risk = effective[:, None, :] >= effective[:, :, None]
+    masked = np.where(at_risk, strengths[:, None, :], -np.inf)
+    log_denominator = np.logaddexp.reduce(masked, axis=2)
+    return -np.where(valid, strengths - log_denominator, 0.0).sum(axis=1)
+
+
+def top_orders(strengths, k=10, boat_numbers=None):
+    """
+    確率上位 k 通りの着順
+    - boat_numbers: (n, 6) 各インデックスの艇番（省略時はインデックス+1）
+    """
+    probs = order_probabilities(strengths)
+    if boat_numbers is None:
+        boat_numbers = np.tile(np.arange(1, N_BOATS + 1), (len(probs), 1))
+    boat_numbers = np.asarray(boat_numbers).reshape(-1, N_BOATS)
+    top = np.argsort(-probs, axis=1)[:, :k]
+    return [
+        [{"order": numbers[PERMUTATIONS[p]].tolist(), "probability": float(race_probs[p])} for p in race_top]
+        for race_probs, race_top, numbers in zip(probs, top, boat_numbers)
+    ]
@@ -0,0 +1,184 @@
+"""
+レース予測キャッシュ
+- race_id ごとに「入力ハッシュ + モデルバージョン」のキーと予測結果・特徴量を保持
+- 出走表・水面状況などの入力か、稼働中のモデルが変わるとキーが一致せず再計算になる
+- 件数上限を超えたら最も長く使われていないレースから削除（LRU）
+- 結果が出て評価の済んだレースは evict で明示的に削除
+- 既存コードとの互換のため race_id -> 予測結果 の辞書としても扱える
+- LRUCache: 任意のキー（入力の正規化ハッシュなど）で引く汎用の有界キャッシュ
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """有界・入力ハッシュ付きの予測キャッシュ"""
+
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counts = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(input_hash, model_version):
+        """キャッシュキー（入力ハッシュ + モデルバージョン）"""
+        return f"{input_hash}:{model_version}"
+
+    def lookup(self, race_id, key):
+        """キーが一致する予測を返す（入力かモデルが変わっていれば None）"""
+        with self._lock:
+            entry = self._entries.get(race_id)
+            if entry is not None and entry["key"] == key:
+                self._entries.move_to_end(race_id)
+                self.stats_counts["hits"] += 1
+                return entry["prediction"]
+
+            if entry is not None:
+                self.stats_counts["invalidations"] += 1
+            self.stats_counts["misses"] += 1
+            return None
+
+    def store(self, race_id, prediction, key=None, race_features=None):
+        """予測を保存（上限を超えたら古いものから削除）"""
+        with self._lock:
+            self._entries[race_id] = {"key": key, "prediction": prediction, "race_features": race_features}
+            self._entries.move_to_end(race_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats_counts["evictions"] += 1
+
+    def race_features(self, race_id):
+        """予測に使った特徴量（保存していなければ None）"""
+        with self._lock:
+            entry = self._entries.get(race_id)
+            return entry["race_features"] if entry is not None else None
+
+    def evict(self, race_ids):
+        """指定レースを削除し、削除したエントリ {race_id: entry} を返す"""
+        evicted = {}
+        with self._lock:
+            for race_id in race_ids:
+                entry = self._entries.pop(race_id, None)
+                if entry is not None:
+                    evicted[race_id] = entry
+            self.stats_counts["evictions"] += len(evicted)
+        return evicted
+
+    def evict_before(self, date):
+        """指定日（YYYYMMDD）より前のレースを削除"""
+        with self._lock:
+            race_ids = [race_id for race_id in self._entries if race_id[:8] < date]
+        return self.evict(race_ids)
+
+    def stats(self):
+        """システムステータス用の統計"""
+        with self._lock:
+            counts = dict(self.stats_counts)
+            size = len(self._entries)
+        lookups = counts["hits"] + counts["misses"]
+        return dict(
+            counts,
+            size=size,
+            max_size=self.max_size,
+            hit_rate=round(counts["hits"] / lookups, 4) if lookups else 0.0
+        )
+
+    # ===== 辞書としての互換インターフェース（キーなしで保存したものは入力変更を検知しない） =====
+    def __contains__(self, race_id):
+        with self._lock:
+            return race_id in self._entries
+
+    def __getitem__(self, race_id):
+        with self._lock:
+            return self._entries[race_id]["prediction"]
+
+    def __setitem__(self, race_id, prediction):
+        self.store(race_id, prediction)
+
+    def __delitem__(self, race_id):
+        if not self.evict([race_id]):
+            raise KeyError(race_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, race_id, default=None):
+        with self._lock:
+            entry = self._entries.get(race_id)
+            return entry["prediction"] if entry is not None else default
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def values(self):
+        with self._lock:
+            return [entry["prediction"] for entry in self._entries.values()]
+
+    def items(self):
+        with self._lock:
+            return [(race_id, entry["prediction"]) for race_id, entry in self._entries.items()]
+
+    def update(self, predictions):
+        for race_id, prediction in predictions.items():
+            self.store(race_id, prediction)
+
+
+class LRUCache:
+    """
+    キー -> 値 の有界LRUキャッシュ（スレッドセーフ）
+    - ルールベース予想など、入力の正規化ハッシュをキーにした結果の再利用に使う
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        """値（なければ None）"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.stats_counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counts["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """保存（上限を超えたら最も長く使われていないものから削除）"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats_counts["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """システムステータス用の統計"""
+        with self._lock:
+            counts = dict(self.stats_counts)
+            size = len(self._entries)
+        lookups = counts["hits"] + counts["misses"]
+        return dict(
+            counts,
+            size=size,
+            max_size=self.max_size,
+            hit_rate=round(counts["hits"] / lookups, 4) if lookups else 0.0
+        )
@@ -0,0 +1,233 @@
+"""
+直前情報（気象・水面・展示タイム）
+- レース開始前に公式サイトの直前情報ページから取得した値を pre_race_info / exhibition_times に保存
+- ルールベース予想は race_id で気象条件を引く（取得済みなら抽選ではなく実際の値を使う）
+- 参照は race_id ごとにメモリ上にキャッシュ。書き込みは save を通すことで、そのレースのキャッシュだけを差し替える
+  未取得のレースの「なし」は missing_ttl 秒だけ保持（別プロセスが保存した直前情報もその後に読み直す）
+- save は保存済みの値と比べて変化があったかを返す（変化のないレースは再評価しない）
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from prediction_cache import LRUCache
+
+logger = logging.getLogger("BoatraceAI")
+
+# 風速（m/s）の上限ごとの風の強さ（ルールベース予想の気象条件の表記）
+WIND_STRENGTH_LEVELS = ((0, '無風'), (2, '微風'), (4, '弱風'), (6, '中風'))
+STRONG_WIND_LABEL = '強風'
+
+# 直前情報ページの風向アイコン（is-wind1 .. is-wind16、北から時計回り）を8方位に丸める
+WIND_DIRECTIONS_16 = ('北', '北北東', '北東', '東北東', '東', '東南東', '南東', '南南東',
+                      '南', '南南西', '南西', '西南西', '西', '西北西', '北西', '北北西')
+WIND_DIRECTIONS_8 = ('北', '北東', '東', '南東', '南', '南西', '西', '北西')
+
+CONDITIONS_CACHE_SIZE = 4096
+MISSING_TTL = 60.0
+
+
+class _Missing:
+    """未取得のレースの目印（キャッシュ上の「なし」。expires を過ぎたらDBを読み直す）"""
+
+    __slots__ = ("expires",)
+
+    def __init__(self, ttl):
+        self.expires = time.time() + ttl
+
+
+def wind_direction_label(icon_index):
+    """風向アイコン番号（1-16）を8方位に（範囲外は None）"""
+    if not icon_index or not 1 <= icon_index <= len(WIND_DIRECTIONS_16):
+        return None
+    return WIND_DIRECTIONS_8[(icon_index // 2) % len(WIND_DIRECTIONS_8)]
+
+
+def wind_strength_label(wind_speed):
+    """風速（m/s）から風の強さ"""
+    if wind_speed is None:
+        return None
+    for upper, label in WIND_STRENGTH_LEVELS:
+        if wind_speed <= upper:
+            return label
+    return STRONG_WIND_LABEL
+
+
+def impact_level(wind_speed, wave_height):
+    """風速（m/s）・波高（cm）から気象の影響度"""
+    wind_speed = wind_speed or 0
+    wave_height = wave_height or 0
+    if wind_speed >= 5 or wave_height >= 5:
+        return '高'
+    if wind_speed >= 3 or wave_height >= 3:
+        return '中'
+    return '低'
+
+
+def weather_from_conditions(conditions):
+    """保存済みの直前情報をルールベース予想の気象条件の形式に"""
+    wind_speed = conditions.get('wind_speed')
+    wave_height = conditions.get('wave_height')
+    return {
+        'wind_direction': conditions.get('wind_direction'),
+        'wind_strength': wind_strength_label(wind_speed) or '無風',
+        'wind_speed': wind_speed,
+        'wave_height': wave_height or 0,
+        'temperature': conditions.get('temperature'),
+        'water_temp': conditions.get('water_temperature'),
+        'weather': conditions.get('weather'),
+        'impact_level': impact_level(wind_speed, wave_height),
+        'source': 'pre_race_info'
+    }
+
+
+class RaceConditionsStore:
+    """
+    直前情報の保存と race_id ごとのキャッシュ付き参照
+    - get(race_id) / get_many(race_ids): {"conditions", "weather", "exhibition_times"}（未取得は None）
+    - save(...): 保存して、値が変わったかを返す
+    """
+
+    CONDITION_COLUMNS = ('weather', 'wind_direction', 'wind_speed', 'wave_height', 'temperature', 'water_temperature')
+
+    def __init__(self, db_path="boatrace_data.db", cache_size=CONDITIONS_CACHE_SIZE, missing_ttl=MISSING_TTL):
+        self.db_path = db_path
+        self.missing_ttl = missing_ttl
+        self._cache = LRUCache(max_size=cache_size)
+        self._write_lock = threading.Lock()
+        self.initialize_database()
+
+    def initialize_database(self):
+        """テーブル作成（アプリの DatabaseManager と同じ定義）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pre_race_info (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            race_id TEXT,
+            venue_code TEXT,
+            race_number INTEGER,
+            race_date TEXT,
+            weather TEXT,
+            wind_direction TEXT,
+            wind_speed REAL,
+            wave_height INTEGER,
+            temperature REAL,
+            water_temperature REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(race_id)
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exhibition_times (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            race_id TEXT,
+            boat_number INTEGER,
+            exhibition_time REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(race_id, boat_number)
+        )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _read(self, cursor, race_ids):
+        """DBから読み込み {race_id: 直前情報}（未取得のレースは含めない）"""
+        placeholders = ",".join("?" * len(race_ids))
+        cursor.execute(f'''
+        SELECT race_id, {", ".join(self.CONDITION_COLUMNS)}
+        FROM pre_race_info
+        WHERE race_id IN ({placeholders})
+        ''', race_ids)
+        found = {}
+        for row in cursor.fetchall():
+            conditions = dict(zip(self.CONDITION_COLUMNS, row[1:]))
+            found[row[0]] = {
+                "conditions": conditions,
+                "weather": weather_from_conditions(conditions),
+                "exhibition_times": {}
+            }
+
+        cursor.execute(f'''
+        SELECT race_id, boat_number, exhibition_time
+        FROM exhibition_times
+        WHERE race_id IN ({placeholders})
+        ORDER BY race_id, boat_number
+        ''', race_ids)
+        for race_id, boat_number, exhibition_time in cursor.fetchall():
+            if race_id in found:
+                found[race_id]["exhibition_times"][boat_number] = exhibition_time
+        return found
+
+    def get(self, race_id):
+        """1レースの直前情報（未取得なら None）"""
+        return self.get_many([race_id]).get(race_id)
+
+    def get_many(self, race_ids):
+        """複数レースの直前情報 {race_id: 直前情報}（キャッシュにないレースは1回のクエリでまとめて読む）"""
+        result = {}
+        missing = []
+        now = time.time()
+        for race_id in dict.fromkeys(race_ids):
+            cached = self._cache.get(race_id)
+            if cached is None or (isinstance(cached, _Missing) and cached.expires <= now):
+                missing.append(race_id)
+            elif not isinstance(cached, _Missing):
+                result[race_id] = cached
+
+        if missing:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                found = self._read(conn.cursor(), missing)
+            finally:
+                conn.close()
+            for race_id in missing:
+                self._cache.put(race_id, found.get(race_id) or _Missing(self.missing_ttl))
+            result.update(found)
+        return result
+
+    def save(self, race_id, venue_code, race_number, race_date, conditions, exhibition_times=None):
+        """
+        直前情報を保存
+        - conditions: CONDITION_COLUMNS の辞書 / exhibition_times: {艇番: 展示タイム}
+        - 戻り値: 保存済みの値から変わったか（変化がなければ書き込まない）
+        """
+        conditions = {column: conditions.get(column) for column in self.CONDITION_COLUMNS}
+        exhibition_times = {int(boat): time for boat, time in (exhibition_times or {}).items()
+                            if time is not None}
+
+        with self._write_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                cursor = conn.cursor()
+                current = self._read(cursor, [race_id]).get(race_id)
+                if (current is not None and current["conditions"] == conditions
+                        and current["exhibition_times"] == exhibition_times):
+                    return False
+
+                cursor.execute(f'''
+                INSERT OR REPLACE INTO pre_race_info
+                (race_id, venue_code, race_number, race_date, {", ".join(self.CONDITION_COLUMNS)})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (race_id, venue_code, race_number, race_date,
+                      *(conditions[column] for column in self.CONDITION_COLUMNS)))
+                cursor.execute('DELETE FROM exhibition_times WHERE race_id = ?', (race_id,))
+                cursor.executemany('''
+                INSERT INTO exhibition_times (race_id, boat_number, exhibition_time)
+                VALUES (?, ?, ?)
+                ''', [(race_id, boat, time) for boat, time in sorted(exhibition_times.items())])
+                conn.commit()
+
+                self._cache.put(race_id, self._read(cursor, [race_id]).get(race_id) or _Missing(self.missing_ttl))
+            finally:
+                conn.close()
+
+        logger.info(f"直前情報更新: {race_id} 風{conditions['wind_speed']}m 波{conditions['wave_height']}cm "
+                    f"展示{len(exhibition_times)}艇")
+        return True
+
+    def stats(self):
+        """システムステータス用"""
+        return self._cache.stats()
@@ -0,0 +1,147 @@
+"""
+レースのモンテカルロシミュレーター
+- 各艇の強さから Plackett-Luce に従う着順を直接サンプリング（Gumbel-max と同等の指数分布による到着順）
+- (レース数, 6艇, 試行数) の配列で一括生成し、メモリ上限に収まるようチャンクに分けて集計
+- strength_noise を指定すると試行ごとに強さ自体も揺らす（展示・気象などの不確かさ）
+- 集計結果から荒れる確率・本命の安定度を求める
+    upset_probability: モデル評価4〜6番手の艇が1着になる確率
+    stability: モデル評価1番手（本命）が3着以内に入る確率
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from bet_combinations import strengths_from_prediction
+from plackett_luce import N_BOATS
+
+logger = logging.getLogger("BoatraceAI")
+
+# 1チャンクあたりの乱数の要素数（float32 で約16MB）
+MAX_CHUNK_ELEMENTS = 4_000_000
+
+# 信頼度の判定（安定度・荒れ確率は % 表記）
+RELIABILITY_LEVELS = [
+    ("高", 70, 25),
+    ("中", 50, 40),
+]
+
+
+class RaceSimulator:
+    """
+    着順のモンテカルロシミュレーション
+    - simulate(strengths): strengths (n, 6) を一括で処理
+    - time_budget（秒）を超えたら、その時点までの試行で集計を打ち切る
+    """
+
+    def __init__(self, n_draws=200_000, seed=None, strength_noise=0.0, time_budget=None):
+        self.n_draws = n_draws
+        self.seed = seed
+        self.strength_noise = strength_noise
+        self.time_budget = time_budget
+
+    def simulate(self, strengths, seed=None):
+        """試行を集計した確率（レースごと）"""
+        strengths = np.asarray(strengths, dtype=np.float32).reshape(-1, N_BOATS)
+        n_races = len(strengths)
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+
+        # モデル評価の順位（0始まり）と本命
+        model_rank = np.argsort(np.argsort(-strengths, axis=1, kind="stable"), axis=1)
+        favourite = np.argmax(strengths, axis=1)
+
+        win_counts = np.zeros((n_races, N_BOATS), dtype=np.int64)
+        favourite_top3 = np.zeros(n_races, dtype=np.int64)
+        chunk = max(1, min(self.n_draws, MAX_CHUNK_ELEMENTS // max(1, n_races * N_BOATS)))
+
+        # 着順の決まり方: 各艇の到着時間 E / w（E は指数分布、w は強さ）が小さい順
+        # （Gumbel-max と同じ分布。対数計算が不要で、並びは (レース, 艇, 試行) にして短い軸での集計を避ける）
+        inverse_weight = np.exp(-(strengths - strengths.max(axis=1, keepdims=True)))[:, :, None]
+        race_index = np.arange(n_races)
+
+        started = time.perf_counter()
+        draws = 0
+        while draws < self.n_draws:
+            size = min(chunk, self.n_draws - draws)
+
+            arrival = rng.standard_exponential((n_races, N_BOATS, size), dtype=np.float32)
+            arrival *= inverse_weight
+            if self.strength_noise:
+                arrival *= np.exp(-self.strength_noise * rng.standard_normal((n_races, N_BOATS, size), dtype=np.float32))
+
+            first = arrival.min(axis=1, keepdims=True)
+            win_counts += (arrival == first).sum(axis=2)
+
+            # 本命より先に着いた艇の数 = 本命の着順 - 1
+            favourite_arrival = arrival[race_index, favourite][:, None, :]
+            ahead = (arrival < favourite_arrival).sum(axis=1, dtype=np.int8)
+            favourite_top3 += (ahead < 3).sum(axis=1)
+
+            draws += size
+            if self.time_budget is not None and time.perf_counter() - started > self.time_budget:
+                if draws < self.n_draws:
+                    logger.debug(f"シミュレーション打ち切り: {draws}/{self.n_draws}回 ({n_races}レース)")
+                break
+
+        win_probability = win_counts / draws
+        upset_probability = np.where(model_rank >= 3, win_probability, 0.0).sum(axis=1)
+        stability = favourite_top3 / draws
+
+        return {
+            "draws": draws,
+            "seconds": time.perf_counter() - started,
+            "favourite": favourite,
+            "win_probability": win_probability,
+            "upset_probability": upset_probability,
+            "stability": stability,
+        }
+
+    def risk_analysis(self, strengths, boat_numbers=None, seed=None):
+        """
+        予測結果に付ける risk_analysis（レースごとの辞書のリスト）
+        - boat_numbers: (n, 6) 各インデックスの艇番（省略時はインデックス+1）
+        """
+        result = self.simulate(strengths, seed=seed)
+        n_races = len(result["favourite"])
+        if boat_numbers is None:
+            boat_numbers = np.tile(np.arange(1, N_BOATS + 1), (n_races, 1))
+        boat_numbers = np.asarray(boat_numbers).reshape(-1, N_BOATS)
+
+        analyses = []
+        for i in range(n_races):
+            stability_score = int(round(result["stability"][i] * 100))
+            upset_probability = int(round(result["upset_probability"][i] * 100))
+            analyses.append({
+                "stability_score": stability_score,
+                "upset_probability": upset_probability,
+                "reliability": reliability_level(stability_score, upset_probability),
+                "favourite_boat": int(boat_numbers[i][result["favourite"][i]]),
+                "win_probabilities": {
+                    int(boat_number): round(float(p), 4)
+                    for boat_number, p in zip(boat_numbers[i], result["win_probability"][i])
+                },
+                "simulations": int(result["draws"]),
+            })
+        return analyses
+
+
+def attach_risk_analysis(predictions, simulator, seed=None):
+    """複数レースの予測結果にまとめて risk_analysis を付ける（6艇揃ったレースのみ）"""
+    targets = [p for p in predictions if len(p["predictions"]) == N_BOATS]
+    if not targets:
+        return predictions
+    pairs = [strengths_from_prediction(p) for p in targets]
+    strengths = np.stack([pair[0] for pair in pairs])
+    boat_numbers = np.stack([pair[1] for pair in pairs])
+    for prediction, analysis in zip(targets, simulator.risk_analysis(strengths, boat_numbers, seed=seed)):
+        prediction["risk_analysis"] = analysis
+    return predictions
+
+
+def reliability_level(stability_score, upset_probability):
+    """安定度・荒れ確率（%）から信頼度（高/中/低）"""
+    for level, min_stability, max_upset in RELIABILITY_LEVELS:
+        if stability_score >= min_stability and upset_probability <= max_upset:
+            return level
+    return "低"
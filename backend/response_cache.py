@@ -0,0 +1,206 @@
+"""
+APIレスポンスキャッシュ
+- 読み取り系エンドポイントの応答本文を、パス・クエリ・元テーブルの世代をキーに保存
+- 保存先は Redis（複数ワーカーで共有）。Redis が使えない・失敗した場合はプロセス内の TTL 付き LRU
+- 本文のハッシュを ETag として付け、If-None-Match が一致すれば 304 を返す
+- 応答ごとに変わるフィールド（時刻・スクレイピング回数）は本文から除いて保存し、返すときに付け直す
+  （ETag は除いた本文のハッシュ。値は変わっても同じ内容なので弱い ETag にする）
+- テーブルへの書き込み時に invalidate_tables でそのテーブルの世代を上げ、関係する応答を無効化
+  （キーに世代が入るので、古い応答は参照されなくなり TTL / LRU で消える）
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+
+logger = logging.getLogger('boatrace')
+
+KEY_PREFIX = "boatrace:response:"
+GENERATION_PREFIX = "boatrace:generation:"
+
+
+class ResponseCache:
+    """
+    応答本文のキャッシュ
+    - cached(tables, ttl): ビュー関数用デコレーター（成功した GET 応答だけ保存）
+    - invalidate_tables(*tables): テーブル書き込み後に呼ぶ
+    - volatile_fields: 応答ごとに変わるフィールドの辞書を返す関数（JSON オブジェクトの本文に付け直す）
+    """
+
+    def __init__(self, redis_client=None, default_ttl=300, max_size=512, volatile_fields=None):
+        self.redis_client = redis_client
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.volatile_fields = volatile_fields
+        self._entries = OrderedDict()  # キー -> (期限, 応答)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats_counts = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "redis_errors": 0}
+
+    # ===== 保存先（Redis / プロセス内） =====
+    def _redis_failed(self, e):
+        with self._lock:
+            self.stats_counts["redis_errors"] += 1
+        logger.warning(f"Redisキャッシュエラー（プロセス内キャッシュを使用）: {e}")
+
+    def _get(self, key):
+        if self.redis_client is not None:
+            try:
+                value = self.redis_client.get(KEY_PREFIX + key)
+                return json.loads(value) if value else None
+            except Exception as e:
+                self._redis_failed(e)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, ttl):
+        if self.redis_client is not None:
+            try:
+                self.redis_client.setex(KEY_PREFIX + key, ttl, json.dumps(value, ensure_ascii=False))
+                return
+            except Exception as e:
+                self._redis_failed(e)
+
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # ===== テーブルの世代 =====
+    def generations(self, tables):
+        """テーブルごとの世代（書き込みのたびに増える番号）"""
+        if self.redis_client is not None:
+            try:
+                values = self.redis_client.mget([GENERATION_PREFIX + table for table in tables])
+                return [int(value or 0) for value in values]
+            except Exception as e:
+                self._redis_failed(e)
+
+        with self._lock:
+            return [self._generations.get(table, 0) for table in tables]
+
+    def invalidate_tables(self, *tables):
+        """テーブルの世代を上げて、そのテーブルから作った応答を無効化"""
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self.stats_counts["invalidations"] += 1
+
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline()
+                for table in tables:
+                    pipeline.incr(GENERATION_PREFIX + table)
+                pipeline.execute()
+            except Exception as e:
+                self._redis_failed(e)
+
+    def _key(self, tables):
+        query = "&".join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+        generations = ",".join(f"{table}.{generation}" for table, generation in zip(tables, self.generations(tables)))
+        mobile = int(bool(getattr(g, 'is_mobile', False)))
+        # 日付を省略すると「今日」になるエンドポイントがあるため日付もキーに含める
+        return f"{request.path}?{query}|{generations}|m{mobile}|{time.strftime('%Y%m%d')}"
+
+    # ===== 応答ごとに変わるフィールド =====
+    def _stable_body(self, body):
+        """保存用の本文（応答ごとに変わるフィールドを除く）"""
+        if self.volatile_fields is None:
+            return body
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            return body
+        volatile = self.volatile_fields()
+        return current_app.json.dumps({name: value for name, value in payload.items() if name not in volatile})
+
+    def _with_volatile_fields(self, body):
+        """返す本文（保存した本文に今の値を付け直す）"""
+        if self.volatile_fields is None:
+            return body
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            return body
+        return current_app.json.dumps(dict(payload, **self.volatile_fields()))
+
+    # ===== デコレーター =====
+    def cached(self, tables, ttl=None):
+        """
+        GET 応答をキャッシュするデコレーター
+        - tables: 応答の元になるテーブル（書き込まれたら無効化）
+        - ttl: 保持秒数（既定は default_ttl）
+        """
+        tables = tuple(tables)
+        ttl = ttl or self.default_ttl
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                entry = self._get(self._key(tables))
+                if entry is not None:
+                    with self._lock:
+                        self.stats_counts["hits"] += 1
+                    response = make_response(self._with_volatile_fields(entry["body"]), entry["status"])
+                    response.mimetype = 'application/json'
+                    response.headers['X-Cache'] = 'HIT'
+                else:
+                    with self._lock:
+                        self.stats_counts["misses"] += 1
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+
+                    body = self._stable_body(response.get_data(as_text=True))
+                    entry = {
+                        "body": body,
+                        "status": response.status_code,
+                        "etag": hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+                    }
+                    # ビュー自身の書き込み（スクレイピング結果の保存など）を反映した世代で保存
+                    self._set(self._key(tables), entry, ttl)
+                    response.headers['X-Cache'] = 'MISS'
+
+                response.set_etag(entry["etag"], weak=self.volatile_fields is not None)
+                response.headers['Cache-Control'] = 'no-cache'
+                response = response.make_conditional(request)
+                if response.status_code == 304:
+                    with self._lock:
+                        self.stats_counts["not_modified"] += 1
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        """システムステータス用"""
+        with self._lock:
+            counts = dict(self.stats_counts)
+            size = len(self._entries)
+        lookups = counts["hits"] + counts["misses"]
+        return dict(
+            counts,
+            backend="redis" if self.redis_client is not None else "memory",
+            local_size=size,
+            max_size=self.max_size,
+            default_ttl=self.default_ttl,
+            hit_rate=round(counts["hits"] / lookups, 4) if lookups else 0.0
+        )
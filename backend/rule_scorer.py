@@ -0,0 +1,188 @@
+"""
+ルールベースの選手評価（テーブル駆動・ベクトル化）
+- get_comprehensive_prediction の評価点（9項目の加点）を、事前に作った参照テーブルと
+  (選手数,) の属性配列に対する NumPy 演算で計算する
+- 1日分の全レースの選手をまとめて1回で評価できる（相手関係の集計はレース番号ごとの bincount）
+- 評価点は従来の選手ごとのループ（クラス・年齢・体重・艇番・登録番号・会場・気象・モーター）と同じ
+  （モーター評価だけは乱数のため、motor_scores を渡した場合に一致）に、
+  会場ナレッジのコース別1着率による補正を加えたもの（実績のない会場は全国平均の目安と同じで補正なし）
+- レースに seed を付けるとモーター評価の抽選がそのレースだけで決まり、同じ入力なら常に同じ評価点になる
+"""
+
+import numpy as np
+
+from venue_knowledge import DEFAULT_COURSE_WIN_RATES, N_COURSES
+
+# クラスの並び（それ以外のクラスは OTHER_CLASS、クラス未設定は B2 扱い）
+CLASS_CODES = ("A1", "A2", "B1", "B2")
+OTHER_CLASS = len(CLASS_CODES)
+_CLASS_INDEX = {code: i for i, code in enumerate(CLASS_CODES)}
+
+# ===== クラス別の参照テーブル（A1, A2, B1, B2, その他） =====
+CLASS_SCORES = np.array([40, 30, 20, 10, 10])               # 1. 基本能力
+MOTOR_SCORE_RANGES = np.array([[7, 10], [5, 8], [3, 6], [1, 4], [3, 3]])  # 5. モーター（乱数の下限・上限）
+FORM_CLASS_BONUS = np.array([3, 2, 0, 0, 0])                # 6. 調子（クラス別安定度）
+RECENT_CLASS_BONUS = np.array([2, 0, 0, -1, 0])             # 7. 前走成績（クラスによる補正）
+START_CLASS_BONUS = np.array([4, 2, 1, 0, 0])               # 8. スタート技術
+
+# 3. コース別の基本点（艇番 1-6、それ以外は3点）
+COURSE_BASE_SCORES = np.array([3, 25, 18, 12, 8, 5, 3])
+
+# 7. 登録番号の末尾数字（0-9）による前走成績の加点
+RECENT_DIGIT_SCORES = np.array([-2, 8, 8, 5, 5, 5, 2, 2, -2, -2])
+
+STRONG_WINDS = ("強風", "中風")
+
+# 3. 会場のコース別1着率が全国平均の目安から1ポイント（0.01）離れるごとの加点（0.1 で5点）
+COURSE_WIN_RATE_SCALE = 50
+
+
+def _parse_weight(weight):
+    """'52.0kg' 形式の体重（文字列以外・解釈できない値は NaN）"""
+    try:
+        return float(weight.replace("kg", ""))
+    except Exception:
+        return np.nan
+
+
+def _registration_digit(registration_number):
+    """登録番号の末尾数字（取れなければ -1）"""
+    try:
+        return int(registration_number[-1])
+    except Exception:
+        return -1
+
+
+def encode_racers(racers_data):
+    """選手の辞書のリストを属性配列に変換"""
+    return {
+        "class_index": np.array([_CLASS_INDEX.get(r.get("class", "B2"), OTHER_CLASS) for r in racers_data],
+                                dtype=np.int64),
+        "age": np.array([r.get("age", 30) for r in racers_data], dtype=np.float64),
+        "weight": np.array([_parse_weight(r.get("weight", "55.0kg")) for r in racers_data], dtype=np.float64),
+        "boat_number": np.array([r.get("boat_number", 1) for r in racers_data], dtype=np.int64),
+        "registration_digit": np.array([_registration_digit(r.get("registration_number", "4000"))
+                                        for r in racers_data], dtype=np.int64),
+    }
+
+
+def draw_motor_scores(class_index, rng=None):
+    """クラス別の範囲からモーター評価を抽選"""
+    rng = rng if rng is not None else np.random.default_rng()
+    ranges = MOTOR_SCORE_RANGES[class_index]
+    return rng.integers(ranges[:, 0], ranges[:, 1] + 1)
+
+
+def score_racers(attrs, race_index, inner_advantage, strong_wind, wave_height, motor_scores, course_win_rates=None):
+    """
+    評価点の計算（全項目を配列で）
+    - attrs: encode_racers の結果（全レースの選手を連結したもの）
+    - race_index: (n,) 各選手のレース番号（0始まり）
+    - inner_advantage / strong_wind / wave_height: (レース数,) 会場・気象
+    - motor_scores: (n,) モーター評価
+    - course_win_rates: (レース数, 6) 会場のコース別1着率（省略時は補正なし）
+    - 戻り値: 項目ごとの点と合計 "total" の辞書
+    """
+    class_index = attrs["class_index"]
+    age = attrs["age"]
+    weight = attrs["weight"]
+    boat = attrs["boat_number"]
+    digit = attrs["registration_digit"]
+    race_index = np.asarray(race_index)
+    inner = np.asarray(inner_advantage, dtype=np.float64)[race_index]
+    windy = np.asarray(strong_wind, dtype=bool)[race_index]
+    waves = np.asarray(wave_height, dtype=np.float64)[race_index]
+
+    prime = (age >= 25) & (age <= 32)
+    stable = (age >= 22) & (age <= 38)
+    is_a1 = class_index == 0
+    is_b2 = class_index == 3
+    inner_boat = boat == 1
+    outer_boat = boat >= 5
+
+    # 2. 年齢・体重（体重が解釈できなければ5点）
+    age_score = np.select([prime, stable], [20, 15], 10)
+    weight_score = np.select([weight < 50, weight < 52], [10, 8], 5)
+
+    # 3. コース（会場のイン有利度で補正）
+    course = np.where((boat >= 1) & (boat <= 6), COURSE_BASE_SCORES[np.clip(boat, 0, 6)], 3)
+    course = course + np.select([(inner > 0.8) & inner_boat, (inner < 0.7) & (boat >= 4)], [5, 3], 0)
+    # 会場のコース別1着率（その艇番のコースが全国平均よりどれだけ勝っているか）
+    if course_win_rates is not None:
+        lane = np.clip(boat, 1, N_COURSES) - 1
+        rates = np.asarray(course_win_rates, dtype=np.float64)[race_index, lane]
+        course_bonus = np.rint(COURSE_WIN_RATE_SCALE * (rates - DEFAULT_COURSE_WIN_RATES[lane])).astype(np.int64)
+        course = course + np.where((boat >= 1) & (boat <= N_COURSES), course_bonus, 0)
+
+    # 4. 気象適性
+    weather = 10 + np.where(windy, np.select([inner_boat, outer_boat], [3, -2], 0), 0)
+    weather = np.maximum(0, weather - np.where((waves >= 2) & (weight < 50), 2, 0))
+
+    # 6. 調子（年齢・クラス・体重）
+    form = 10 + np.select([prime, stable, age > 45], [5, 3, -2], 0) + FORM_CLASS_BONUS[class_index]
+    form = form + np.select([(weight >= 48) & (weight <= 52), weight > 56], [2, -1], 0)
+    form = np.clip(form, 0, 15)
+
+    # 7. 前走成績（登録番号が取れなければ10点のまま）
+    recent = np.where(digit >= 0, 10 + RECENT_DIGIT_SCORES[np.clip(digit, 0, 9)] + RECENT_CLASS_BONUS[class_index], 10)
+    recent = np.clip(recent, 0, 20)
+
+    # 8. スタート
+    start = np.clip(5 + START_CLASS_BONUS[class_index] + np.select([inner_boat, outer_boat], [1, -1], 0), 0, 10)
+
+    # 9. 相手関係（同じレースの自分以外のA1の数）
+    a1_per_race = np.bincount(race_index, weights=is_a1, minlength=len(inner_advantage))
+    opponent_a1 = a1_per_race[race_index] - is_a1
+    situation = 3 + np.select([is_a1 & (opponent_a1 <= 1), is_b2 & (opponent_a1 >= 3)], [2, -1], 0)
+    situation = np.clip(situation, 0, 5)
+
+    components = {
+        "class_ability": CLASS_SCORES[class_index],
+        "physical": age_score + weight_score,
+        "course": course,
+        "weather": weather,
+        "motor": np.asarray(motor_scores),
+        "form": form,
+        "recent": recent,
+        "start": start,
+        "situation": situation,
+    }
+    total = 50 + sum(components.values())
+    return dict(components, total=total.astype(np.int64))
+
+
+def score_races(races, rng=None):
+    """
+    複数レースの評価点を1回で計算
+    - races: [{"racers": 選手のリスト, "venue": 会場特性, "weather": 気象条件, "motor_scores": 省略可, "seed": 省略可}]
+    - motor_scores がなければ seed（なければ rng）でモーター評価を抽選
+    - 戻り値: レースごとの評価点の配列のリスト（選手の並びは入力どおり）
+    """
+    counts = [len(race["racers"]) for race in races]
+    racers = [racer for race in races for racer in race["racers"]]
+    if not racers:
+        return [np.zeros(0, dtype=np.int64) for _ in races]
+
+    attrs = encode_racers(racers)
+    race_index = np.repeat(np.arange(len(races)), counts)
+
+    motor_scores = draw_motor_scores(attrs["class_index"], rng)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    for i, race in enumerate(races):
+        if race.get("motor_scores") is not None:
+            motor_scores[offsets[i]:offsets[i + 1]] = race["motor_scores"]
+        elif race.get("seed") is not None:
+            motor_scores[offsets[i]:offsets[i + 1]] = draw_motor_scores(
+                attrs["class_index"][offsets[i]:offsets[i + 1]], np.random.default_rng(race["seed"])
+            )
+
+    totals = score_racers(
+        attrs,
+        race_index,
+        inner_advantage=[race["venue"]["inner_advantage"] for race in races],
+        strong_wind=[race["weather"]["wind_strength"] in STRONG_WINDS for race in races],
+        wave_height=[race["weather"]["wave_height"] for race in races],
+        motor_scores=motor_scores,
+        course_win_rates=[race["venue"].get("course_win_rates", DEFAULT_COURSE_WIN_RATES) for race in races]
+    )["total"]
+    return np.split(totals, offsets[1:-1])
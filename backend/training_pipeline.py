@@ -0,0 +1,308 @@
+"""
+ストリーミング学習パイプライン
+- レース単位で特徴量を生成し、全件をPythonのリストに溜めずに処理
+- 1パス目: 生の特徴量を列指向アーカイブ（追記型バイナリ）に書き出しつつ、
+  StandardScaler を partial_fit で全学習データに適合
+- 2パス目以降: アーカイブを memmap で読み、tf.data でバッチ供給
+- メモリ使用量はチャンクサイズで決まり、履歴の期間には依存しない
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import zlib
+
+import numpy as np
+
+from feature_schema import N_RACER_FEATURES, N_WATER_FEATURES
+
+logger = logging.getLogger("BoatraceAI")
+
+
+def is_validation_race(race_id, validation_ratio):
+    """レースIDから決まる検証用フラグ（同じレースの選手は同じ側に入る）"""
+    return (zlib.crc32(str(race_id).encode("utf-8")) % 1000) < validation_ratio * 1000
+
+
+class DictRaceSource:
+    """既存の train_data 形式 {race_id: {"features": ..., "results": ...}} のレース供給"""
+
+    def __init__(self, train_data):
+        self.train_data = train_data
+
+    def __iter__(self):
+        for race_id, race_data in self.train_data.items():
+            yield race_id, race_data["features"], race_data["results"]
+
+
+class DatabaseRaceSource:
+    """
+    DBからのレース供給
+    - race_results にあるレースを日付順に1件ずつ読み出す
+    - 特徴量は BoatRaceFeatureExtractor.get_race_features で都度生成
+    """
+
+    def __init__(self, db_path, feature_extractor, race_ids=None, start_date=None, end_date=None):
+        self.db_path = db_path
+        self.feature_extractor = feature_extractor
+        self.race_ids = race_ids
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def _iter_race_ids(self):
+        if self.race_ids is not None:
+            yield from self.race_ids
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT DISTINCT race_id, race_date
+        FROM race_results
+        WHERE race_date >= ? AND race_date <= ?
+        ORDER BY race_date, race_id
+        ''', (self.start_date or "00000000", self.end_date or "99999999"))
+        for row in cursor:
+            yield row[0]
+        conn.close()
+
+    def _get_results(self, race_id):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT boat_number, rank FROM race_results WHERE race_id = ?
+        ''', (race_id,))
+        results = [{"boat_number": row[0], "rank": row[1]} for row in cursor.fetchall()]
+        conn.close()
+        return results
+
+    def __iter__(self):
+        for race_id in self._iter_race_ids():
+            race_features = self.feature_extractor.get_race_features(race_id)
+            results = self._get_results(race_id)
+            if race_features and results:
+                yield race_id, race_features, results
+
+
+class FeatureArchive:
+    """
+    列指向の学習データアーカイブ
+    - racers.f32 (n, N_RACER_FEATURES) / water.f32 (n, 6) / labels.u8 (n,) / validation.u8 (n,)
+    - 追記で書き込み、np.memmap で読み出す
+    """
+
+    COLUMNS = {
+        "racers": (np.float32, N_RACER_FEATURES),
+        "water": (np.float32, N_WATER_FEATURES),
+        "labels": (np.uint8, None),
+        "validation": (np.uint8, None),
+    }
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._handles = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def open_writer(self):
+        """書き込み開始（既存の内容は破棄）"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._handles = {name: open(self._path(name), "wb") for name in self.COLUMNS}
+        return self
+
+    def append(self, racers, water, labels, validation):
+        """行を追記"""
+        columns = {"racers": racers, "water": water, "labels": labels, "validation": validation}
+        for name, (dtype, _) in self.COLUMNS.items():
+            self._handles[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+    def close(self, metadata=None):
+        """書き込み終了"""
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = None
+        with open(os.path.join(self.directory, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(metadata or {}, rows=len(self)), f, ensure_ascii=False, indent=2)
+
+    def metadata(self):
+        path = os.path.join(self.directory, "metadata.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def __len__(self):
+        path = self._path("labels")
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def size_bytes(self):
+        """列ファイルの合計サイズ（バイト）"""
+        return sum(os.path.getsize(self._path(name)) for name in self.COLUMNS if os.path.exists(self._path(name)))
+
+    def fingerprint(self):
+        """内容が変わったかを判定する値（行数・スキーマ・列ファイルのサイズと更新時刻から決まる）"""
+        columns = {}
+        for name in self.COLUMNS:
+            path = self._path(name)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                columns[name] = [stat.st_size, stat.st_mtime_ns]
+        payload = {
+            "rows": len(self),
+            "schema_version": self.metadata().get("schema", {}).get("schema_version"),
+            "columns": columns,
+        }
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+    def column(self, name):
+        """列を memmap で取得"""
+        dtype, width = self.COLUMNS[name]
+        rows = len(self)
+        shape = (rows, width) if width else (rows,)
+        if rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode="r", shape=shape)
+
+
+class StreamingTrainingPipeline:
+    """
+    ストリーミング学習パイプライン
+    - build_archive: レースを1件ずつ特徴量化してアーカイブ化 + スケーラー適合
+    - datasets: アーカイブから学習用・検証用の tf.data.Dataset を作成
+    """
+
+    def __init__(self, prediction_model, batch_size=32, validation_ratio=0.2, chunk_rows=8192, seed=42):
+        self.prediction_model = prediction_model
+        self.batch_size = batch_size
+        self.validation_ratio = validation_ratio
+        self.chunk_rows = chunk_rows
+        self.seed = seed
+
+    def is_validation(self, race_id):
+        """レースIDから決まる検証用フラグ（同じレースの選手は同じ側に入る）"""
+        return is_validation_race(race_id, self.validation_ratio)
+
+    def race_rows(self, race_features, race_results):
+        """1レース分の生特徴量とラベル"""
+        registry = self.prediction_model.feature_registry
+        racer_vectors = registry.racer_vectors(race_features)
+        water_vector = registry.water_vector(race_features)
+        row_by_boat = {
+            racer["position"]["boat_number"]: i for i, racer in enumerate(race_features["racers"])
+        }
+
+        racers, labels = [], []
+        for result in race_results:
+            rank = result["rank"]
+            row = row_by_boat.get(result["boat_number"])
+            # 6位までの順位に制限（失格や欠場は除外）
+            if row is not None and rank is not None and 1 <= rank <= 6:
+                racers.append(racer_vectors[row])
+                labels.append(rank - 1)
+
+        racers = np.array(racers, dtype=np.float64).reshape(-1, N_RACER_FEATURES)
+        water = np.repeat(np.array([water_vector], dtype=np.float64), len(racers), axis=0)
+        return racers, water, np.array(labels, dtype=np.uint8)
+
+    def build_archive(self, source, archive):
+        """レースを順に読み、アーカイブ書き出しとスケーラー適合を同時に行う"""
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        pending = []
+        pending_rows = 0
+        race_count = 0
+
+        archive.open_writer()
+        for race_id, race_features, race_results in source:
+            racers, water, labels = self.race_rows(race_features, race_results)
+            if len(labels) == 0:
+                continue
+
+            validation = np.full(len(labels), self.is_validation(race_id), dtype=np.uint8)
+            archive.append(racers, water, labels, validation)
+            race_count += 1
+
+            # スケーラーは学習側の行だけでチャンク単位に partial_fit
+            train_racers = racers[validation == 0]
+            if len(train_racers):
+                pending.append(train_racers)
+                pending_rows += len(train_racers)
+            if pending_rows >= self.chunk_rows:
+                scaler.partial_fit(np.concatenate(pending))
+                pending, pending_rows = [], 0
+
+        if pending:
+            scaler.partial_fit(np.concatenate(pending))
+
+        archive.close(metadata={
+            "races": race_count,
+            "schema": self.prediction_model.feature_registry.describe(),
+        })
+
+        if not hasattr(scaler, "mean_"):
+            raise ValueError("学習データがありません")
+
+        logger.info(f"学習データアーカイブ作成: {race_count}レース, {len(archive)}行")
+        return scaler
+
+    def iter_batches(self, archive, scaler, validation, shuffle=True, epoch=0):
+        """アーカイブからチャンク単位で読み出してバッチを生成"""
+        racers = archive.column("racers")
+        water = archive.column("water")
+        labels = archive.column("labels")
+        flags = archive.column("validation")
+
+        rng = np.random.default_rng(self.seed + epoch)
+        chunk_starts = np.arange(0, len(archive), self.chunk_rows)
+        if shuffle:
+            rng.shuffle(chunk_starts)
+
+        for start in chunk_starts:
+            stop = min(start + self.chunk_rows, len(archive))
+            indices = np.flatnonzero(flags[start:stop] == int(validation)) + start
+            if shuffle:
+                rng.shuffle(indices)
+
+            for b in range(0, len(indices), self.batch_size):
+                rows = indices[b:b + self.batch_size]
+                batch_racers = scaler.transform(racers[rows]).astype(np.float32)
+                batch_water = np.asarray(water[rows], dtype=np.float32)
+                batch_labels = np.eye(6, dtype=np.float32)[labels[rows]]
+                yield (batch_racers, batch_water), batch_labels
+
+    def count_batches(self, archive, validation):
+        """学習側・検証側の1エポックあたりのバッチ数"""
+        flags = archive.column("validation")
+        batches = 0
+        for start in range(0, len(archive), self.chunk_rows):
+            rows = int(np.count_nonzero(flags[start:start + self.chunk_rows] == int(validation)))
+            batches += -(-rows // self.batch_size)
+        return batches
+
+    def dataset(self, archive, scaler, validation):
+        """tf.data.Dataset（エポックごとにアーカイブを読み直す）"""
+        import tensorflow as tf
+
+        epochs = {"count": 0}
+
+        def generator():
+            epochs["count"] += 1
+            yield from self.iter_batches(
+                archive, scaler, validation,
+                shuffle=not validation, epoch=epochs["count"]
+            )
+
+        output_signature = (
+            (
+                tf.TensorSpec(shape=(None, N_RACER_FEATURES), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, 6), dtype=tf.float32),
+            ),
+            tf.TensorSpec(shape=(None, 6), dtype=tf.float32),
+        )
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=output_signature)
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(self.count_batches(archive, validation)))
+        return dataset.prefetch(2)
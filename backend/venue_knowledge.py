@@ -0,0 +1,268 @@
+"""
+会場ナレッジベース
+- 全国24場の特性（水質・水面の広さ・風の影響など）と、レース結果から集計したコース別1着率を持つ
+- 表は読み込み時に1回だけ組み立てる読み取り専用の辞書（MappingProxyType）で、参照は会場コードで O(1)
+- コース別の出走数・1着数は race_results から配列演算（bincount）で集計し、venue_course_stats テーブルに保存
+  （夜間に refresh で更新。起動時は保存済みの集計から表を作るだけ）
+- イン有利度（inner_advantage）は会場ごとの事前値を、1コースの1着率の実績で補正した値
+    実績値 = 事前値の全場平均 x (その場の1コース1着率 / 全国の1コース1着率)
+    補正後 = (出走数 x 実績値 + PRIOR_STRENGTH x 事前値) / (出走数 + PRIOR_STRENGTH)
+  結果がない会場は事前値のまま
+- コース別1着率（course_win_rates[コース-1]）はルールベース予想のコース評価と、
+  特徴量の venue_stats グループ（feature_schema）の両方が参照する
+"""
+
+import datetime
+import logging
+import sqlite3
+import threading
+from types import MappingProxyType
+
+import numpy as np
+
+logger = logging.getLogger("BoatraceAI")
+
+N_COURSES = 6
+
+# (会場コード, 会場名, 水質, 水面の広さ, イン有利度の事前値, 風の影響, 難易度)
+VENUES = (
+    ('01', '桐生', 'fresh', 'narrow', 0.85, 'high', 'medium'),
+    ('02', '戸田', 'fresh', 'narrow', 0.80, 'medium', 'hard'),
+    ('03', '江戸川', 'tidal', 'wide', 0.60, 'very_high', 'very_hard'),
+    ('04', '平和島', 'sea', 'standard', 0.75, 'high', 'hard'),
+    ('05', '多摩川', 'fresh', 'standard', 0.78, 'medium', 'medium'),
+    ('06', '浜名湖', 'fresh', 'wide', 0.72, 'low', 'easy'),
+    ('07', '蒲郡', 'fresh', 'standard', 0.76, 'medium', 'medium'),
+    ('08', '常滑', 'fresh', 'standard', 0.74, 'medium', 'medium'),
+    ('09', '津', 'fresh', 'standard', 0.77, 'low', 'easy'),
+    ('10', '三国', 'fresh', 'narrow', 0.82, 'high', 'medium'),
+    ('11', 'びわこ', 'fresh', 'wide', 0.71, 'medium', 'medium'),
+    ('12', '住之江', 'fresh', 'wide', 0.70, 'medium', 'medium'),
+    ('13', '尼崎', 'fresh', 'standard', 0.75, 'medium', 'medium'),
+    ('14', '鳴門', 'sea', 'standard', 0.73, 'high', 'hard'),
+    ('15', '丸亀', 'sea', 'standard', 0.74, 'medium', 'medium'),
+    ('16', '児島', 'sea', 'wide', 0.69, 'high', 'hard'),
+    ('17', '宮島', 'sea', 'standard', 0.72, 'high', 'hard'),
+    ('18', '徳山', 'sea', 'standard', 0.76, 'medium', 'medium'),
+    ('19', '下関', 'sea', 'standard', 0.73, 'high', 'hard'),
+    ('20', '若松', 'sea', 'standard', 0.75, 'medium', 'medium'),
+    ('21', '芦屋', 'sea', 'standard', 0.77, 'medium', 'medium'),
+    ('22', '福岡', 'fresh', 'standard', 0.78, 'low', 'easy'),
+    ('23', '唐津', 'sea', 'wide', 0.68, 'very_high', 'very_hard'),
+    ('24', '大村', 'fresh', 'narrow', 0.83, 'low', 'easy'),
+)
+
+VENUE_CODES = tuple(venue[0] for venue in VENUES)
+VENUE_NAMES = MappingProxyType({venue[0]: venue[1] for venue in VENUES})
+DEFAULT_VENUE_CODE = '01'
+
+# 会場名・会場コードのどちらからでも行番号を引く（race_results.venue には会場名が入る）
+_VENUE_INDEX = {key: i for i, venue in enumerate(VENUES) for key in venue[:2]}
+
+# 結果がないときのコース別1着率（全国平均の目安）
+DEFAULT_COURSE_WIN_RATES = np.array([0.55, 0.14, 0.12, 0.11, 0.06, 0.02])
+
+# 事前値の重み（出走数に換算）
+PRIOR_STRENGTH = 200
+
+# 集計に使う期間（日）
+DEFAULT_WINDOW_DAYS = 365
+
+
+def venue_index(venue):
+    """会場コードか会場名から行番号（不明なら None）"""
+    return _VENUE_INDEX.get(venue)
+
+
+def aggregate_course_results(venues, courses, ranks):
+    """
+    コース別の出走数・1着数を集計
+    - venues: 会場名または会場コードの配列 / courses: 進入コース / ranks: 着順
+    - 戻り値: (starts, wins) いずれも (24, 6)
+    """
+    venues = np.asarray(venues, dtype=object)
+    courses = np.asarray(courses, dtype=np.float64)
+    ranks = np.asarray(ranks, dtype=np.float64)
+
+    # 会場の種類は高々数十なので、ユニーク値だけ辞書で引いて行番号に展開
+    unique, inverse = np.unique(venues.astype(str), return_inverse=True)
+    rows = np.array([_VENUE_INDEX.get(value, -1) for value in unique], dtype=np.int64)[inverse]
+
+    valid = (rows >= 0) & (courses >= 1) & (courses <= N_COURSES)
+    cells = rows[valid] * N_COURSES + courses[valid].astype(np.int64) - 1
+    size = len(VENUES) * N_COURSES
+    starts = np.bincount(cells, minlength=size).reshape(len(VENUES), N_COURSES)
+    wins = np.bincount(cells[ranks[valid] == 1], minlength=size).reshape(len(VENUES), N_COURSES)
+    return starts, wins
+
+
+def build_table(starts=None, wins=None, updated_at=None, prior_strength=PRIOR_STRENGTH):
+    """集計値から読み取り専用の会場表 {会場コード: 会場特性} を作成"""
+    if starts is None:
+        starts = np.zeros((len(VENUES), N_COURSES), dtype=np.int64)
+        wins = np.zeros_like(starts)
+    starts = np.asarray(starts, dtype=np.float64)
+    wins = np.asarray(wins, dtype=np.float64)
+
+    total_starts = starts.sum(axis=0)
+    national = np.where(total_starts > 0, wins.sum(axis=0) / np.maximum(total_starts, 1), DEFAULT_COURSE_WIN_RATES)
+
+    # コース別1着率: 全国の率に向けて縮小
+    course_win_rates = (wins + prior_strength * national) / (starts + prior_strength)
+
+    # イン有利度: 1コースの実績で事前値を補正
+    priors = np.array([venue[4] for venue in VENUES])
+    inner_starts = starts[:, 0]
+    observed = priors.mean() * (wins[:, 0] / np.maximum(inner_starts, 1)) / max(national[0], 1e-6)
+    inner_advantage = (inner_starts * observed + prior_strength * priors) / (inner_starts + prior_strength)
+
+    table = {}
+    for i, (code, name, water_type, course_width, prior, wind_effect, difficulty) in enumerate(VENUES):
+        table[code] = MappingProxyType({
+            'code': code,
+            'name': name,
+            'water_type': water_type,
+            'course_width': course_width,
+            'inner_advantage': round(float(inner_advantage[i]), 4),
+            'inner_advantage_prior': prior,
+            'wind_effect': wind_effect,
+            'difficulty': difficulty,
+            'course_win_rates': tuple(round(float(rate), 4) for rate in course_win_rates[i]),
+            'races': int(inner_starts[i]),
+            'updated_at': updated_at,
+        })
+    return MappingProxyType(table)
+
+
+class VenueKnowledgeBase:
+    """
+    会場ナレッジベース
+    - get(venue_code): 会場特性（読み取り専用の辞書）
+    - refresh(): race_results から再集計して保存し、表を丸ごと差し替える
+    """
+
+    def __init__(self, db_path="boatrace_data.db", window_days=DEFAULT_WINDOW_DAYS, prior_strength=PRIOR_STRENGTH):
+        self.db_path = db_path
+        self.window_days = window_days
+        self.prior_strength = prior_strength
+        self._refresh_lock = threading.Lock()
+        self.initialize_database()
+        self._table = self._load()
+
+    def initialize_database(self):
+        """テーブル作成"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS venue_course_stats (
+            venue_code TEXT,
+            course INTEGER,
+            starts INTEGER,
+            wins INTEGER,
+            window_start TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (venue_code, course)
+        )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _load(self):
+        """保存済みの集計から表を作成（集計がなければ事前値のみ）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT venue_code, course, starts, wins, updated_at FROM venue_course_stats')
+        rows = cursor.fetchall()
+        conn.close()
+
+        if not rows:
+            return build_table(prior_strength=self.prior_strength)
+
+        starts = np.zeros((len(VENUES), N_COURSES), dtype=np.int64)
+        wins = np.zeros_like(starts)
+        for venue_code, course, venue_starts, venue_wins, _ in rows:
+            row = venue_index(venue_code)
+            if row is not None and 1 <= course <= N_COURSES:
+                starts[row, course - 1] = venue_starts
+                wins[row, course - 1] = venue_wins
+        updated_at = max(row[4] for row in rows)
+        return build_table(starts, wins, updated_at=updated_at, prior_strength=self.prior_strength)
+
+    def get(self, venue_code):
+        """会場特性（未知の会場コードは桐生）"""
+        return self._table.get(venue_code) or self._table[DEFAULT_VENUE_CODE]
+
+    def name(self, venue_code):
+        """会場名"""
+        return VENUE_NAMES.get(venue_code)
+
+    def _aggregate(self, cursor, as_of=None):
+        """直近 window_days 日分（as_of の前日まで）の (starts, wins, 件数, 集計開始日)"""
+        end = datetime.datetime.strptime(as_of, "%Y%m%d") if as_of else datetime.datetime.now()
+        window_start = (end - datetime.timedelta(days=self.window_days)).strftime("%Y%m%d")
+        cursor.execute('''
+        SELECT venue, course, rank
+        FROM race_results
+        WHERE race_date >= ? AND race_date < ?
+        ''', (window_start, end.strftime("%Y%m%d")))
+        rows = cursor.fetchall()
+
+        if not rows:
+            starts = np.zeros((len(VENUES), N_COURSES), dtype=np.int64)
+            return starts, np.zeros_like(starts), 0, window_start
+
+        venues, courses, ranks = zip(*rows)
+        starts, wins = aggregate_course_results(
+            venues,
+            [course if course is not None else 0 for course in courses],
+            [rank if rank is not None else 0 for rank in ranks]
+        )
+        return starts, wins, len(rows), window_start
+
+    def table_as_of(self, as_of):
+        """
+        as_of（YYYYMMDD）の前日までの結果だけで作った会場表（保存も差し替えもしない）
+        - バックテストで、その日より後の結果を特徴量に混ぜないために使う
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            starts, wins, _, _ = self._aggregate(conn.cursor(), as_of)
+        finally:
+            conn.close()
+        return build_table(starts, wins, updated_at=as_of, prior_strength=self.prior_strength)
+
+    def refresh(self, as_of=None):
+        """
+        race_results から直近 window_days 日分を再集計して保存し、表を差し替える
+        - as_of: YYYYMMDD（既定は今日）。集計はその前日まで
+        """
+        with self._refresh_lock:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            starts, wins, result_count, window_start = self._aggregate(cursor, as_of)
+
+            updated_at = datetime.datetime.now().isoformat()
+            cursor.execute('DELETE FROM venue_course_stats')
+            cursor.executemany('''
+            INSERT INTO venue_course_stats (venue_code, course, starts, wins, window_start, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (code, course + 1, int(starts[i, course]), int(wins[i, course]), window_start, updated_at)
+                for i, code in enumerate(VENUE_CODES) for course in range(N_COURSES)
+            ])
+            conn.commit()
+            conn.close()
+
+            self._table = build_table(starts, wins, updated_at=updated_at, prior_strength=self.prior_strength)
+
+        logger.info(f"会場ナレッジ更新: {result_count}件の結果（{window_start}〜）")
+        return self.status()
+
+    def status(self):
+        """システムステータス用"""
+        table = self._table
+        return {
+            "updated_at": table[DEFAULT_VENUE_CODE]['updated_at'],
+            "races": sum(venue['races'] for venue in table.values()),
+            "venues_with_results": sum(1 for venue in table.values() if venue['races'] > 0),
+        }
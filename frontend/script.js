@@ -168,11 +168,10 @@ class OptimizedBoatraceAPI {
         return this.request(`/prediction/${raceId}`);
     }
 
-    async updateAIPrediction(racers) {
-        return this.request('/ai-prediction-simple', {
-            method: 'POST',
-            body: JSON.stringify({ racers })
-        });
+    // 会場1日分（1R-12R）の出走表・直前情報・AI予想をまとめて取得（gzip圧縮で1往復）
+    async getVenueDay(venue, date = null) {
+        const params = date ? `?date=${date}` : '';
+        return this.request(`/venue-day/${venue}${params}`);
     }
 
     // 🔴 自動更新機能は完全に削除
@@ -484,6 +483,7 @@ class OptimizedUIManager {
             
             // 選択された会場・レースがある場合は再取得
             if (selectedVenue && selectedRace) {
+                app.venueDays.delete(selectedVenue);
                 await app.loadSelectedRaceData(selectedVenue, selectedRace, 'Selected Venue');
             } else {
                 // 会場一覧を更新
@@ -641,6 +641,7 @@ class OptimizedWavePredictorApp {
         this.api = new OptimizedBoatraceAPI();
         this.ui = new OptimizedUIManager();
         this.isInitialized = false;
+        this.venueDays = new Map(); // 会場コード -> 会場1日分のデータ（出走表・AI予想）
     }
 
     async initialize() {
@@ -713,6 +714,19 @@ class OptimizedWavePredictorApp {
             
             console.log('取得したスケジュールデータ:', scheduleResponse);
             
+            // 保存済みデータがなくサーバーが取得中（202）の場合は手動更新を案内
+            if (scheduleResponse && scheduleResponse.data && scheduleResponse.data.refreshing) {
+                this.ui.elements.venueGrid.innerHTML = `
+                    <div style="grid-column: 1 / -1; text-align:center; padding:40px; color:var(--warning);">
+                        <div style="font-weight:600; margin-bottom:1rem;">スケジュールを取得中です。しばらくしてから手動更新してください</div>
+                        <button class="btn btn-primary" onclick="app.ui.manualRefresh()">
+                            <i class="fas fa-sync-alt"></i> 手動更新
+                        </button>
+                    </div>
+                `;
+                return;
+            }
+            
             if (scheduleResponse && scheduleResponse.data && scheduleResponse.data.venues) {
                 this.ui.elements.venueGrid.innerHTML = '';
                 
@@ -895,12 +909,51 @@ class OptimizedWavePredictorApp {
         this.loadSelectedRaceData(venueCode, raceNumber, venueName);
     }
 
+    async loadVenueDay(venueCode) {
+        // 会場を選んだ後のレース切り替えは通信なし（手動更新で破棄）
+        if (this.venueDays.has(venueCode)) {
+            return this.venueDays.get(venueCode);
+        }
+        
+        const response = await this.api.getVenueDay(venueCode);
+        if (!response || !response.data || !response.data.races) {
+            throw new Error('会場データが見つかりません');
+        }
+        
+        const venueDay = { ...response.data, timestamp: response.timestamp };
+        this.venueDays.set(venueCode, venueDay);
+        return venueDay;
+    }
+
     async loadSelectedRaceData(venueCode, raceNumber, venueName) {
         try {
             this.ui.showLoading(`${venueName} 第${raceNumber}レース 出走表取得中（キャッシュ優先）...`);
             
+            // 会場1日分の一括データに出走表があればそれを表示
+            const venueDay = await this.loadVenueDay(venueCode).catch(error => {
+                console.warn('会場一括データ取得エラー:', error);
+                return null;
+            });
+            const race = venueDay ? venueDay.races.find(r => r.race_number === raceNumber) : null;
+            
+            if (race && race.racers.length > 0) {
+                this.displayRealRacers(race.racers, venueDay.data_source);
+                this.updateRaceInfoFromSelected(venueDay, venueName, raceNumber);
+                this.displayRacePrediction(race);
+                
+                this.ui.elements.predictionContainer.style.display = 'block';
+                this.ui.hideLoading();
+                this.ui.updateStatus('success', '<i class="fas fa-check-circle"></i> 出走表・AI予想取得完了（キャッシュ）');
+                return;
+            }
+            
+            // 一括データにないレースは個別に出走表を取得
             const data = await this.api.getRaceEntries(venueCode, raceNumber);
             
+            if (data && data.data && data.data.refreshing) {
+                throw new Error('出走表を取得中です。しばらくしてから手動更新してください');
+            }
+            
             if (data && data.data && data.data.racer_extraction && data.data.racer_extraction.racers) {
                 this.displayRealRacers(data.data.racer_extraction.racers, data.data.data_source);
                 this.updateRaceInfoFromSelected(data.data, venueName, raceNumber);
@@ -1027,21 +1080,16 @@ class OptimizedWavePredictorApp {
         try {
             console.log('AI予想データ取得開始...');
             
-            // 固定のレースID
-            const today = new Date();
-            const dateStr = today.getFullYear().toString() + 
-                           (today.getMonth() + 1).toString().padStart(2, '0') + 
-                           today.getDate().toString().padStart(2, '0');
-            const raceId = `${dateStr}0101`;
-            
-            const prediction = await this.api.getRacePrediction(raceId);
-            
-            // AI予想結果を表示
-            if (prediction.ai_predictions && prediction.ai_predictions.predictions && prediction.ai_predictions.predictions.length > 0) {
-                this.displayAIPredictionResult(prediction);
+            if (!selectedVenue || !selectedRace) {
+                throw new Error('会場・レースが選択されていません');
             }
             
-            this.ui.updateTimestamp();
+            // 選択中の会場の一括データから取得（取得済みなら通信なし）
+            const venueDay = await this.loadVenueDay(selectedVenue);
+            const race = venueDay.races.find(r => r.race_number === selectedRace);
+            this.displayRacePrediction(race);
+            
+            this.ui.updateTimestamp(venueDay.timestamp);
             console.log('AI予想データ取得完了');
             
         } catch (error) {
@@ -1050,6 +1098,28 @@ class OptimizedWavePredictorApp {
         }
     }
 
+    displayRacePrediction(race) {
+        // ルールベース予想（総合予想）を優先し、なければモデル予想の1着確率順で表示
+        let prediction = race ? race.rule_prediction : null;
+        
+        if (!prediction && race && race.model_prediction && race.model_prediction.predictions) {
+            const predictions = [...race.model_prediction.predictions]
+                .sort((a, b) => a.predicted_rank - b.predicted_rank)
+                .map(p => ({
+                    boat_number: p.boat_number,
+                    predicted_rank: p.predicted_rank,
+                    normalized_probability: p.rank_probabilities[0]
+                }));
+            prediction = { ai_predictions: { predictions } };
+        }
+        
+        if (prediction && prediction.ai_predictions && prediction.ai_predictions.predictions.length > 0) {
+            this.displayAIPredictionResult(prediction);
+        } else {
+            this.displayMockAIPrediction();
+        }
+    }
+
     displayAIPredictionResult(prediction) {
         const topPrediction = prediction.ai_predictions.predictions[0];
         